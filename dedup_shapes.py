@@ -0,0 +1,55 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Remove the shapes of a GTFS feed which duplicate the geometry of another.
+
+The trips of a removed shape use the shape which is kept instead.
+
+For usage information run dedup_shapes.py --help
+"""
+
+import transitfeed
+from transitfeed import util
+
+
+def main():
+    usage = \
+        '''%prog [options] <input GTFS.zip> <output GTFS.zip>
+
+Writes the input feed to the output feed with one shape for each geometry.
+'''
+    parser = util.OptionParserLongError(
+        usage=usage, version='%prog ' + transitfeed.__version__)
+    parser.add_option('-p', '--precision', dest='precision', type='int',
+                      help='Shapes whose coordinates and distances are all '
+                           'within 10^-PRECISION of each other are merged, 5 '
+                           'decimals of a degree are about a metre')
+    parser.add_option('-m', '--memory_db', dest='memory_db', action='store_true',
+                      help='Use in-memory sqlite databases')
+    parser.set_defaults(precision=5, memory_db=False)
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error('You must provide the paths of the input and output feeds.')
+
+    problems = transitfeed.ProblemReporter()
+    schedule = transitfeed.Loader(args[0], loader_problems=problems,
+                                  memory_db=options.memory_db).load()
+    num_shapes = len(schedule.get_shape_list())
+    replaced_ids = transitfeed.dedup_shapes(schedule, options.precision)
+    print('Removed %d of %d shapes' % (len(replaced_ids), num_shapes))
+    schedule.write_google_transit_feed(args[1])
+
+
+if __name__ == '__main__':
+    util.run_with_crash_handler(main)
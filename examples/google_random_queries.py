@@ -171,6 +171,32 @@ def write_output(title, locations, limit, f):
         f.write(output_suffix)
 
 
+def check_random_reachability(schedule, limit, date, f):
+    """Plan journeys between random pairs of stops and write the pairs that
+    can't be reached to f.
+
+    Args:
+      schedule: a transitfeed.Schedule with stop times loaded
+      limit: number of random queries
+      date: a "YYYYMMDD" string, only trips active on it are used
+      f: a file object
+
+    Returns:
+      the number of unreachable pairs
+    """
+    planner = transitfeed.ConnectionScanPlanner(schedule)
+    stop_ids = [s.stop_id for s in schedule.get_stop_list()]
+    unreachable = 0
+    for _ in range(limit):
+        origin, destination = random.choice(stop_ids), random.choice(stop_ids)
+        secs = random.randint(0, 60 * 60 * 24)
+        if planner.get_earliest_arrival(origin, destination, date, secs) is None:
+            unreachable += 1
+            f.write("%s -> %s at %s: unreachable\n" % (
+                origin, destination, transitfeed.format_seconds_since_midnight(secs)))
+    return unreachable
+
+
 def parent_and_base_name(path):
     """Given a path return only the parent name and file name as a string."""
     dirname, basename = os.path.split(path)
@@ -200,7 +226,15 @@ def main():
                       help="Maximum number of URLs to generate")
     parser.add_option("-o", "--output", dest="output", metavar="HTML_OUTPUT_PATH",
                       help="write HTML output to HTML_OUTPUT_PATH")
-    parser.set_defaults(output="google_random_queries.html", limit=50)
+    parser.add_option("--check_reachability", dest="check_reachability",
+                      action="store_true",
+                      help="Instead of writing URLs plan the journeys with the "
+                           "built-in planner and list the unreachable ones")
+    parser.add_option("--date", dest="date", metavar="YYYYMMDD",
+                      help="Date of the journeys planned by --check_reachability, "
+                           "default today")
+    parser.set_defaults(output="google_random_queries.html", limit=50,
+                        check_reachability=False)
     (options, args) = parser.parse_args()
     if len(args) != 1:
         print(parser.format_help(), file=sys.stderr)
@@ -210,8 +244,15 @@ def main():
 
     # ProblemReporter prints problems on console.
     loader = transitfeed.Loader(feed_path, loader_problems=transitfeed.ProblemReporter(),
-                                load_stop_times=False)
+                                load_stop_times=options.check_reachability)
     schedule = loader.load()
+    if options.check_reachability:
+        date = options.date or datetime.today().strftime("%Y%m%d")
+        unreachable = check_random_reachability(schedule, options.limit, date,
+                                                sys.stdout)
+        print("%d of %d random journeys are unreachable" %
+              (unreachable, options.limit))
+        sys.exit(unreachable and 1 or 0)
     locations = get_random_locations_near_stops(schedule)
     random.shuffle(locations)
     agencies = ", ".join([a.agency_name for a in schedule.get_agency_list()])
@@ -0,0 +1,72 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Show what changed between two versions of a GTFS feed.
+
+The added, removed and modified entities are written as JSON and counted in a
+summary. Either version can be a database written by a previous run with
+--save_store, which loads much faster than the feed.
+
+For usage information run feed_diff.py --help
+"""
+
+import json
+
+import transitfeed
+from transitfeed import util
+
+
+def main():
+    usage = \
+        '''%prog [options] <old GTFS.zip or store> <new GTFS.zip or store>
+
+Prints the number of added, removed, modified and unchanged entities of each
+type from the old to the new version of a feed.
+'''
+    parser = util.OptionParserLongError(
+        usage=usage, version='%prog ' + transitfeed.__version__)
+    parser.add_option('-o', '--output', dest='output', metavar='FILE',
+                      help='Write the changes to FILE as JSON')
+    parser.add_option('-s', '--save_store', dest='save_store', metavar='FILE',
+                      help='Save the new version to the database FILE, to be '
+                           'the old version of the next diff')
+    parser.add_option('-m', '--memory_db', dest='memory_db', action='store_true',
+                      help='Use in-memory sqlite databases')
+    parser.set_defaults(memory_db=False)
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error('You must provide the paths of the old and new feeds.')
+
+    problems = transitfeed.ProblemReporter()
+    old_schedule = transitfeed.load_feed_version(args[0], problems,
+                                                 options.memory_db)
+    new_schedule = transitfeed.load_feed_version(args[1], problems,
+                                                 options.memory_db)
+    changeset = transitfeed.diff_schedules(old_schedule, new_schedule)
+    print('%-16s %8s %8s %8s %10s' % ('', 'added', 'removed', 'modified',
+                                     'unchanged'))
+    for section in transitfeed.CHANGESET_SECTIONS:
+        counts = changeset['summary'][section]
+        print('%-16s %8d %8d %8d %10d' % (
+            section, counts['added'], counts['removed'], counts['modified'],
+            counts['unchanged']))
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(changeset, output_file, indent=1, sort_keys=True)
+    if options.save_store:
+        new_schedule.export_sqlite(options.save_store)
+
+
+if __name__ == '__main__':
+    util.run_with_crash_handler(main)
@@ -536,10 +536,20 @@ class KMLWriter:
             if self.date_filter and not trip.service_period.is_active_on(self.date_filter):
                 continue
 
+            descriptions = []
             if trip.trip_headsign:
-                description = 'Headsign: %s' % trip.trip_headsign
-            else:
-                description = None
+                descriptions.append('Headsign: %s' % trip.trip_headsign)
+            # The runs of a frequency-based trip are counted instead of drawn,
+            # since a short headway has hundreds of them
+            run_count = trip.get_frequency_run_count()
+            if run_count:
+                descriptions.append('Runs: %d (%s)' % (run_count, ', '.join(
+                    '%s-%s every %ds' % (
+                        transitfeed.format_seconds_since_midnight(freq_tuple[0]),
+                        transitfeed.format_seconds_since_midnight(freq_tuple[1]),
+                        freq_tuple[2])
+                    for freq_tuple in trip.get_frequency_tuples())))
+            description = '<br/>'.join(descriptions) or None
 
             coordinate_list = []
             for secs, stoptime, tp in trip.get_time_interpolated_stops():
@@ -24,6 +24,7 @@
 from __future__ import print_function
 import schedule_viewer
 import transitfeed
+import zipfile
 
 
 class LocationEditorRequestHandler(schedule_viewer.ScheduleRequestHandler):
@@ -48,7 +49,11 @@ class LocationEditorRequestHandler(schedule_viewer.ScheduleRequestHandler):
         if not self.server.feed_path:
             msg = 'Feed path not defined'
         else:
-            schedule.write_google_transit_feed(self.server.feed_path)
+            # Only the changed tables are rewritten when the feed is a zip
+            base = None
+            if zipfile.is_zipfile(self.server.feed_path):
+                base = self.server.feed_path
+            schedule.write_google_transit_feed(self.server.feed_path, base=base)
             msg = 'Data saved to ' + self.server.feed_path
         print(msg)
         return msg
@@ -39,9 +39,15 @@ Run merge.py --help for a list of the possible options.
 __author__ = 'timothy.stranex@gmail.com (Timothy Stranex)'
 
 import datetime
+import difflib
+import hashlib
+import itertools
+import multiprocessing
 import os
 import re
+import shutil
 import sys
+import tempfile
 import time
 import transitfeed
 from transitfeed import util
@@ -124,6 +130,17 @@ class CalendarsNotDisjoint(MergeProblemWithContext):
                   "disjoint.")
 
 
+class CalendarsTruncated(MergeProblemWithContext):
+    ERROR_TEXT = ("%(count)d service periods of the %(feed_name)s feed lost "
+                  "active dates at the cutoff date: %(service_ids)s")
+
+
+class CalendarsRemoved(MergeProblemWithContext):
+    ERROR_TEXT = ("%(count)d service periods of the %(feed_name)s feed have no "
+                  "active dates left at the cutoff date and were removed with "
+                  "their trips: %(service_ids)s")
+
+
 class MergeNotImplemented(MergeProblemWithContext):
     ERROR_TEXT = ("The feed merger does not currently support merging in this "
                   "file. The entries have been duplicated instead.")
@@ -148,6 +165,25 @@ class MergeProblemReporter(transitfeed.ProblemReporter):
         self.add_to_accumulator(
             CalendarsNotDisjoint(dataset, problem_type=transitfeed.TYPE_ERROR))
 
+    @staticmethod
+    def _list_ids(service_ids):
+        listed_ids = ', '.join(service_ids[:10])
+        if len(service_ids) > 10:
+            listed_ids += ', ...'
+        return listed_ids
+
+    def calendars_truncated(self, dataset, feed_name, service_ids):
+        self.add_to_accumulator(
+            CalendarsTruncated(dataset, problem_type=transitfeed.TYPE_NOTICE,
+                               feed_name=feed_name, count=len(service_ids),
+                               service_ids=self._list_ids(service_ids)))
+
+    def calendars_removed(self, dataset, feed_name, service_ids):
+        self.add_to_accumulator(
+            CalendarsRemoved(dataset, problem_type=transitfeed.TYPE_NOTICE,
+                             feed_name=feed_name, count=len(service_ids),
+                             service_ids=self._list_ids(service_ids)))
+
     def merge_not_implemented(self, dataset):
         self.add_to_accumulator(MergeNotImplemented(dataset))
 
@@ -192,19 +228,26 @@ class HTMLProblemAccumulator(transitfeed.ProblemAccumulatorInterface):
         Generate an HTML table of merge statistics.
 
         Args:
-          feed_merger: The FeedMerger instance.
+          feed_merger: The FeedMerger instance, or a list of them whose
+                       statistics are added up.
 
         Returns:
           The generated HTML as a string.
         """
+        if isinstance(feed_merger, FeedMerger):
+            feed_mergers = [feed_merger]
+        else:
+            feed_mergers = feed_merger
         rows = ['<tr><th class="header"/><th class="header">Merged</th>'
                 '<th class="header">Copied from old feed</th>'
                 '<th class="header">Copied from new feed</th></tr>']
-        for merger in feed_merger.get_merger_list():
-            stats = merger.get_merge_stats()
-            if stats is None:
+        for mergers in zip(*[f.get_merger_list() for f in feed_mergers]):
+            merger = mergers[0]
+            all_stats = [m.get_merge_stats() for m in mergers]
+            if None in all_stats:
                 continue
-            merged, not_merged_a, not_merged_b = stats
+            merged, not_merged_a, not_merged_b = [sum(s) for s in
+                                                  zip(*all_stats)]
             rows.append('<tr><th class="header">%s</th>'
                         '<td class="header">%d</td>'
                         '<td class="header">%d</td>'
@@ -283,7 +326,8 @@ class HTMLProblemAccumulator(transitfeed.ProblemAccumulatorInterface):
 
         Args:
           output_file: The file object that the HTML output will be written to.
-          feed_merger: The FeedMerger instance.
+          feed_merger: The FeedMerger instance, or the list of them of
+                       merge_schedule_list.
           old_feed_path: The path to the old feed file as a string.
           new_feed_path: The path to the new feed file as a string
           merged_feed_path: The path to the merged feed file as a string. This
@@ -347,8 +391,9 @@ Generated using transitfeed version %s on %s.
         output_file.write(html_footer)
 
 
-def load_without_errors(path, memory_db):
-    """"Return a Schedule object loaded from path; sys.exit for any error."""
+def _load_feed(path, memory_db):
+    """Return (a Schedule object loaded from path, None), or (None, an error
+    message) if there was an error."""
     accumulator = transitfeed.ExceptionProblemAccumulator()
     loading_problem_handler = MergeProblemReporter(accumulator)
     try:
@@ -357,14 +402,80 @@ def load_without_errors(path, memory_db):
                                       loader_problems=loading_problem_handler,
                                       extra_validation=True).load()
     except transitfeed.ExceptionWithContext as e:
-        print((
+        return None, (
                 "\n\nFeeds to merge must load without any errors.\n"
                 "While loading %s the following error was found:\n%s\n%s\n" %
-                (path, e.format_context(), str(e))), file=sys.stderr)
+                (path, e.format_context(), str(e)))
+    return schedule, None
+
+
+def load_without_errors(path, memory_db):
+    """"Return a Schedule object loaded from path; sys.exit for any error."""
+    schedule, error = _load_feed(path, memory_db)
+    if error is not None:
+        print(error, file=sys.stderr)
         sys.exit(1)
     return schedule
 
 
+def _load_and_export_sqlite(task):
+    """Load a feed and write it to a database with export_sqlite. Runs in a
+    worker process of load_all_without_errors.
+
+    Args:
+      task: A tuple (feed path, memory_db, database path).
+
+    Returns:
+      None, or the error message if there was an error.
+    """
+    path, memory_db, db_path = task
+    schedule, error = _load_feed(path, memory_db)
+    if schedule is not None:
+        schedule.export_sqlite(db_path)
+    return error
+
+
+def load_all_without_errors(paths, memory_db, processes=None):
+    """Return a list of the Schedule objects loaded from paths; sys.exit for
+    any error.
+
+    The feeds are loaded and validated at the same time in worker processes.
+    A Schedule can't be passed between processes, so each worker writes its
+    schedule to a database with export_sqlite, which is read back here with
+    load_sqlite without validating it again.
+
+    Args:
+      paths: The paths of the feeds.
+      memory_db: Use in-memory sqlite databases.
+      processes: The number of worker processes, by default one per feed. With
+                 1 the feeds are loaded one after the other in this process.
+    """
+    if processes is None:
+        processes = len(paths)
+    if processes == 1 or len(paths) < 2:
+        return [load_without_errors(path, memory_db) for path in paths]
+    temp_dir = tempfile.mkdtemp()
+    try:
+        tasks = [(path, memory_db, os.path.join(temp_dir, '%d.db' % i))
+                 for i, path in enumerate(paths)]
+        pool = multiprocessing.Pool(min(processes, len(paths)))
+        try:
+            errors = pool.map(_load_and_export_sqlite, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        for error in errors:
+            if error is not None:
+                print(error, file=sys.stderr)
+                sys.exit(1)
+        return [transitfeed.load_sqlite(
+            db_path, problems=MergeProblemReporter(
+                transitfeed.ExceptionProblemAccumulator()),
+            memory_db=memory_db) for _, _, db_path in tasks]
+    finally:
+        shutil.rmtree(temp_dir)
+
+
 class DataSetMerger:
 
     """A DataSetMerger is in charge of merging a set of entities.
@@ -693,6 +804,23 @@ class DataSetMerger:
         """
         raise NotImplementedError()
 
+    def _get_migrated_id(self, entity_id, schedule, new_id):
+        """Returns the id of an entity of schedule migrated to the merged
+        schedule.
+
+        Args:
+          entity_id: The id of the entity.
+          schedule: The schedule from the FeedMerger that contains the entity.
+          new_id: Whether to generate a new id (True) or keep the original
+                  (False).
+
+        Returns:
+          The id with the id prefix of schedule, see FeedMerger.
+        """
+        if new_id:
+            entity_id = self.feed_merger.generate_id(entity_id)
+        return self.feed_merger.add_id_prefix(schedule, entity_id)
+
     def _has_id(self, schedule, entity_id):
         """Check if the schedule has an entity with the given id.
 
@@ -871,8 +999,7 @@ class AgencyMerger(DataSetMerger):
 
     def _migrate(self, entity, schedule, new_id):
         a = transitfeed.Agency(field_dict=entity)
-        if new_id:
-            a.agency_id = self.feed_merger.generate_id(entity.agency_id)
+        a.agency_id = self._get_migrated_id(entity.agency_id, schedule, new_id)
         return a
 
     def _add(self, a, b, migrated):
@@ -893,6 +1020,10 @@ class StopMerger(DataSetMerger):
     Attributes:
       largest_stop_distance: The largest distance allowed between stops that
         will be merged in metres.
+      match_different_ids: If True, stops are merged by location and name
+        instead of by stop_id, for feeds with independent id schemes.
+      min_name_similarity: The smallest similarity between the names of stops
+        merged by location, from 0 to 1 as computed by difflib.
     """
 
     ENTITY_TYPE_NAME = 'stop'
@@ -900,6 +1031,8 @@ class StopMerger(DataSetMerger):
     DATASET_NAME = 'Stops'
 
     largest_stop_distance = 10.0
+    match_different_ids = False
+    min_name_similarity = 0.8
 
     def __init__(self, feed_merger):
         DataSetMerger.__init__(self, feed_merger)
@@ -911,6 +1044,14 @@ class StopMerger(DataSetMerger):
         """Sets largest_stop_distance."""
         self.largest_stop_distance = distance
 
+    def set_match_different_ids(self, match_different_ids):
+        """Sets match_different_ids."""
+        self.match_different_ids = match_different_ids
+
+    def set_min_name_similarity(self, similarity):
+        """Sets min_name_similarity."""
+        self.min_name_similarity = similarity
+
     def _get_iter(self, schedule):
         return schedule.get_stop_list()
 
@@ -949,14 +1090,110 @@ class StopMerger(DataSetMerger):
                   'location_type': self._merge_identical}
         return self._schemed_merge(scheme, a, b)
 
+    def _merge_nearby_entities(self, a, b):
+        """Merges two stops with possibly different stop_ids and names.
+
+        The stops must have the same zone_id and location_type. The merged stop
+        has the stop_id and the other attributes of the new stop.
+
+        Raises:
+          MergeError: The stops could not be merged.
+        """
+        scheme = {'zone_id': self._merge_identical,
+                  'location_type': self._merge_identical}
+        return self._schemed_merge(scheme, a, b)
+
+    def _match_nearby_stops(self, a_stops, b_stops):
+        """Finds the stops of b_stops to merge with those of a_stops.
+
+        The stops of b_stops are put in a GridIndex so that each stop of a_stops
+        is only compared with those within largest_stop_distance of it, instead
+        of with every stop. The candidate pairs whose names are at least
+        min_name_similarity alike are then assigned greedily, from the most
+        similar names and the closest stops, each stop being merged at most
+        once.
+
+        Args:
+          a_stops: The stops of the old schedule.
+          b_stops: The stops of the new schedule.
+
+        Returns:
+          A list of (old stop, new stop, merged stop) tuples.
+        """
+        index = transitfeed.GridIndex(max(self.largest_stop_distance, 1.0))
+        index.add_stops(b_stops)
+        candidates = []
+        for a_number, a in enumerate(a_stops):
+            if a.stop_lat is None or a.stop_lon is None:
+                continue
+            a_name = (a.stop_name or '').lower()
+            for distance, b in index.get_nearby(a.stop_lat, a.stop_lon,
+                                                self.largest_stop_distance):
+                matcher = difflib.SequenceMatcher(None, a_name,
+                                                  (b.stop_name or '').lower())
+                # quick_ratio is an upper bound of ratio
+                if matcher.quick_ratio() < self.min_name_similarity:
+                    continue
+                similarity = matcher.ratio()
+                if similarity >= self.min_name_similarity:
+                    candidates.append((-similarity, distance, a_number, a, b))
+        candidates.sort(key=lambda c: c[:3])
+
+        matches = []
+        matched_a = set()
+        matched_b = set()
+        for _, _, _, a, b in candidates:
+            if a.stop_id in matched_a or b.stop_id in matched_b:
+                continue
+            try:
+                merged_stop = self._merge_nearby_entities(a, b)
+            except MergeError:
+                continue
+            matched_a.add(a.stop_id)
+            matched_b.add(b.stop_id)
+            matches.append((a, b, merged_stop))
+        return matches
+
+    def _merge_nearby(self):
+        """Merges the stops matched by _match_nearby_stops and migrates the
+        others.
+
+        Returns:
+          The number of merged stops.
+        """
+        fm = self.feed_merger
+        a_stops = fm.a_schedule.get_stop_list()
+        b_stops = fm.b_schedule.get_stop_list()
+        matches = self._match_nearby_stops(a_stops, b_stops)
+        for a, b, merged_stop in matches:
+            self._add(a, b, merged_stop)
+        self._num_merged = len(matches)
+
+        matched_a = set(a.stop_id for a, _, _ in matches)
+        matched_b = set(b.stop_id for _, b, _ in matches)
+        # The merged stops have the stop_ids of the new schedule
+        for a in a_stops:
+            if a.stop_id not in matched_a:
+                self._num_not_merged_a += 1
+                new_id = self._has_id(fm.b_schedule, a.stop_id)
+                self._add(a, None, self._migrate(a, fm.a_schedule, new_id))
+        for b in b_stops:
+            if b.stop_id not in matched_b:
+                self._num_not_merged_b += 1
+                new_id = self._has_id(fm.a_schedule, b.stop_id)
+                self._add(None, b, self._migrate(b, fm.b_schedule, new_id))
+        return self._num_merged
+
     def _migrate(self, entity, schedule, new_id):
         migrated_stop = transitfeed.Stop(field_dict=entity)
-        if new_id:
-            migrated_stop.stop_id = self.feed_merger.generate_id(entity.stop_id)
+        migrated_stop.stop_id = self._get_migrated_id(entity.stop_id, schedule,
+                                                      new_id)
         return migrated_stop
 
     def _add(self, a, b, migrated_stop):
         self.feed_merger.register(a, b, migrated_stop)
+        self.feed_merger.register_ids(self.ENTITY_TYPE_NAME, a and a.stop_id,
+                                      b and b.stop_id, migrated_stop.stop_id)
 
         # The migrated_stop will be added to feed_merger.merged_schedule later
         # since adding must be done after the zone_ids have been finalized.
@@ -971,7 +1208,10 @@ class StopMerger(DataSetMerger):
         return entity.stop_id
 
     def merge_data_sets(self):
-        num_merged = self._merge_same_id()
+        if self.match_different_ids:
+            num_merged = self._merge_nearby()
+        else:
+            num_merged = self._merge_same_id()
         fm = self.feed_merger
 
         # now we do all the zone_id and parent_station mapping
@@ -1052,8 +1292,8 @@ class RouteMerger(DataSetMerger):
 
     def _migrate(self, entity, schedule, new_id):
         migrated_route = transitfeed.Route(field_dict=entity)
-        if new_id:
-            migrated_route.route_id = self.feed_merger.generate_id(entity.route_id)
+        migrated_route.route_id = self._get_migrated_id(entity.route_id, schedule,
+                                                        new_id)
         if entity.agency_id:
             original_agency = schedule.get_agency(entity.agency_id)
         else:
@@ -1080,6 +1320,12 @@ class ServicePeriodMerger(DataSetMerger):
     Attributes:
       require_disjoint_calendars: A boolean specifying whether to require
         disjoint calendars when merging (True) or not (False).
+      truncated_service_ids: A tuple of the lists of ids of the service periods
+        of the old and new schedules which lost active dates in
+        disjoin_calendars().
+      removed_service_ids: A tuple of the lists of ids of the service periods
+        of the old and new schedules which lost all their active dates in
+        disjoin_calendars() and were removed with their trips.
     """
 
     ENTITY_TYPE_NAME = 'service period'
@@ -1089,6 +1335,8 @@ class ServicePeriodMerger(DataSetMerger):
     def __init__(self, feed_merger):
         DataSetMerger.__init__(self, feed_merger)
         self.require_disjoint_calendars = True
+        self.truncated_service_ids = ([], [])
+        self.removed_service_ids = ([], [])
 
     def _report_same_id_but_not_merged(self, entity_id, reason):
         pass
@@ -1125,11 +1373,8 @@ class ServicePeriodMerger(DataSetMerger):
         migrated_service_period.end_date = original_service_period.end_date
         migrated_service_period.date_exceptions = dict(
             original_service_period.date_exceptions)
-        if new_id:
-            migrated_service_period.service_id = self.feed_merger.generate_id(
-                original_service_period.service_id)
-        else:
-            migrated_service_period.service_id = original_service_period.service_id
+        migrated_service_period.service_id = self._get_migrated_id(
+            original_service_period.service_id, schedule, new_id)
         return migrated_service_period
 
     def _add(self, a, b, migrated_service_period):
@@ -1148,6 +1393,23 @@ class ServicePeriodMerger(DataSetMerger):
         self.feed_merger.problem_reporter.merge_not_implemented(self)
         return True
 
+    def _get_base_date(self, *dates):
+        """Return the earliest of dates and of the dates of the service periods
+        of both schedules as a date object.
+
+        Args:
+          dates: more dates as strings in YYYYMMDD format
+        """
+        dates = [date for date in dates if date]
+        for schedule in (self.feed_merger.a_schedule,
+                         self.feed_merger.b_schedule):
+            for period in schedule.get_service_period_list():
+                start, _ = period.get_date_range()
+                if start:
+                    dates.append(start)
+        date_object = dates and util.date_string_to_date_object(min(dates))
+        return date_object or datetime.date.today()
+
     def disjoin_calendars(self, cutoff):
         """Forces the old and new calendars to be disjoint about a cutoff date.
 
@@ -1155,64 +1417,83 @@ class ServicePeriodMerger(DataSetMerger):
         stops one day before the given cutoff date and truncates the new schedule
         so that service only begins on the cutoff date.
 
+        The active dates of every service period are compiled into a bitset once
+        and the truncation is a mask of these bitsets. The service periods that
+        lose active dates are reported with a calendars_truncated notice and
+        kept in truncated_service_ids. The service periods that lose all their
+        active dates are removed from their schedule with their trips, since
+        the trips would refer to a service period without dates in calendar.txt,
+        and are reported with a calendars_removed notice and kept in
+        removed_service_ids.
+
         Args:
           cutoff: The cutoff date as a string in YYYYMMDD format. The timezone
                   is the same as used in the calendar.txt file.
-        """
 
-        def truncate_period(service_period, start, end):
-            """Truncate the service period to into the range [start, end].
-
-            Args:
-              service_period: The service period to truncate.
-              start: The start date as a string in YYYYMMDD format.
-              end: The end date as a string in YYYYMMDD format.
-            """
-            service_period.start_date = max(service_period.start_date, start)
-            service_period.end_date = min(service_period.end_date, end)
-            dates_to_delete = []
-            for k in service_period.date_exceptions:
-                if (k < start) or (k > end):
-                    dates_to_delete.append(k)
-            for k in dates_to_delete:
-                del service_period.date_exceptions[k]
-
-        # find the date one day before cutoff
-        year = int(cutoff[:4])
-        month = int(cutoff[4:6])
-        day = int(cutoff[6:8])
-        cutoff_date = datetime.date(year, month, day)
-        one_day_delta = datetime.timedelta(days=1)
-        before = (cutoff_date - one_day_delta).strftime('%Y%m%d')
-
-        for a in self.feed_merger.a_schedule.get_service_period_list():
-            truncate_period(a, 0, before)
-        for b in self.feed_merger.b_schedule.get_service_period_list():
-            truncate_period(b, cutoff, '9' * 8)
+        Returns:
+          A tuple (a_service_ids, b_service_ids) of the sorted lists of ids of
+          the truncated service periods of the old and new schedules.
+        """
+        cutoff_date = util.date_string_to_date_object(cutoff)
+        if cutoff_date is None:
+            raise MergeError('Invalid cutoff date %s' % cutoff)
+        before = (cutoff_date - datetime.timedelta(days=1)).strftime('%Y%m%d')
+        base_date = self._get_base_date(before)
+        cutoff_index = cutoff_date.toordinal() - base_date.toordinal()
+        before_mask = (1 << cutoff_index) - 1
+
+        self.truncated_service_ids = ([], [])
+        self.removed_service_ids = ([], [])
+        for schedule, feed_name, truncated, removed, start, end in (
+                (self.feed_merger.a_schedule, 'old',
+                 self.truncated_service_ids[0], self.removed_service_ids[0],
+                 None, before),
+                (self.feed_merger.b_schedule, 'new',
+                 self.truncated_service_ids[1], self.removed_service_ids[1],
+                 cutoff, None)):
+            for period in schedule.get_service_period_list():
+                bitset = period.get_active_date_bitset(base_date)
+                if end is None:
+                    kept = bitset & ~before_mask
+                else:
+                    kept = bitset & before_mask
+                if kept != bitset:
+                    truncated.append(period.service_id)
+                    if not kept:
+                        removed.append(period.service_id)
+                period.clip_dates(start, end)
+            for service_id in removed:
+                schedule.remove_service_period(service_id)
+            truncated.sort()
+            removed.sort()
+            if truncated:
+                self.feed_merger.problem_reporter.calendars_truncated(
+                    self, feed_name, truncated)
+            if removed:
+                self.feed_merger.problem_reporter.calendars_removed(
+                    self, feed_name, removed)
+        return self.truncated_service_ids
 
     def check_disjoint_calendars(self):
         """Check whether any old service periods intersect with any new ones.
 
-        This is a rather coarse check based on
-        transitfeed.SevicePeriod.GetDateRange.
+        The active dates of all the service periods of each schedule are
+        compiled into one bitset, so the calendars are disjoint if the two
+        bitsets have no date in common. Exceptions and days of the week are
+        taken into account: a weekday service in the old schedule and a weekend
+        service in the new schedule over the same dates are disjoint.
 
         Returns:
           True if the calendars are disjoint or False if not.
         """
-        # TODO: Do an exact check here.
-
-        a_service_periods = self.feed_merger.a_schedule.get_service_period_list()
-        b_service_periods = self.feed_merger.b_schedule.get_service_period_list()
-
-        for a_service_period in a_service_periods:
-            a_start, a_end = a_service_period.get_date_range()
-            for b_service_period in b_service_periods:
-                b_start, b_end = b_service_period.get_date_range()
-                overlap_start = max(a_start, b_start)
-                overlap_end = min(a_end, b_end)
-                if overlap_end >= overlap_start:
-                    return False
-        return True
+        base_date = self._get_base_date()
+        a_dates = 0
+        for period in self.feed_merger.a_schedule.get_service_period_list():
+            a_dates |= period.get_active_date_bitset(base_date)
+        b_dates = 0
+        for period in self.feed_merger.b_schedule.get_service_period_list():
+            b_dates |= period.get_active_date_bitset(base_date)
+        return not a_dates & b_dates
 
     def get_merge_stats(self):
         return None
@@ -1243,9 +1524,8 @@ class FareMerger(DataSetMerger):
     def _migrate(self, original_fare, schedule, new_id):
         migrated_fare = transitfeed.FareAttribute(
             field_dict=original_fare)
-        if new_id:
-            migrated_fare.fare_id = self.feed_merger.generate_id(
-                original_fare.fare_id)
+        migrated_fare.fare_id = self._get_migrated_id(original_fare.fare_id,
+                                                      schedule, new_id)
         return migrated_fare
 
     def _add(self, a, b, migrated_fare):
@@ -1331,6 +1611,12 @@ class ShapeMerger(DataSetMerger):
     Attributes:
       largest_shape_distance: The largest distance between the endpoints of two
         shapes allowed for them to be merged in metres.
+      merge_duplicate_shapes: If True, the shapes of both schedules with the
+        same geometry are merged into one, whatever their ids, and the trips
+        use the merged shape. The shape of the new schedule is kept.
+      shape_precision: The number of decimals of the coordinates and distances
+        compared by merge_duplicate_shapes, see
+        transitfeed.group_duplicate_shapes.
     """
 
     ENTITY_TYPE_NAME = 'shape'
@@ -1338,11 +1624,21 @@ class ShapeMerger(DataSetMerger):
     DATASET_NAME = 'Shapes'
 
     largest_shape_distance = 10.0
+    merge_duplicate_shapes = False
+    shape_precision = 5
 
     def set_largest_shape_distance(self, distance):
         """Sets largest_shape_distance."""
         self.largest_shape_distance = distance
 
+    def set_merge_duplicate_shapes(self, merge_duplicate_shapes):
+        """Sets merge_duplicate_shapes."""
+        self.merge_duplicate_shapes = merge_duplicate_shapes
+
+    def set_shape_precision(self, precision):
+        """Sets shape_precision."""
+        self.shape_precision = precision
+
     def _get_iter(self, schedule):
         return schedule.get_shape_list()
 
@@ -1366,10 +1662,10 @@ class ShapeMerger(DataSetMerger):
         if a.shape_id != b.shape_id:
             raise MergeError('shape_id must be the same')
 
-        distance = max(approximate_distance_between_points(a.points[0][:2],
-                                                           b.points[0][:2]),
-                       approximate_distance_between_points(a.points[-1][:2],
-                                                           b.points[-1][:2]))
+        distance = max(approximate_distance_between_points(a._get_point(0)[:2],
+                                                           b._get_point(0)[:2]),
+                       approximate_distance_between_points(a._get_point(-1)[:2],
+                                                           b._get_point(-1)[:2]))
         if distance > self.largest_shape_distance:
             raise MergeError('The shape endpoints are too far away: %.1fm '
                              '(largest_shape_distance is %.1fm)' %
@@ -1378,10 +1674,8 @@ class ShapeMerger(DataSetMerger):
         return self._migrate(b, self.feed_merger.b_schedule, False)
 
     def _migrate(self, original_shape, schedule, new_id):
-        migrated_shape = transitfeed.Shape(original_shape.shape_id)
-        if new_id:
-            migrated_shape.shape_id = self.feed_merger.generate_id(
-                original_shape.shape_id)
+        migrated_shape = transitfeed.Shape(self._get_migrated_id(
+            original_shape.shape_id, schedule, new_id))
         for (lat, lon, dist) in original_shape.points:
             migrated_shape.add_point(lat=lat, lon=lon, distance=dist)
         return migrated_shape
@@ -1393,22 +1687,110 @@ class ShapeMerger(DataSetMerger):
     def _get_id(self, shape):
         return shape.shape_id
 
+    def _find_duplicate_shapes(self):
+        """Groups the shapes of both schedules by their geometry.
+
+        Returns:
+          A list with a tuple (schedule, shape, new_id, a_shapes, b_shapes) for
+          each shape of the merged schedule, where shape is the shape of
+          schedule to migrate, new_id is the new_id argument of _migrate, and
+          a_shapes and b_shapes are the shapes of the old and new schedules
+          which it replaces, including itself.
+        """
+        fm = self.feed_merger
+        b_shapes = list(fm.b_schedule.get_shape_list())
+        # The new shapes come first so they are the ones kept
+        shapes = b_shapes + list(fm.a_schedule.get_shape_list())
+        groups = dict((group[0], group) for group in
+                      transitfeed.group_duplicate_shapes(shapes,
+                                                         self.shape_precision))
+        duplicates = set(index for group in groups.values() for index in group[1:])
+        plan = []
+        for index, shape in enumerate(shapes):
+            if index in duplicates:
+                continue
+            group = groups.get(index, [index])
+            a_group = [shapes[i] for i in group if i >= len(b_shapes)]
+            b_group = [shapes[i] for i in group if i < len(b_shapes)]
+            if b_group:
+                schedule, other_schedule, other_group = (
+                    fm.b_schedule, fm.a_schedule, a_group)
+            else:
+                schedule, other_schedule, other_group = (
+                    fm.a_schedule, fm.b_schedule, b_group)
+            # The id is kept unless another shape of the other schedule has it
+            new_id = (self._has_id(other_schedule, shape.shape_id) and
+                      shape.shape_id not in [s.shape_id for s in other_group])
+            plan.append((schedule, shape, new_id, a_group, b_group))
+        return plan
+
+    def _merge_duplicates(self):
+        """Merges the shapes with the same geometry and migrates the others.
+
+        Returns:
+          The number of merged shapes.
+        """
+        fm = self.feed_merger
+        for schedule, shape, new_id, a_shapes, b_shapes in (
+                self._find_duplicate_shapes()):
+            migrated_shape = self._migrate(shape, schedule, new_id)
+            self._add(a_shapes[0] if a_shapes else None,
+                      b_shapes[0] if b_shapes else None, migrated_shape)
+            for a in a_shapes[1:]:
+                fm.register(a, None, migrated_shape)
+            for b in b_shapes[1:]:
+                fm.register(None, b, migrated_shape)
+            if len(a_shapes) + len(b_shapes) > 1:
+                self._num_merged += 1
+            elif a_shapes:
+                self._num_not_merged_a += 1
+            else:
+                self._num_not_merged_b += 1
+        return self._num_merged
+
     def merge_data_sets(self):
-        self._merge_same_id()
+        if self.merge_duplicate_shapes:
+            self._merge_duplicates()
+        else:
+            self._merge_same_id()
         return True
 
 
 class TripMerger(DataSetMerger):
     """A DataSetMerger for trips.
 
-    This implementation makes no attempt to merge trips, it simply migrates
-    them all to the merged feed.
+    By default this implementation makes no attempt to merge trips, it simply
+    migrates them all to the merged feed.
+
+    Attributes:
+      drop_duplicate_trips: If True, a trip of the old schedule which has the
+        same service dates, frequencies and stops at the same times as a trip of
+        the new schedule is merged into it, so feeds which overlap don't keep
+        both copies of their trips.
+      duplicate_time_resolution: The times of trips are rounded to a multiple
+        of this many seconds before comparing them, so that trips only a few
+        seconds apart are duplicates too. 0 compares the exact times.
     """
 
     ENTITY_TYPE_NAME = 'trip'
     FILE_NAME = 'trips.txt'
     DATASET_NAME = 'Trips'
 
+    drop_duplicate_trips = False
+    duplicate_time_resolution = 0
+
+    def __init__(self, feed_merger):
+        DataSetMerger.__init__(self, feed_merger)
+        self._unvalidated_trips = []
+
+    def set_drop_duplicate_trips(self, drop_duplicate_trips):
+        """Sets drop_duplicate_trips."""
+        self.drop_duplicate_trips = drop_duplicate_trips
+
+    def set_duplicate_time_resolution(self, seconds):
+        """Sets duplicate_time_resolution."""
+        self.duplicate_time_resolution = seconds
+
     def _report_same_id_but_not_merged(self, trip_id, reason):
         pass
 
@@ -1426,9 +1808,9 @@ class TripMerger(DataSetMerger):
         migrated_trip = transitfeed.Trip(field_dict=original_trip)
         # Make new trip_id first. AddTripObject reports a problem if it conflicts
         # with an existing id.
+        migrated_trip.trip_id = self._get_migrated_id(original_trip.trip_id,
+                                                      schedule, new_id)
         if new_id:
-            migrated_trip.trip_id = self.feed_merger.generate_id(
-                original_trip.trip_id)
             migrated_trip.original_trip_id = original_trip.trip_id
         # Need to add trip to schedule before copying stoptimes
         self.feed_merger.merged_schedule.add_trip_object(migrated_trip,
@@ -1452,22 +1834,11 @@ class TripMerger(DataSetMerger):
                 original_trip.block_id)
 
         if original_trip.shape_id:
+            # Duplicate shapes share their migrated shape
             original_shape = schedule.get_shape(original_trip.shape_id)
-            migrated_trip.shape_id = merge_map[original_shape].shape_id
-
-        for original_stop_time in original_trip.get_stop_times():
-            migrated_stop_time = transitfeed.StopTime(
-                None,
-                merge_map[original_stop_time.stop],
-                original_stop_time.arrival_time,
-                original_stop_time.departure_time,
-                original_stop_time.stop_headsign,
-                original_stop_time.pickup_type,
-                original_stop_time.drop_off_type,
-                original_stop_time.shape_dist_traveled,
-                original_stop_time.arrival_secs,
-                original_stop_time.departure_secs)
-            migrated_trip.add_stop_time_object(migrated_stop_time)
+            migrated_trip.shape_id = original_shape._migrated_entity.shape_id
+
+        # The stop_times are copied together by _migrate_stop_times
 
         for headway_period in original_trip.get_frequency_tuples():
             migrated_trip.add_frequency(*headway_period)
@@ -1475,19 +1846,212 @@ class TripMerger(DataSetMerger):
         return migrated_trip
 
     def _add(self, a, b, migrated_trip):
-        # Validate now, since it wasn't done in _migrate
-        migrated_trip.validate(self.feed_merger.merged_schedule.problem_reporter)
+        # Validated in merge_data_sets once its stop_times have been copied
+        self._unvalidated_trips.append(migrated_trip)
         self.feed_merger.register(a, b, migrated_trip)
+        self.feed_merger.register_ids(self.ENTITY_TYPE_NAME, a and a.trip_id,
+                                      b and b.trip_id, migrated_trip.trip_id)
 
     def _get_id(self, trip):
         return trip.trip_id
 
+    def _migrate_stop_times(self, schedule):
+        """Copy the stop_times of the trips migrated from schedule to the
+        merged schedule.
+
+        The trip_ids and stop_ids are mapped to the migrated ones with joins on
+        a temporary table holding the ids of FeedMerger.register_ids, which is
+        filled with one executemany and dropped afterwards, and the
+        stop_sequences renumbered from 1, as Trip.add_stop_time_object does.
+        The trips of the old schedule merged into a trip of the new one are
+        skipped, the merged trip has the stop_times of the new trip. If the
+        stop_times of schedule are in a file this is a single INSERT ... SELECT
+        on the merged database with the file attached, otherwise the rows of one
+        query on schedule are inserted into the merged database with one
+        executemany. No StopTime objects are created.
+
+        Args:
+          schedule: The old or new schedule.
+        """
+        fm = self.feed_merger
+        merged_schedule = fm.merged_schedule
+        columns = transitfeed.StopTime.SQL_FIELD_NAMES
+        selected = {'trip_id': 'trip_map.migrated_id',
+                    'stop_id': 'stop_map.migrated_id',
+                    'stop_sequence': 'ROW_NUMBER() OVER (PARTITION BY '
+                                     'stop_times.trip_id ORDER BY '
+                                     'stop_times.stop_sequence)'}
+        select_query = (
+            'SELECT %s FROM %%sstop_times AS stop_times '
+            'JOIN temp.merge_id_map AS trip_map '
+            'ON trip_map.entity_type=:trip AND '
+            'trip_map.original_id=stop_times.trip_id %s'
+            'JOIN temp.merge_id_map AS stop_map '
+            'ON stop_map.entity_type=:stop AND '
+            'stop_map.original_id=stop_times.stop_id' % (
+                ','.join(selected.get(c, 'stop_times.%s' % c) for c in columns),
+                'AND NOT trip_map.merged ' if schedule is fm.a_schedule else ''))
+        parameters = {'trip': self.ENTITY_TYPE_NAME,
+                      'stop': StopMerger.ENTITY_TYPE_NAME}
+        insert_query = 'INSERT INTO stop_times (%s) ' % ','.join(columns)
+
+        # Make the stop_times of schedule visible to other connections
+        schedule.connection.commit()
+        db_path = schedule.connection.execute('PRAGMA database_list').fetchone()[2]
+        if db_path:
+            # ATTACH isn't allowed inside a transaction
+            merged_schedule.connection.commit()
+            cursor = merged_schedule.connection.cursor()
+            cursor.execute('ATTACH DATABASE ? AS merge_source', (db_path,))
+            select_query %= 'merge_source.'
+        else:
+            # Join the ids next to the stop_times of schedule
+            cursor = schedule.connection.cursor()
+            select_query %= ''
+        cursor.execute('DROP TABLE IF EXISTS temp.merge_id_map')
+        cursor.execute('CREATE TEMP TABLE merge_id_map ('
+                       'entity_type CHAR(20), original_id CHAR(50), '
+                       'migrated_id CHAR(50), merged INTEGER, '
+                       'PRIMARY KEY (entity_type, original_id))')
+        try:
+            cursor.executemany(
+                'INSERT OR REPLACE INTO temp.merge_id_map VALUES (?, ?, ?, ?)',
+                fm.get_registered_ids(schedule))
+            if db_path:
+                cursor.execute(insert_query + select_query, parameters)
+                merged_schedule.connection.commit()
+            else:
+                cursor.execute(select_query, parameters)
+                merged_schedule.connection.cursor().executemany(
+                    insert_query + 'VALUES (%s)' % ','.join(['?'] * len(columns)),
+                    cursor)
+        finally:
+            cursor.execute('DROP TABLE IF EXISTS temp.merge_id_map')
+            if db_path:
+                cursor.execute('DETACH DATABASE merge_source')
+        merged_schedule.mark_table_dirty('stop_times')
+
+    def _get_trip_fingerprints(self, schedule):
+        """Returns a hash of each trip of schedule with stop_times.
+
+        The hashes are computed in one scan of the stop_times of schedule,
+        ordered by the index on trip_id and stop_sequence. A hash covers the
+        active dates of the service period, the frequencies, and the migrated
+        stop_id and times of each stop, so the stops must have been merged.
+
+        Args:
+          schedule: The old or new schedule.
+
+        Returns:
+          A dict mapping trip_ids to hashes as bytes.
+        """
+        stop_ids = dict((stop.stop_id, stop._migrated_entity.stop_id)
+                        for stop in schedule.get_stop_list())
+        service_dates = dict(
+            (period.service_id, ','.join(period.active_dates()))
+            for period in schedule.get_service_period_list())
+        resolution = self.duplicate_time_resolution
+
+        def round_time(secs):
+            if secs is None or not resolution:
+                return secs
+            return int(round(float(secs) / resolution))
+
+        fingerprints = {}
+        cursor = schedule.connection.cursor()
+        cursor.execute('SELECT trip_id,stop_id,arrival_secs,departure_secs '
+                       'FROM stop_times INDEXED BY trip_index '
+                       'ORDER BY trip_id,stop_sequence')
+        for trip_id, rows in itertools.groupby(cursor, key=lambda row: row[0]):
+            trip = schedule.trips.get(trip_id)
+            if trip is None:
+                continue
+            fingerprint = hashlib.sha1()
+            fingerprint.update(('%s\n%s\n' % (
+                service_dates.get(trip.service_id, ''),
+                trip.get_frequency_tuples())).encode('utf-8'))
+            for _, stop_id, arrival_secs, departure_secs in rows:
+                fingerprint.update(('%s,%s,%s\n' % (
+                    stop_ids.get(stop_id, stop_id), round_time(arrival_secs),
+                    round_time(departure_secs))).encode('utf-8'))
+            fingerprints[trip_id] = fingerprint.digest()
+        return fingerprints
+
+    @staticmethod
+    def _find_duplicate_trips(a_trips, a_fingerprints, b_fingerprints):
+        """Finds the old trips with the same fingerprint as a new trip.
+
+        This is a hash join on the fingerprints. Each new trip is the duplicate
+        of at most one old trip.
+
+        Args:
+          a_trips: The trips of the old schedule.
+          a_fingerprints: A dict mapping the trip_ids of the old schedule to
+                          their fingerprints.
+          b_fingerprints: A dict mapping the trip_ids of the new schedule to
+                          their fingerprints.
+
+        Returns:
+          A tuple (a dict mapping the trip_ids of new trips to the old trip they
+          duplicate, a list of the old trips which aren't duplicates).
+        """
+        b_trip_ids = {}
+        for trip_id in sorted(b_fingerprints):
+            b_trip_ids.setdefault(b_fingerprints[trip_id], trip_id)
+        duplicates = {}
+        a_not_merged = []
+        for a in a_trips:
+            b_trip_id = b_trip_ids.get(a_fingerprints.get(a.trip_id))
+            if b_trip_id is not None and b_trip_id not in duplicates:
+                duplicates[b_trip_id] = a
+            else:
+                a_not_merged.append(a)
+        return duplicates, a_not_merged
+
+    def _merge_duplicates(self):
+        """Merges the old trips which duplicate a new trip into it and migrates
+        the other trips.
+
+        Returns:
+          The number of merged trips.
+        """
+        fm = self.feed_merger
+        b_trips = fm.b_schedule.get_trip_list()
+        duplicates, a_not_merged = self._find_duplicate_trips(
+            fm.a_schedule.get_trip_list(),
+            self._get_trip_fingerprints(fm.a_schedule),
+            self._get_trip_fingerprints(fm.b_schedule))
+        # The old trips get new ids if they are taken by the new trips
+        for a in a_not_merged:
+            new_id = self._has_id(fm.b_schedule, a.trip_id)
+            self._add(a, None, self._migrate(a, fm.a_schedule, new_id))
+        for b in b_trips:
+            self._add(duplicates.get(b.trip_id), b,
+                      self._migrate(b, fm.b_schedule, False))
+        self._num_merged = len(duplicates)
+        self._num_not_merged_a = len(a_not_merged)
+        self._num_not_merged_b = len(b_trips) - len(duplicates)
+        return self._num_merged
+
     def merge_data_sets(self):
-        self._merge_same_id()
-        self.feed_merger.problem_reporter.merge_not_implemented(self)
+        if self.drop_duplicate_trips:
+            self._merge_duplicates()
+        else:
+            self._merge_same_id()
+        for schedule in (self.feed_merger.a_schedule, self.feed_merger.b_schedule):
+            self._migrate_stop_times(schedule)
+        # Validate now, since it wasn't done in _migrate
+        problems = self.feed_merger.merged_schedule.problem_reporter
+        for migrated_trip in self._unvalidated_trips:
+            migrated_trip.validate(problems)
+        self._unvalidated_trips = []
+        if not self.drop_duplicate_trips:
+            self.feed_merger.problem_reporter.merge_not_implemented(self)
         return True
 
     def get_merge_stats(self):
+        if self.drop_duplicate_trips:
+            return DataSetMerger.get_merge_stats(self)
         return None
 
 
@@ -1559,6 +2123,43 @@ class FareRuleMerger(DataSetMerger):
         return None
 
 
+class EntityMap(object):
+    """A map from the entities of an input schedule to the merged entities.
+
+    The GTFS objects define __eq__ but no __hash__, so they can't be the keys
+    of a dict. An EntityMap keys them by identity instead, which is what the
+    merge needs since each entity of an input schedule is registered once.
+    """
+
+    def __init__(self):
+        # Map from id() of an entity to (entity, migrated entity). Keeping the
+        # entity keeps its id() from being reused.
+        self._items = {}
+
+    def __setitem__(self, entity, migrated_entity):
+        self._items[id(entity)] = (entity, migrated_entity)
+
+    def __getitem__(self, entity):
+        try:
+            return self._items[id(entity)][1]
+        except KeyError:
+            raise KeyError(entity)
+
+    def __contains__(self, entity):
+        return id(entity) in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, entity, default=None):
+        item = self._items.get(id(entity))
+        return default if item is None else item[1]
+
+    def items(self):
+        """Return a list of (entity, migrated entity) tuples."""
+        return list(self._items.values())
+
+
 class FeedMerger(object):
     """A class for merging two whole feeds.
 
@@ -1566,19 +2167,22 @@ class FeedMerger(object):
     DataSetMerger instances to merge the feeds and produce the resultant
     merged feed.
 
+    To merge more than two feeds see merge_schedule_list.
+
     Attributes:
       a_schedule: The old transitfeed.Schedule instance.
       b_schedule: The new transitfeed.Schedule instance.
       problem_reporter: The merge problem reporter.
       merged_schedule: The merged transitfeed.Schedule instance.
-      a_merge_map: A map from old entities to merged entities.
-      b_merge_map: A map from new entities to merged entities.
+      a_merge_map: An EntityMap from old entities to merged entities.
+      b_merge_map: An EntityMap from new entities to merged entities.
       a_zone_map: A map from old zone ids to merged zone ids.
       b_zone_map: A map from new zone ids to merged zone ids.
     """
 
     def __init__(self, a_schedule, b_schedule, merged_schedule,
-                 problem_reporter):
+                 problem_reporter, schedule_names=('a', 'b'),
+                 id_prefixes=('', '')):
         """Initialise the merger.
 
         Once this initialiser has been called, a_schedule and b_schedule should
@@ -1589,12 +2193,18 @@ class FeedMerger(object):
           b_schedule: The new schedule, an instance of transitfeed.Schedule.
           problem_reporter: The problem reporter, an instance of
                             transitfeed.ProblemReporter.
+          schedule_names: The identifiers of the old and new schedules returned
+                          by get_schedule_name.
+          id_prefixes: The prefixes added to the ids of the entities migrated
+                       from the old and new schedules.
         """
         self.a_schedule = a_schedule
         self.b_schedule = b_schedule
+        self._schedule_names = list(schedule_names)
+        self._id_prefixes = list(id_prefixes)
         self.merged_schedule = merged_schedule
-        self.a_merge_map = {}
-        self.b_merge_map = {}
+        self.a_merge_map = EntityMap()
+        self.b_merge_map = EntityMap()
         self.a_zone_map = {}
         self.b_zone_map = {}
         self._mergers = []
@@ -1602,6 +2212,18 @@ class FeedMerger(object):
                           self._find_largest_id_postfix_number(self.b_schedule))
 
         self.problem_reporter = problem_reporter
+        # (schedule name, entity_type, original_id, migrated_id, merged)
+        # tuples of register_ids
+        self._id_rows = []
+
+    # The DataSetMerger classes whose results the mergers of each class use.
+    # The dependencies of a merger are those of its class and base classes.
+    MERGER_DEPENDENCIES = {
+        RouteMerger: (AgencyMerger,),
+        TransferMerger: (StopMerger,),
+        TripMerger: (StopMerger, RouteMerger, ServicePeriodMerger, ShapeMerger),
+        FareRuleMerger: (StopMerger, RouteMerger, FareMerger),
+    }
 
     @staticmethod
     def _find_largest_id_postfix_number(schedule):
@@ -1652,10 +2274,11 @@ class FeedMerger(object):
         return max_postfix_number
 
     def get_schedule_name(self, schedule):
-        """Returns a single letter identifier for the schedule.
+        """Returns an identifier for the schedule.
 
         This only works for the old and new schedules which return 'a' and 'b'
-        respectively. The purpose of such identifiers is for generating ids.
+        respectively, unless other schedule_names were given. The purpose of
+        such identifiers is for generating ids.
 
         Args:
           schedule: The transitfeed.Schedule instance.
@@ -1666,7 +2289,28 @@ class FeedMerger(object):
         Raises:
           KeyError: schedule is not the old or new schedule.
         """
-        return {self.a_schedule: 'a', self.b_schedule: 'b'}[schedule]
+        return dict(zip((self.a_schedule, self.b_schedule),
+                        self._schedule_names))[schedule]
+
+    def add_id_prefix(self, schedule, entity_id):
+        """Returns entity_id with the id prefix of the old or new schedule.
+
+        An empty id is replaced by the prefix alone, so that entities without
+        an id, such as the agency of a feed with a single agency, stay distinct
+        between feeds with different prefixes.
+
+        Args:
+          schedule: The transitfeed.Schedule instance.
+          entity_id: An id string or None.
+
+        Returns:
+          The prefixed id, or entity_id if the schedule has no prefix.
+        """
+        prefix = dict(zip((self.a_schedule, self.b_schedule),
+                          self._id_prefixes))[schedule]
+        if not prefix:
+            return entity_id
+        return prefix + (entity_id or '')
 
     def generate_id(self, entity_id=None):
         """Generate a unique id based on the given id.
@@ -1707,9 +2351,8 @@ class FeedMerger(object):
         # migrated entity of an object without knowing in which original schedule
         # the entity started. With a_merge_map and b_merge_map both have to be
         # checked. Use of the _migrated_entity attribute allows the migrated entity
-        # to be directly found without the schedule.  The merge maps also require
-        # that all objects be hashable. GenericGTFSObject is at the moment, but
-        # this is a bug. See comment in transitfeed.GenericGTFSObject.
+        # to be directly found without the schedule. The merge maps are
+        # EntityMaps because the GTFS objects aren't hashable.
         if a is not None:
             self.a_merge_map[a] = migrated_entity
             a._migrated_entity = migrated_entity
@@ -1717,6 +2360,31 @@ class FeedMerger(object):
             self.b_merge_map[b] = migrated_entity
             b._migrated_entity = migrated_entity
 
+    def register_ids(self, entity_type, a_id, b_id, migrated_id):
+        """Registers the ids of a merge mapping.
+
+        The ids are collected in a list, from which the stop_times of the
+        input schedules are migrated with joins instead of looking up each row
+        in Python. They don't replace the merge maps of register.
+
+        Args:
+          entity_type: The ENTITY_TYPE_NAME of the DataSetMerger.
+          a_id: The id of the entity from the old feed or None.
+          b_id: The id of the entity from the new feed or None.
+          migrated_id: The id of the migrated entity.
+        """
+        merged = int(a_id is not None and b_id is not None)
+        for name, original_id in zip(self._schedule_names, (a_id, b_id)):
+            if original_id is not None:
+                self._id_rows.append(
+                    (name, entity_type, original_id, migrated_id, merged))
+
+    def get_registered_ids(self, schedule):
+        """Return a list of (entity_type, original_id, migrated_id, merged)
+        tuples of the ids registered for the entities of schedule."""
+        name = self.get_schedule_name(schedule)
+        return [row[1:] for row in self._id_rows if row[0] == name]
+
     def add_merger(self, merger):
         """Add a DataSetMerger to be run by Merge().
 
@@ -1757,18 +2425,60 @@ class FeedMerger(object):
         """Returns the list of DataSetMerger instances that have been added."""
         return self._mergers
 
+    def _get_dependencies(self, merger):
+        """Returns the added DataSetMergers that merger depends on."""
+        dependency_classes = set()
+        for cls in type(merger).__mro__:
+            dependency_classes.update(self.MERGER_DEPENDENCIES.get(cls, ()))
+        return [other for other in self._mergers if other is not merger and
+                isinstance(other, tuple(dependency_classes))]
+
+    def get_merge_plan(self):
+        """Returns the added DataSetMergers grouped in stages.
+
+        The plan is the DAG of the dependencies in MERGER_DEPENDENCIES: each
+        merger is in the stage after the last one of the mergers it depends on,
+        so that the mergers of a stage don't depend on each other. Within a
+        stage the mergers are in the order that they were added.
+
+        Returns:
+          A list of lists of DataSetMerger instances.
+
+        Raises:
+          MergeError: Some mergers depend on each other.
+        """
+        dependencies = dict((merger, self._get_dependencies(merger))
+                            for merger in self._mergers)
+        stages = []
+        planned = set()
+        remaining = list(self._mergers)
+        while remaining:
+            stage = [merger for merger in remaining
+                     if planned.issuperset(dependencies[merger])]
+            if not stage:
+                raise MergeError('Circular dependencies between %s' % ', '.join(
+                    type(merger).__name__ for merger in remaining))
+            stages.append(stage)
+            planned.update(stage)
+            remaining = [merger for merger in remaining if merger not in planned]
+        return stages
+
     def merge_schedules(self):
         """Merge the schedules.
 
         This is done by running the DataSetMergers that have been added with
-        add_merger() in the order that they were added.
+        add_merger() stage by stage in the order of get_merge_plan(). The
+        mergers of a stage could run concurrently, but they are run one after
+        the other because they share the merged schedule and the counter of
+        generate_id, which keeps the generated ids the same from run to run.
 
         Returns:
           True if the merge was successful.
         """
-        for merger in self._mergers:
-            if not merger.merge_data_sets():
-                return False
+        for stage in self.get_merge_plan():
+            for merger in stage:
+                if not merger.merge_data_sets():
+                    return False
         return True
 
     def get_merged_schedule(self):
@@ -1782,13 +2492,61 @@ class FeedMerger(object):
         return self.merged_schedule
 
 
+def merge_schedule_list(schedules, merged_schedule, problem_reporter,
+                        schedule_names, id_prefixes,
+                        add_mergers=FeedMerger.add_default_mergers):
+    """Merge any number of schedules into merged_schedule in a single pass.
+
+    Each schedule is the new schedule of a FeedMerger whose old schedule is
+    empty and whose merged schedule is merged_schedule, so its entities are
+    migrated once into merged_schedule with its id prefix, and the counter of
+    generate_id carries on from one FeedMerger to the next. The cost is linear
+    in the number of schedules, unlike merging them two at a time into ever
+    larger feeds. Entities of different schedules are not merged with each
+    other, the id prefixes keep them apart.
+
+    Args:
+      schedules: The list of transitfeed.Schedule instances to merge.
+      merged_schedule: The transitfeed.Schedule instance to merge them into.
+      problem_reporter: The problem reporter of all the FeedMergers.
+      schedule_names: A list of an identifier for each schedule, see
+                      FeedMerger.get_schedule_name.
+      id_prefixes: A list of the prefix of the ids of each schedule, which
+                   must be different from each other.
+      add_mergers: A function called with each FeedMerger to add its
+                   DataSetMergers.
+
+    Returns:
+      A tuple (True if the merge was successful, the list of FeedMergers run).
+    """
+    if len(set(id_prefixes)) != len(id_prefixes):
+        raise MergeError('The id prefixes of the schedules must be different.')
+    feed_mergers = []
+    idnum = 0
+    for schedule, name, prefix in zip(schedules, schedule_names, id_prefixes):
+        feed_merger = FeedMerger(transitfeed.Schedule(), schedule,
+                                 merged_schedule, problem_reporter,
+                                 schedule_names=('', name),
+                                 id_prefixes=('', prefix))
+        feed_merger._idnum = max(feed_merger._idnum, idnum)
+        add_mergers(feed_merger)
+        feed_mergers.append(feed_merger)
+        if not feed_merger.merge_schedules():
+            return False, feed_mergers
+        idnum = feed_merger._idnum
+    return True, feed_mergers
+
+
 def main():
     """Run the merge driver program."""
     usage = \
-        """%prog [options] <input GTFS a.zip> <input GTFS b.zip> <output GTFS.zip>
+        """%prog [options] <input GTFS a.zip> <input GTFS b.zip> [<more input GTFS.zip> ...] <output GTFS.zip>
         
         Merges <input GTFS a.zip> and <input GTFS b.zip> into a new GTFS file
         <output GTFS.zip>.
+
+        With more than two input feeds, all of them are merged in a single pass,
+        each with its own prefix added to its ids (see --id_prefixes).
         
         For more information see
         https://github.com/google/transitfeed/wiki/Merge
@@ -1806,11 +2564,44 @@ def main():
                       default=StopMerger.largest_stop_distance,
                       help='the furthest distance two stops can be apart and '
                            'still be merged, in metres')
+    parser.add_option('--match_stops_by_location',
+                      dest='match_stops_by_location',
+                      action='store_true',
+                      help='merge stops that are close and have similar names '
+                           'instead of stops with the same stop_id, for feeds '
+                           'with different stop_ids')
+    parser.add_option('--min_stop_name_similarity',
+                      dest='min_stop_name_similarity',
+                      default=StopMerger.min_name_similarity,
+                      help='with --match_stops_by_location, the smallest '
+                           'similarity from 0 to 1 of the names of merged stops')
+    parser.add_option('--drop_duplicate_trips',
+                      dest='drop_duplicate_trips',
+                      action='store_true',
+                      help='merge the trips of the old feed which have the same '
+                           'dates, stops and times as a trip of the new feed '
+                           'into it')
+    parser.add_option('--duplicate_time_resolution',
+                      dest='duplicate_time_resolution', type='int',
+                      default=TripMerger.duplicate_time_resolution,
+                      help='with --drop_duplicate_trips, round the times of '
+                           'trips to this many seconds before comparing them')
     parser.add_option('--largest_shape_distance',
                       dest='largest_shape_distance',
                       default=ShapeMerger.largest_shape_distance,
                       help='the furthest distance the endpoints of two shapes '
                            'can be apart and the shape still be merged, in metres')
+    parser.add_option('--merge_duplicate_shapes',
+                      dest='merge_duplicate_shapes',
+                      action='store_true',
+                      help='merge the shapes with the same geometry, whatever '
+                           'their ids, and use the merged shape in their trips')
+    parser.add_option('--shape_precision',
+                      dest='shape_precision', type='int',
+                      default=ShapeMerger.shape_precision,
+                      help='with --merge_duplicate_shapes, shapes whose '
+                           'coordinates and distances are all within '
+                           '10^-SHAPE_PRECISION of each other are merged')
     parser.add_option('--html_output_path',
                       dest='html_output_path',
                       default='merge-results.html',
@@ -1828,43 +2619,96 @@ def main():
     parser.add_option('-m', '--memory_db', dest='memory_db', action='store_true',
                       help='Use in-memory sqlite db instead of a temporary file. '
                            'It is faster but uses more RAM.')
+    parser.add_option('--workers', dest='workers', type='int', default=1,
+                      help='number of threads compressing the merged feed')
+    parser.add_option('--load_processes', dest='load_processes', type='int',
+                      default=2,
+                      help='number of processes loading the input feeds, 1 '
+                           'loads them one after the other in this process')
+    parser.add_option('--id_prefixes', dest='id_prefixes',
+                      help='with more than two input feeds, comma separated '
+                           'prefixes added to the ids of each feed, by default '
+                           'the name of its file followed by _')
+    parser.add_option('--compression_level', dest='compression_level',
+                      type='int', default=None,
+                      help='zlib compression level of the merged feed, from 0 '
+                           '(fastest) to 9 (smallest)')
     parser.set_defaults(memory_db=False)
     (options, args) = parser.parse_args()
 
-    if len(args) != 3:
+    if len(args) < 3:
         parser.error('You did not provide all required command line arguments.')
 
-    old_feed_path = os.path.abspath(args[0])
-    new_feed_path = os.path.abspath(args[1])
-    merged_feed_path = os.path.abspath(args[2])
-
-    if old_feed_path.find("IWantMyCrash") != -1:
+    input_feed_paths = [os.path.abspath(arg) for arg in args[:-1]]
+    merged_feed_path = os.path.abspath(args[-1])
+    old_feed_path = input_feed_paths[0]
+    new_feed_path = input_feed_paths[-1]
+
+    if len(input_feed_paths) > 2:
+        if options.cutoff_date is not None:
+            parser.error('--cutoff_date needs exactly two input feeds.')
+        names = [os.path.splitext(os.path.basename(path))[0]
+                 for path in input_feed_paths]
+        if options.id_prefixes is not None:
+            id_prefixes = options.id_prefixes.split(',')
+        else:
+            id_prefixes = ['%s_' % name for name in names]
+        if (len(id_prefixes) != len(input_feed_paths) or
+                len(set(id_prefixes)) != len(id_prefixes)):
+            parser.error('--id_prefixes needs a different prefix for each input '
+                         'feed.')
+        old_feed_path = ', '.join(input_feed_paths[:-1])
+
+    if input_feed_paths[0].find("IWantMyCrash") != -1:
         # See tests/testmerge.py
         raise Exception('For testing the merge crash handler.')
 
-    a_schedule = load_without_errors(old_feed_path, options.memory_db)
-    b_schedule = load_without_errors(new_feed_path, options.memory_db)
+    schedules = load_all_without_errors(
+        input_feed_paths, options.memory_db, options.load_processes)
     merged_schedule = transitfeed.Schedule(memory_db=options.memory_db)
     accumulator = HTMLProblemAccumulator()
     problem_reporter = MergeProblemReporter(accumulator)
 
     util.check_version(problem_reporter, options.latest_version)
 
-    feed_merger = FeedMerger(a_schedule, b_schedule, merged_schedule,
-                             problem_reporter)
-    feed_merger.add_default_mergers()
-
-    feed_merger.get_merger(StopMerger).set_largest_stop_distance(float(
-        options.largest_stop_distance))
-    feed_merger.get_merger(ShapeMerger).set_largest_shape_distance(float(
-        options.largest_shape_distance))
-
-    if options.cutoff_date is not None:
-        service_period_merger = feed_merger.get_merger(ServicePeriodMerger)
-        service_period_merger.disjoin_calendars(options.cutoff_date)
-
-    if feed_merger.merge_schedules():
-        feed_merger.get_merged_schedule().write_google_transit_feed(merged_feed_path)
+    def add_mergers(feed_merger):
+        feed_merger.add_default_mergers()
+        stop_merger = feed_merger.get_merger(StopMerger)
+        stop_merger.set_largest_stop_distance(float(
+            options.largest_stop_distance))
+        stop_merger.set_match_different_ids(bool(
+            options.match_stops_by_location))
+        stop_merger.set_min_name_similarity(float(
+            options.min_stop_name_similarity))
+        shape_merger = feed_merger.get_merger(ShapeMerger)
+        shape_merger.set_largest_shape_distance(float(
+            options.largest_shape_distance))
+        shape_merger.set_merge_duplicate_shapes(bool(
+            options.merge_duplicate_shapes))
+        shape_merger.set_shape_precision(options.shape_precision)
+        trip_merger = feed_merger.get_merger(TripMerger)
+        trip_merger.set_drop_duplicate_trips(bool(options.drop_duplicate_trips))
+        trip_merger.set_duplicate_time_resolution(
+            options.duplicate_time_resolution)
+
+    if len(schedules) > 2:
+        merged, feed_merger = merge_schedule_list(
+            schedules, merged_schedule, problem_reporter, names, id_prefixes,
+            add_mergers)
+    else:
+        feed_merger = FeedMerger(schedules[0], schedules[1], merged_schedule,
+                                 problem_reporter)
+        add_mergers(feed_merger)
+
+        if options.cutoff_date is not None:
+            service_period_merger = feed_merger.get_merger(ServicePeriodMerger)
+            service_period_merger.disjoin_calendars(options.cutoff_date)
+        merged = feed_merger.merge_schedules()
+
+    if merged:
+        merged_schedule.write_google_transit_feed(
+            merged_feed_path, workers=options.workers,
+            compression_level=options.compression_level)
     else:
         merged_feed_path = None
 
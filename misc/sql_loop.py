@@ -69,7 +69,7 @@ def load_named_file(file_name, conn):
     last_dot = basename.rfind(".")
     if last_dot > 0:
         basename = basename[:last_dot]
-    file_object = open(file_name, "rb")
+    file_object = open(file_name, newline='', encoding='utf-8-sig')
     load_file(file_object, basename, conn)
 
 
@@ -130,9 +130,20 @@ def main():
     parser.add_option(
         '-i', '--interactive', dest='interactive', action='store_true', help='Go into command prompt mode'
     )
+    parser.add_option(
+        '-g', '--load_feed', dest='load_feed', metavar='FEED',
+        help='Load the GTFS feed FEED with transitfeed and export it to the db, '
+             'which can then be reopened with --db'
+    )
     parser.add_option('', '--db', dest='database', metavar='FILE', help='sqlite db')
     parser.set_defaults(database=':memory:', interactive=False)
     options, args = parser.parse_args()
+    if options.load_feed:
+        if options.database == ':memory:':
+            parser.error('--load_feed needs a --db file to export to')
+        import transitfeed
+        schedule = transitfeed.Loader(options.load_feed).load()
+        schedule.export_sqlite(options.database)
     conn = sqlite.connect(options.database)
 
     if options.load_dir:
@@ -151,7 +162,7 @@ def main():
         cursor.execute(args[0])
         writer.writerow([desc[0] for desc in cursor.description])
         for row in cursor:
-            writer.writerow([str(v).encode('utf8') for v in row])
+            writer.writerow([str(v) for v in row])
     elif options.interactive:
         loop = SqlLoop(cursor)
         loop.cmdloop()
@@ -168,6 +179,6 @@ def profile_main():
 if __name__ == '__main__':
     try:
         import traceplus
-        traceplus.RunWithExpandedTrace(main)
+        traceplus.run_with_expanded_trace(main)
     except ImportError:
         main()
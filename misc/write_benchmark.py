@@ -0,0 +1,100 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure how fast a feed is written.
+
+A synthetic schedule with the requested number of trips is built in memory
+and then the rows of stop_times.txt are written with util.CsvUnicodeWriter,
+row by row and in one batch, and the whole feed is written with
+Schedule.write_google_transit_feed.
+"""
+
+import io
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import transitfeed
+from transitfeed import util
+
+
+def build_schedule(trip_count, stops_per_trip):
+    """Return a Schedule with one route of trip_count trips visiting
+    stops_per_trip stops."""
+    problems = transitfeed.ProblemReporter()
+    schedule = transitfeed.Schedule(problem_reporter=problems)
+    schedule.add_agency("Benchmark Agency", "http://example.com",
+                        "America/Los_Angeles")
+    service_period = schedule.get_default_service_period()
+    service_period.set_start_date("20070101")
+    service_period.set_end_date("20071231")
+    service_period.set_weekday_service(True)
+    stops = [schedule.add_stop(lng=-122.0 + i * 0.001, lat=37.0,
+                               name=u"Stop \u020b %d" % i, stop_id="S%d" % i)
+             for i in range(stops_per_trip)]
+    route = schedule.add_route("1", "One", "Bus")
+    for i in range(trip_count):
+        trip = route.add_trip(schedule, "Headsign", trip_id="T%06d" % i)
+        for j, stop in enumerate(stops):
+            secs = 21600 + i * 60 + j * 90
+            trip.add_stop_time_object(transitfeed.StopTime(
+                problems, stop, arrival_secs=secs, departure_secs=secs))
+    return schedule
+
+
+def time_call(name, row_count, function, *args, **kwargs):
+    start = time.time()
+    function(*args, **kwargs)
+    elapsed = time.time() - start
+    print("%-32s %8.3f s %12.0f rows/s" % (name, elapsed, row_count / elapsed))
+
+
+def write_rows(rows):
+    writer = util.CsvUnicodeWriter(io.StringIO(newline=''))
+    for row in rows:
+        writer.writerow(row)
+
+
+def write_rows_batched(rows):
+    writer = util.CsvUnicodeWriter(io.StringIO(newline=''))
+    writer.writerows(rows)
+
+
+def main():
+    parser = optparse.OptionParser(usage='usage: %prog [options]')
+    parser.add_option('--trips', dest='trips', type='int', default=10000,
+                      help='number of trips in the schedule')
+    parser.add_option('--stops_per_trip', dest='stops_per_trip', type='int',
+                      default=30, help='number of stop times of each trip')
+    parser.add_option('--workers', dest='workers', type='int', default=4,
+                      help='number of threads for the parallel write')
+    (options, args) = parser.parse_args()
+
+    schedule = build_schedule(options.trips, options.stops_per_trip)
+    rows = list(schedule._generate_stop_times_rows())
+    print("%d stop_times rows" % len(rows))
+    time_call("CsvUnicodeWriter.writerow", len(rows), write_rows, rows)
+    time_call("CsvUnicodeWriter.writerows", len(rows), write_rows_batched, rows)
+    time_call("write feed", len(rows), schedule.write_google_transit_feed,
+              io.BytesIO())
+    time_call("write feed, %d workers" % options.workers, len(rows),
+              schedule.write_google_transit_feed, io.BytesIO(),
+              workers=options.workers)
+
+
+if __name__ == '__main__':
+    main()
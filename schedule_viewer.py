@@ -17,7 +17,6 @@ An example application that uses the transitfeed module.
 You must provide a Google Maps API key.
 """
 
-import bisect
 import urllib.parse
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from gtfsscheduleviewer.marey_graph import MareyGraph
@@ -263,7 +262,13 @@ class ScheduleRequestHandler(BaseHTTPRequestHandler):
 
             sample = []
             for t in trips[start_sample_index:start_sample_index + sample_size]:
-                sample.append((t.get_start_time(), t.trip_id))
+                # For a frequency-based trip show its next run after 'time'
+                # instead of the start time of its template.
+                next_runs = t.get_frequency_start_times_after(time, 1)
+                if next_runs:
+                    sample.append((next_runs[0], t.trip_id))
+                else:
+                    sample.append((t.get_start_time(), t.trip_id))
 
             patterns.append((name, pattern_id, start_sample_index, sample,
                              num_after_sample, (0, 1)[has_non_zero_trip_type]))
@@ -400,28 +405,11 @@ class ScheduleRequestHandler(BaseHTTPRequestHandler):
         time = int(params.get('time', 0))
         date = params.get('date', "")
 
-        time_trips = stop.get_stop_time_trips(schedule)
-        time_trips.sort()  # OPT: use bisect.insort to make this O(N*ln(N)) -> O(N)
-        # Keep the first 5 after param 'time'.
-        # Need make a tuple to find correct bisect point
-        time_trips = time_trips[bisect.bisect_left(time_trips, (time, 0)):]
-        time_trips = time_trips[:5]
+        departures = schedule.get_departure_board().next_departures(
+            stop.stop_id, date, time, 5)
         # TODO: combine times for a route to show next 2 departure times
         result = []
-        for time, (trip, index), tp in time_trips:
-            service_id = trip.service_id
-            service_period = schedule.get_service_period(service_id)
-            if date and not service_period.is_active_on(date):
-                continue
-            headsign = None
-            # Find the most recent headsign from the StopTime objects
-            for stoptime in trip.get_stop_times()[index::-1]:
-                if stoptime.stop_headsign:
-                    headsign = stoptime.stop_headsign
-                    break
-            # If stop_headsign isn't found, look for a trip_headsign
-            if not headsign:
-                headsign = trip.trip_headsign
+        for time, trip, index, headsign, tp in departures:
             route = schedule.get_route(trip.route_id)
             trip_name = ''
             if route.route_short_name:
@@ -0,0 +1,92 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cut a GTFS feed down to some routes, a bounding box or a date range.
+
+The trips that match every given option are kept with everything they need:
+their stops and parent stations, routes, agencies, shapes, service periods,
+and the fares and transfers between what is kept.
+
+For usage information run subset_feed.py --help
+"""
+
+import transitfeed
+from transitfeed import util
+
+
+def parse_float_list(parser, option, value, count):
+    try:
+        values = [float(v) for v in value.split(',')]
+    except ValueError:
+        values = []
+    if len(values) != count:
+        parser.error('%s needs %d comma separated numbers' % (option, count))
+    return values
+
+
+def main():
+    usage = \
+        '''%prog [options] <input GTFS.zip> <output GTFS.zip>
+
+Writes the part of the input feed used by the trips that match every given
+option to the output feed.
+'''
+    parser = util.OptionParserLongError(
+        usage=usage, version='%prog ' + transitfeed.__version__)
+    parser.add_option('-r', '--routes', dest='routes', metavar='ROUTE_IDS',
+                      help='Keep the trips of these comma separated route_ids')
+    parser.add_option('-b', '--bounding_box', dest='bounding_box',
+                      metavar='MIN_LAT,MIN_LON,MAX_LAT,MAX_LON',
+                      help='Keep the trips that stop in this box at least once')
+    parser.add_option('-d', '--dates', dest='dates', metavar='START,END',
+                      help='Keep the trips running on a date from START to END, '
+                           'as YYYYMMDD, and remove the other dates')
+    parser.add_option('-m', '--memory_db', dest='memory_db', action='store_true',
+                      help='Use in-memory sqlite databases')
+    parser.add_option('-s', '--sort', dest='sort', action='store_true',
+                      help='Sort the rows of the output feed by id')
+    parser.set_defaults(memory_db=False, sort=False)
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error('You must provide the paths of the input and output feeds.')
+
+    route_ids = None
+    if options.routes is not None:
+        route_ids = options.routes.split(',')
+    bounding_box = None
+    if options.bounding_box is not None:
+        bounding_box = parse_float_list(parser, '--bounding_box',
+                                        options.bounding_box, 4)
+    date_range = None
+    if options.dates is not None:
+        date_range = options.dates.split(',')
+        if len(date_range) != 2 or not all(map(util.is_valid_date, date_range)):
+            parser.error('--dates needs two comma separated YYYYMMDD dates')
+        if date_range[0] > date_range[1]:
+            parser.error('The START date of --dates is after its END date')
+
+    problems = transitfeed.ProblemReporter()
+    schedule = transitfeed.Loader(args[0], loader_problems=problems,
+                                  memory_db=options.memory_db).load()
+    subset = transitfeed.subset_schedule(
+        schedule, route_ids=route_ids, bounding_box=bounding_box,
+        date_range=date_range, problems=problems, memory_db=options.memory_db)
+    print('Kept %d of %d trips, %d of %d stops and %d of %d routes' % (
+        len(subset.trips), len(schedule.trips), len(subset.stops),
+        len(schedule.stops), len(subset.routes), len(schedule.routes)))
+    subset.write_google_transit_feed(args[1], sort=options.sort)
+
+
+if __name__ == '__main__':
+    util.run_with_crash_handler(main)
@@ -300,6 +300,30 @@ class TestRouteKML(util.TestCase):
         self.assertEquals(len(route_folders), 1)
 
 
+class TestFrequencyTripsKML(util.TestCase):
+    """Tests the KML of frequency-based trips."""
+
+    def setUp(self):
+        self.schedule = util.build_small_network(self)
+        self.kmlwriter = kmlwriter.KMLWriter()
+        self.kmlwriter.altitude_per_sec = 1.0
+        self.parent = Et.Element('parent')
+
+    def testCreateRouteTripsFolder(self):
+        folder = self.kmlwriter._create_route_trips_folder(
+            self.parent, self.schedule.get_route('0'))
+        # The runs of trip4 aren't drawn one by one
+        placemarks = dict((placemark.find('name').text, placemark)
+                          for placemark in folder.findall('Placemark'))
+        self.assertEqual(['trip1', 'trip2', 'trip3', 'trip4'],
+                         sorted(placemarks))
+        self.assertEqual('Headsign: Headsign<br/>'
+                         'Runs: 6 (10:00:00-11:00:00 every 600s)',
+                         placemarks['trip4'].find('description').text)
+        self.assertEqual('Headsign: Headsign',
+                         placemarks['trip1'].find('description').text)
+
+
 class TestShapesKML(util.TestCase):
     """Tests the shapes folder KML generation methods of KMLWriter."""
 
@@ -331,17 +331,17 @@ class TestFeedMerger(util.TestCase):
         s2 = transitfeed.Stop(stop_id='2')
         s3 = transitfeed.Stop(stop_id='3')
         self.fm.register(s1, s2, s3)
-        self.assertEquals(self.fm.a_merge_map, {s1: s3})
+        self.assertEquals(self.fm.a_merge_map.items(), [(s1, s3)])
         self.assertEquals('3', s1._migrated_entity.stop_id)
-        self.assertEquals(self.fm.b_merge_map, {s2: s3})
+        self.assertEquals(self.fm.b_merge_map.items(), [(s2, s3)])
         self.assertEquals('3', s2._migrated_entity.stop_id)
 
     def testRegisterNone(self):
         s2 = transitfeed.Stop(stop_id='2')
         s3 = transitfeed.Stop(stop_id='3')
         self.fm.register(None, s2, s3)
-        self.assertEquals(self.fm.a_merge_map, {})
-        self.assertEquals(self.fm.b_merge_map, {s2: s3})
+        self.assertEquals(self.fm.a_merge_map.items(), [])
+        self.assertEquals(self.fm.b_merge_map.items(), [(s2, s3)])
         self.assertEquals('3', s2._migrated_entity.stop_id)
 
     def testGenerateId_Prefix(self):
@@ -400,6 +400,120 @@ class TestFeedMerger(util.TestCase):
     def testGetMerger_Error(self):
         self.assertRaises(LookupError, self.fm.get_merger, TestFeedMerger.Merger)
 
+    def testGetMergePlan(self):
+        self.fm.add_default_mergers()
+        self.assertEquals(
+            [[merge.AgencyMerger, merge.StopMerger, merge.ServicePeriodMerger,
+              merge.FareMerger, merge.ShapeMerger],
+             [merge.RouteMerger],
+             [merge.TripMerger, merge.FareRuleMerger]],
+            [[type(merger) for merger in stage]
+             for stage in self.fm.get_merge_plan()])
+
+    def testGetMergePlan_Subclass(self):
+        class MyStopMerger(merge.StopMerger):
+            pass
+
+        self.fm.add_merger(merge.TransferMerger(self.fm))
+        self.fm.add_merger(MyStopMerger(self.fm))
+        self.assertEquals([[MyStopMerger], [merge.TransferMerger]],
+                          [[type(merger) for merger in stage]
+                           for stage in self.fm.get_merge_plan()])
+
+    def testGetMergePlan_Circular(self):
+        class MergerA(merge.DataSetMerger):
+            pass
+
+        class MergerB(merge.DataSetMerger):
+            pass
+
+        self.fm.MERGER_DEPENDENCIES = {MergerA: (MergerB,), MergerB: (MergerA,)}
+        self.fm.add_merger(MergerA(self.fm))
+        self.fm.add_merger(MergerB(self.fm))
+        self.assertRaises(merge.MergeError, self.fm.get_merge_plan)
+
+
+class TestMergeScheduleList(util.TestCase):
+
+    def setUp(self):
+        self.a_schedule = transitfeed.Schedule()
+        self.b_schedule = transitfeed.Schedule()
+        self.fm = merge.FeedMerger(self.a_schedule, self.b_schedule,
+                                   transitfeed.Schedule(), None,
+                                   schedule_names=('', 'feed2'),
+                                   id_prefixes=('', 'f2_'))
+
+    def testIdPrefixes(self):
+        self.assertEquals('feed2', self.fm.get_schedule_name(self.b_schedule))
+        self.assertEquals('s1', self.fm.add_id_prefix(self.a_schedule, 's1'))
+        self.assertEquals('f2_s1', self.fm.add_id_prefix(self.b_schedule, 's1'))
+        self.assertEquals('f2_', self.fm.add_id_prefix(self.b_schedule, None))
+
+        sm = merge.StopMerger(self.fm)
+        stop = transitfeed.Stop(30.0, 30.0, 'Stop', 's1')
+        self.assertEquals('f2_s1',
+                          sm._migrate(stop, self.b_schedule, False).stop_id)
+        self.assertEquals('s1', sm._migrate(stop, self.a_schedule, False).stop_id)
+        self.fm._idnum = 10
+        self.assertEquals('f2_s1_merged_11',
+                          sm._migrate(stop, self.b_schedule, True).stop_id)
+
+    def testMergeThreeSchedules(self):
+        schedules = [util.build_small_network(self) for _ in range(3)]
+        merged_schedule = transitfeed.Schedule()
+        # Service periods and trips are always copied, which is reported as
+        # MergeNotImplemented
+        accumulator = util.RecordingProblemAccumulator(
+            self, ('ExpirationDate', 'MergeNotImplemented'))
+        merged, feed_mergers = merge.merge_schedule_list(
+            schedules, merged_schedule,
+            merge.MergeProblemReporter(accumulator), ['a', 'b', 'c'],
+            ['a_', 'b_', 'c_'])
+        self.assert_(merged)
+        self.assertEquals(3, len(feed_mergers))
+        accumulator.assert_no_more_exceptions()
+
+        self.assertEquals(['%s_%s' % (prefix, stop_id)
+                           for prefix in 'abc' for stop_id in 'ABCD'],
+                          sorted(merged_schedule.stops))
+        self.assertEquals(['%s_trip%d' % (prefix, i)
+                           for prefix in 'abc' for i in range(1, 5)],
+                          sorted(merged_schedule.trips))
+        self.assertEquals(3, len(merged_schedule.get_agency_list()))
+        self.assertEquals(3, len(merged_schedule.get_route_list()))
+        for prefix in 'abc':
+            trip = merged_schedule.get_trip(prefix + '_trip1')
+            self.assertEquals(prefix + '_0', trip.route_id)
+            self.assertEquals(
+                [(prefix + '_A', 1, 28800), (prefix + '_B', 2, 29400),
+                 (prefix + '_C', 3, 30000)],
+                [(st.stop_id, st.stop_sequence, st.arrival_secs)
+                 for st in trip.get_stop_times()])
+        self.assertEquals([(36000, 39600, 600)],
+                          [t[:3] for t in merged_schedule.get_trip(
+                              'c_trip4').get_frequency_tuples()])
+
+    def testSamePrefixes(self):
+        self.assertRaises(merge.MergeError, merge.merge_schedule_list,
+                          [self.a_schedule, self.b_schedule],
+                          transitfeed.Schedule(), None, ['a', 'b'], ['x_', 'x_'])
+
+    def testStatsTable(self):
+        feed_mergers = []
+        for stats in ((1, 2, 3), (10, 20, 30)):
+            feed_merger = merge.FeedMerger(transitfeed.Schedule(),
+                                           transitfeed.Schedule(),
+                                           transitfeed.Schedule(), None)
+            merger = merge.StopMerger(feed_merger)
+            (merger._num_merged, merger._num_not_merged_a,
+             merger._num_not_merged_b) = stats
+            feed_merger.add_merger(merger)
+            feed_mergers.append(feed_merger)
+        html = merge.HTMLProblemAccumulator._generate_stats_table(feed_mergers)
+        self.assertTrue(re.search(r'Stops</th>\s*<td class="header">11</td>'
+                                  r'<td class="header">22</td>'
+                                  r'<td class="header">33</td>', html), html)
+
 
 class TestServicePeriodMerger(util.TestCase):
 
@@ -423,6 +537,12 @@ class TestServicePeriodMerger(util.TestCase):
         self.fm.a_schedule.add_service_period_object(self.sp1)
         self.fm.b_schedule.add_service_period_object(self.sp2)
 
+    def _RecordProblems(self):
+        """Report the problems of the feed merger to a recording accumulator."""
+        accumulator = util.RecordingProblemAccumulator(self)
+        self.fm.problem_reporter = merge.MergeProblemReporter(accumulator)
+        return accumulator
+
     def testCheckDisjoint_True(self):
         self._AddTwoPeriods('20071213', '20071231',
                             '20080101', '20080201')
@@ -443,14 +563,70 @@ class TestServicePeriodMerger(util.TestCase):
                             '20080101', '20090101')
         self.assert_(not self.spm.check_disjoint_calendars())
 
+    def testCheckDisjoint_DaysOfWeek(self):
+        self._AddTwoPeriods('20080101', '20080301',
+                            '20080101', '20080301')
+        self.sp1.day_of_week = [True] * 5 + [False] * 2
+        self.sp2.day_of_week = [False] * 5 + [True] * 2
+        self.assert_(self.spm.check_disjoint_calendars())
+        self.sp2.set_date_has_service('20080104')  # a Friday
+        self.assert_(not self.spm.check_disjoint_calendars())
+
+    def testCheckDisjoint_Exceptions(self):
+        self._AddTwoPeriods('20071213', '20080101',
+                            '20080101', '20080201')
+        self.assert_(not self.spm.check_disjoint_calendars())
+        self.sp1.set_date_has_service('20080101', False)
+        self.assert_(self.spm.check_disjoint_calendars())
+        self.sp2.set_date_has_service('20071215')
+        self.assert_(not self.spm.check_disjoint_calendars())
+
     def testDisjoinCalendars(self):
         self._AddTwoPeriods('20071213', '20080201',
                             '20080101', '20080301')
+        accumulator = self._RecordProblems()
         self.spm.disjoin_calendars('20080101')
         self.assertEquals(self.sp1.start_date, '20071213')
         self.assertEquals(self.sp1.end_date, '20071231')
         self.assertEquals(self.sp2.start_date, '20080101')
         self.assertEquals(self.sp2.end_date, '20080301')
+        self.assert_(self.spm.check_disjoint_calendars())
+        e = accumulator.pop_exception('CalendarsTruncated')
+        self.assertEquals('old', e.feed_name)
+        self.assertEquals('test1', e.service_ids)
+        accumulator.assert_no_more_exceptions()
+
+    def testDisjoinCalendars_Truncated(self):
+        self._AddTwoPeriods('20071213', '20071220',
+                            '20071201', '20080301')
+        sp3 = transitfeed.ServicePeriod(
+            field_list=['test3', '20080105', '20080110'] + ['1'] * 7)
+        self.fm.a_schedule.add_service_period_object(sp3)
+        self.fm.a_schedule.add_agency('Agency', 'http://agency',
+                                      'Europe/Berlin', agency_id='agency')
+        route = self.fm.a_schedule.add_route('R', 'Route', 'Bus')
+        route.add_trip(self.fm.a_schedule, trip_id='trip3', service_period=sp3)
+        accumulator = self._RecordProblems()
+        self.assertEquals((['test3'], ['test2']),
+                          self.spm.disjoin_calendars('20080101'))
+        self.assertEquals((['test3'], ['test2']),
+                          self.spm.truncated_service_ids)
+        self.assertEquals(('20071213', '20071220'),
+                          (self.sp1.start_date, self.sp1.end_date))
+        # The old service period after the cutoff has no dates left and is
+        # removed with its trips
+        self.assertEquals((['test3'], []), self.spm.removed_service_ids)
+        self.assertEquals(['test1'], [period.service_id for period in
+                                      self.fm.a_schedule.get_service_period_list()])
+        self.assertEquals([], [trip.trip_id for trip in
+                               self.fm.a_schedule.get_trip_list()])
+        self.assertEquals('old', accumulator.pop_exception(
+            'CalendarsTruncated').feed_name)
+        e = accumulator.pop_exception('CalendarsRemoved')
+        self.assertEquals(('old', 'test3'), (e.feed_name, e.service_ids))
+        self.assertEquals('new', accumulator.pop_exception(
+            'CalendarsTruncated').feed_name)
+        accumulator.assert_no_more_exceptions()
 
     def testDisjoinCalendars_Dates(self):
         self._AddTwoPeriods('20071213', '20080201',
@@ -460,7 +636,11 @@ class TestServicePeriodMerger(util.TestCase):
         self.sp2.set_date_has_service('20071201')
         self.sp2.set_date_has_service('20081231')
 
+        accumulator = self._RecordProblems()
         self.spm.disjoin_calendars('20080101')
+        accumulator.pop_exception('CalendarsTruncated')
+        accumulator.pop_exception('CalendarsTruncated')
+        accumulator.assert_no_more_exceptions()
 
         self.assert_('20071201' in self.sp1.date_exceptions.keys())
         self.assert_('20081231' not in self.sp1.date_exceptions.keys())
@@ -854,6 +1034,62 @@ class TestStopMerger(util.TestCase):
         self.assertEquals(len(self.fm.get_merged_schedule().get_stop_list()), 1)
 
 
+class TestStopMergerNearby(util.TestCase):
+
+    def setUp(self):
+        self.fm = merge.FeedMerger(transitfeed.Schedule(), transitfeed.Schedule(),
+                                   transitfeed.Schedule(), None)
+        self.sm = merge.StopMerger(self.fm)
+        self.sm.set_match_different_ids(True)
+
+    def makeStops(self, *stops):
+        result = []
+        for stop_id, name, lat, lon in stops:
+            stop = transitfeed.Stop(lat, lon, name, stop_id)
+            stop.zone_id = 'zone1'
+            result.append(stop)
+        return result
+
+    def getMatchedIds(self, a_stops, b_stops):
+        return sorted((a.stop_id, b.stop_id, merged.stop_id) for a, b, merged in
+                      self.sm._match_nearby_stops(a_stops, b_stops))
+
+    def testMatch(self):
+        a_stops = self.makeStops(('a1', 'Main St', 30.0, 30.0),
+                                 ('a2', 'Oak Ave', 30.0, 30.0001),
+                                 ('a3', 'Main St', 31.0, 30.0))
+        # About 2m and 8m from a1, and 7m from a2
+        b_stops = self.makeStops(('b1', 'Main St.', 30.00002, 30.0),
+                                 ('b2', 'MAIN ST', 30.00007, 30.0),
+                                 ('b3', 'Oak Avenue', 30.00006, 30.0001))
+        # The most similar name wins over the closest stop
+        self.assertEquals([('a1', 'b2', 'b2'), ('a2', 'b3', 'b3')],
+                          self.getMatchedIds(a_stops, b_stops))
+
+        self.sm.set_min_name_similarity(0.9)
+        self.assertEquals([('a1', 'b2', 'b2')],
+                          self.getMatchedIds(a_stops, b_stops))
+
+    def testMatchOnce(self):
+        a_stops = self.makeStops(('a1', 'Main St', 30.0, 30.0),
+                                 ('a2', 'Main St', 30.00001, 30.0))
+        b_stops = self.makeStops(('b1', 'Main St', 30.00004, 30.0))
+        self.assertEquals([('a2', 'b1', 'b1')],
+                          self.getMatchedIds(a_stops, b_stops))
+
+    def testNoMatch(self):
+        a_stops = self.makeStops(('a1', 'Main St', 30.0, 30.0),
+                                 ('a2', 'Oak Ave', 30.0, 30.001))
+        b_stops = self.makeStops(('b1', 'Main St', 30.00002, 30.0),
+                                 ('b2', 'Elm Rd', 30.0, 30.001))
+        b_stops[0].zone_id = 'zone2'
+        self.assertEquals([], self.getMatchedIds(a_stops, b_stops))
+
+        self.sm.set_largest_stop_distance(1.0)
+        b_stops[0].zone_id = 'zone1'
+        self.assertEquals([], self.getMatchedIds(a_stops, b_stops))
+
+
 class TestRouteMerger(util.TestCase):
     fields = ['route_short_name', 'route_long_name', 'route_type',
               'route_url']
@@ -1068,6 +1304,170 @@ class TestTripMerger(util.TestCase):
         self.assertEquals(t1_in_b_merged[0].original_trip_id, 't1')
 
 
+class TestLoadAllWithoutErrors(util.TempDirTestCaseBase):
+
+    def setUp(self):
+        util.TempDirTestCaseBase.setUp(self)
+        self.schedule = util.build_small_network(self)
+        for stop in self.schedule.get_stop_list():
+            stop.location_type = 0
+        # Feeds to merge must load without warnings either
+        period = self.schedule.get_service_period('0')
+        period.end_date = '20991231'
+        period.set_date_has_service('20110704', False)
+        self.paths = []
+        for name in ('a.zip', 'b.zip'):
+            path = os.path.join(self.tempdirpath, name)
+            self.schedule.write_google_transit_feed(path)
+            self.paths.append(path)
+
+    def checkLoaded(self, schedules):
+        self.assertEquals(2, len(schedules))
+        expected = merge.load_without_errors(self.paths[0], True)
+        query = 'SELECT * FROM stop_times ORDER BY trip_id,stop_sequence'
+        for schedule in schedules:
+            self.assertEquals(sorted(expected.trips), sorted(schedule.trips))
+            self.assertEquals(sorted(expected.stops), sorted(schedule.stops))
+            self.assertEquals(expected.connection.execute(query).fetchall(),
+                              schedule.connection.execute(query).fetchall())
+
+    def testParallel(self):
+        self.checkLoaded(merge.load_all_without_errors(self.paths, True))
+
+    def testOneProcess(self):
+        self.checkLoaded(merge.load_all_without_errors(self.paths, True, 1))
+
+
+class TestTripMergerStopTimes(util.TestCase):
+
+    def setUp(self):
+        self.merged_stops = {}
+
+    def makeFeedMerger(self, memory_db):
+        a_schedule = transitfeed.Schedule(memory_db=memory_db)
+        b_schedule = transitfeed.Schedule(memory_db=memory_db)
+        merged_schedule = transitfeed.Schedule(memory_db=memory_db)
+        fm = merge.FeedMerger(a_schedule, b_schedule, merged_schedule,
+                              TestingProblemReporter(TestingProblemAccumulator()))
+        for i, stop_id in enumerate(('s1', 's2', 's3')):
+            a_schedule.add_stop(30.0, 30.0 + i * 0.01, stop_id, stop_id)
+            merged_schedule.add_stop(30.0, 30.0 + i * 0.01, stop_id,
+                                     stop_id + '_merged')
+            fm.register_ids('stop', stop_id, None, stop_id + '_merged')
+        route = a_schedule.add_route('r1', 'route 1', 'Bus')
+        for trip_id in ('t1', 't2'):
+            trip = route.add_trip(a_schedule, trip_id=trip_id)
+            for i, stop_id in enumerate(('s3', 's1', 's2')):
+                trip.add_stop_time_object(transitfeed.StopTime(
+                    None, a_schedule.get_stop(stop_id), arrival_secs=i * 60,
+                    departure_secs=i * 60 + 30))
+        # Sequences which aren't consecutive
+        a_schedule.connection.execute(
+            'UPDATE stop_times SET stop_sequence=stop_sequence*10')
+        return fm
+
+    def checkMigrateStopTimes(self, memory_db):
+        fm = self.makeFeedMerger(memory_db)
+        tm = merge.TripMerger(fm)
+        fm.register_ids('trip', 't1', None, 't1_merged')
+        # t2 was merged into a trip of b, which has the stop_times
+        fm.register_ids('trip', 't2', 't2', 't2')
+        tm._migrate_stop_times(fm.a_schedule)
+        self.assertEqual(
+            [('t1_merged', 0, 30, 's3_merged', 1),
+             ('t1_merged', 60, 90, 's1_merged', 2),
+             ('t1_merged', 120, 150, 's2_merged', 3)],
+            fm.merged_schedule.connection.execute(
+                'SELECT trip_id,arrival_secs,departure_secs,stop_id,stop_sequence '
+                'FROM stop_times ORDER BY stop_sequence').fetchall())
+        self.assertIn('stop_times', fm.merged_schedule._dirty_tables)
+
+    def testMigrateStopTimesInMemory(self):
+        self.checkMigrateStopTimes(True)
+
+    def testMigrateStopTimesAttached(self):
+        self.checkMigrateStopTimes(False)
+
+    def testGetRegisteredIds(self):
+        fm = self.makeFeedMerger(True)
+        fm.register_ids('trip', 't1', 't2', 'merged_t')
+        self.assertEqual([('stop', 's1', 's1_merged', 0),
+                          ('stop', 's2', 's2_merged', 0),
+                          ('stop', 's3', 's3_merged', 0),
+                          ('trip', 't1', 'merged_t', 1)],
+                         fm.get_registered_ids(fm.a_schedule))
+        self.assertEqual([('trip', 't2', 'merged_t', 1)],
+                         fm.get_registered_ids(fm.b_schedule))
+        # The ids are only stored in a table while migrating the stop_times
+        self.assertEqual(None, fm.merged_schedule.connection.execute(
+            "SELECT name FROM sqlite_temp_master WHERE name='merge_id_map'"
+        ).fetchone())
+
+
+class TestTripMergerDuplicates(util.TestCase):
+
+    def setUp(self):
+        self.a_schedule = util.build_small_network(self)
+        self.b_schedule = util.build_small_network(self)
+        self.fm = merge.FeedMerger(self.a_schedule, self.b_schedule,
+                                   transitfeed.Schedule(), None)
+        self.tm = merge.TripMerger(self.fm)
+        self.tm.set_drop_duplicate_trips(True)
+        for schedule in (self.a_schedule, self.b_schedule):
+            for stop in schedule.get_stop_list():
+                stop._migrated_entity = transitfeed.Stop(
+                    stop.stop_lat, stop.stop_lon, stop.stop_name,
+                    'merged_' + stop.stop_id)
+        # trip1 of b is 20 seconds later
+        self.b_schedule.connection.execute(
+            "UPDATE stop_times SET arrival_secs=arrival_secs+20, "
+            "departure_secs=departure_secs+20 WHERE trip_id='trip1'")
+
+    def getDuplicateIds(self):
+        duplicates, a_not_merged = self.tm._find_duplicate_trips(
+            self.a_schedule.get_trip_list(),
+            self.tm._get_trip_fingerprints(self.a_schedule),
+            self.tm._get_trip_fingerprints(self.b_schedule))
+        return (sorted((b_trip_id, a.trip_id)
+                       for b_trip_id, a in duplicates.items()),
+                sorted(a.trip_id for a in a_not_merged))
+
+    def testExactDuplicates(self):
+        self.assertEquals(
+            ([('trip2', 'trip2'), ('trip3', 'trip3'), ('trip4', 'trip4')],
+             ['trip1']),
+            self.getDuplicateIds())
+
+    def testNearDuplicates(self):
+        self.tm.set_duplicate_time_resolution(60)
+        self.assertEquals(
+            ([('trip1', 'trip1'), ('trip2', 'trip2'), ('trip3', 'trip3'),
+              ('trip4', 'trip4')], []),
+            self.getDuplicateIds())
+
+    def testDifferentDatesAndFrequencies(self):
+        self.b_schedule.get_service_period('0').set_date_has_service(
+            '20110704', False)
+        self.assertEquals(([], ['trip1', 'trip2', 'trip3', 'trip4']),
+                          self.getDuplicateIds())
+
+        self.b_schedule = util.build_small_network(self)
+        self.b_schedule.get_trip('trip4').add_frequency('12:00:00', '13:00:00',
+                                                        600)
+        for stop in self.b_schedule.get_stop_list():
+            stop._migrated_entity = self.a_schedule.get_stop(
+                stop.stop_id)._migrated_entity
+        self.assertEquals(
+            ([('trip1', 'trip1'), ('trip2', 'trip2'), ('trip3', 'trip3')],
+             ['trip4']),
+            self.getDuplicateIds())
+
+    def testMergeStats(self):
+        self.assertEquals((0, 0, 0), self.tm.get_merge_stats())
+        self.tm.set_drop_duplicate_trips(False)
+        self.assert_(self.tm.get_merge_stats() is None)
+
+
 class TestFareMerger(util.TestCase):
 
     def setUp(self):
@@ -1197,6 +1597,40 @@ class TestShapeMerger(util.TestCase):
 
         self.accumulator.assertExpectedProblemsReported(self)
 
+    def testFindDuplicateShapes(self):
+        s4 = self.s1.copy()
+        s4.shape_id = 's4'
+        for shape in (self.s1, self.s2, s4):
+            self.fm.a_schedule.add_shape_object(shape)
+        # Less than the precision away from s1
+        b1 = transitfeed.Shape('x')
+        for lat, lon, _ in self.s1.points:
+            b1.add_point(lat + 0.000001, lon)
+        self.s3.shape_id = 's2'
+        self.fm.b_schedule.add_shape_object(b1)
+        self.fm.b_schedule.add_shape_object(self.s3)
+
+        plan = self.sm._find_duplicate_shapes()
+        self.assertEquals(3, len(plan))
+        schedule, shape, new_id, a_shapes, b_shapes = plan[0]
+        self.assertTrue(schedule is self.fm.b_schedule)
+        self.assertTrue(shape is b1)
+        self.assertFalse(new_id)
+        self.assertEquals(['s1', 's4'], [s.shape_id for s in a_shapes])
+        self.assertEquals(['x'], [s.shape_id for s in b_shapes])
+        # s3 and s2 have the same id but a different geometry
+        schedule, shape, new_id, a_shapes, b_shapes = plan[1]
+        self.assertTrue(shape is self.s3)
+        self.assertTrue(new_id)
+        self.assertEquals(([], [self.s3]), (a_shapes, b_shapes))
+        schedule, shape, new_id, a_shapes, b_shapes = plan[2]
+        self.assertTrue(schedule is self.fm.a_schedule)
+        self.assertTrue(shape is self.s2)
+        self.assertTrue(new_id)
+
+        self.sm.set_shape_precision(7)
+        self.assertEquals(4, len(self.sm._find_duplicate_shapes()))
+
     def _AddShapesApart(self):
         """Adds two shapes to the schedules.
 
@@ -1416,6 +1850,122 @@ class TestTransferMerger(util.TestCase):
             self.assertEquals("1a", MergedScheduleStopName(transfers[1].from_stop_id))
 
 
+class TestMergeSchedules(util.TestCase):
+    """Runs the default mergers of a FeedMerger on two small networks."""
+
+    def setUp(self):
+        self.a_schedule = util.build_small_network(self)
+        self.b_schedule = util.build_small_network(self)
+
+    def merge(self, **options):
+        """Merge a_schedule and b_schedule with the default mergers, with
+        options given as {'ClassName': {'setter': value}}, and return the
+        merged schedule."""
+        merged_schedule = transitfeed.Schedule(
+            problem_reporter=util.get_test_failure_problem_reporter(self))
+        # Service periods are always copied, which is reported as
+        # MergeNotImplemented
+        self.accumulator = util.RecordingProblemAccumulator(
+            self, ('ExpirationDate', 'MergeNotImplemented'))
+        self.fm = merge.FeedMerger(
+            self.a_schedule, self.b_schedule, merged_schedule,
+            merge.MergeProblemReporter(self.accumulator))
+        self.fm.add_default_mergers()
+        # Both networks run on the same dates
+        self.fm.get_merger(
+            merge.ServicePeriodMerger).require_disjoint_calendars = False
+        for class_name, setters in options.items():
+            merger = self.fm.get_merger(getattr(merge, class_name))
+            for setter, value in setters.items():
+                getattr(merger, setter)(value)
+        self.assert_(self.fm.merge_schedules())
+        return merged_schedule
+
+    def getStopTimes(self, schedule, trip_id):
+        return [(st.stop_id, st.arrival_secs)
+                for st in schedule.get_trip(trip_id).get_stop_times()]
+
+    def testMatchStopsByLocation(self):
+        # The stops of b have other ids and slightly different names
+        self.b_schedule = transitfeed.Schedule()
+        self.b_schedule.add_agency('Agency', 'http://iflyagency.com',
+                                   'America/Los_Angeles')
+        period = self.b_schedule.get_default_service_period()
+        period.set_start_date('20110101')
+        period.set_end_date('20111231')
+        period.set_weekday_service(True)
+        route = self.b_schedule.add_route('2', 'Two', 'Bus')
+        trip = route.add_trip(self.b_schedule, 'Headsign', trip_id='b_trip')
+        for i, stop_id in enumerate('AB'):
+            stop = self.b_schedule.add_stop(lng=140.0 + i * 0.01, lat=0.00001,
+                                            name=stop_id + '.',
+                                            stop_id='b_' + stop_id)
+            trip.add_stop_time_object(transitfeed.StopTime(
+                self.b_schedule.problem_reporter, stop,
+                arrival_secs=40000 + i * 600, departure_secs=40000 + i * 600))
+
+        merged_schedule = self.merge(
+            StopMerger={'set_match_different_ids': True,
+                        'set_min_name_similarity': 0.6})
+        self.assertEquals(['C', 'D', 'b_A', 'b_B'], sorted(merged_schedule.stops))
+        self.assertEquals([('b_A', 28800), ('b_B', 29400), ('C', 30000)],
+                          self.getStopTimes(merged_schedule, 'trip1'))
+        self.assertEquals([('b_A', 40000), ('b_B', 40600)],
+                          self.getStopTimes(merged_schedule, 'b_trip'))
+        self.assertEquals((2, 2, 0), self.fm.get_merger(
+            merge.StopMerger).get_merge_stats())
+
+    def testDropDuplicateTrips(self):
+        # trip1 of b is 20 seconds later
+        self.b_schedule.connection.execute(
+            "UPDATE stop_times SET arrival_secs=arrival_secs+20, "
+            "departure_secs=departure_secs+20 WHERE trip_id='trip1'")
+        merged_schedule = self.merge(
+            TripMerger={'set_drop_duplicate_trips': True})
+        trip_ids = sorted(merged_schedule.trips)
+        self.assertEquals(['trip1', 'trip2', 'trip3', 'trip4'],
+                          trip_ids[:1] + trip_ids[2:])
+        self.assert_(trip_ids[1].startswith('trip1_merged_'))
+        self.assertEquals((3, 1, 1), self.fm.get_merger(
+            merge.TripMerger).get_merge_stats())
+        # The old trip1 is kept with a new id and its own stop_times
+        self.assertEquals([('A', 28800), ('B', 29400), ('C', 30000)],
+                          self.getStopTimes(merged_schedule, trip_ids[1]))
+        self.assertEquals([('A', 28820), ('B', 29420), ('C', 30020)],
+                          self.getStopTimes(merged_schedule, 'trip1'))
+        # The stop_times of the duplicates are copied once
+        self.assertEquals([('B', 29700), ('D', 30600)],
+                          self.getStopTimes(merged_schedule, 'trip2'))
+
+    def testMergeDuplicateShapes(self):
+        line = [(0, 140.0), (0, 140.01), (0, 140.02)]
+        for schedule, shapes in (
+                (self.a_schedule, (('a_line', line, 'trip1'),
+                                   ('other', [(0, 140.01), (0, 140.03)],
+                                    'trip2'))),
+                (self.b_schedule, (('b_line', line, 'trip1'),))):
+            for shape_id, points, trip_id in shapes:
+                shape = transitfeed.Shape(shape_id)
+                for lat, lon in points:
+                    shape.add_point(lat, lon)
+                schedule.add_shape_object(shape)
+                schedule.get_trip(trip_id).shape_id = shape_id
+        merged_schedule = self.merge(
+            ShapeMerger={'set_merge_duplicate_shapes': True})
+        self.assertEquals(['b_line', 'other'],
+                          sorted(s.shape_id for s in merged_schedule.get_shape_list()))
+        self.assertEquals((1, 1, 0), self.fm.get_merger(
+            merge.ShapeMerger).get_merge_stats())
+        # The trips of both schedules use the shape of b_schedule
+        for merge_map, schedule in ((self.fm.a_merge_map, self.a_schedule),
+                                    (self.fm.b_merge_map, self.b_schedule)):
+            trip = merge_map[schedule.get_trip('trip1')]
+            self.assertEquals('b_line',
+                              merged_schedule.get_trip(trip.trip_id).shape_id)
+        self.assertEquals('other', self.fm.a_merge_map[
+            self.a_schedule.get_trip('trip2')].shape_id)
+
+
 class TestExceptionProblemAccumulator(util.TestCase):
 
     def setUp(self):
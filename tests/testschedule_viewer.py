@@ -0,0 +1,46 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the schedule_viewer module."""
+
+import schedule_viewer
+from tests import util
+
+
+class FakeServer:
+    def __init__(self, schedule):
+        self.schedule = schedule
+
+
+class RoutePatternsTestCase(util.TestCase):
+
+    def setUp(self):
+        # The handler is only used to answer requests, without a connection
+        self.handler = schedule_viewer.ScheduleRequestHandler.__new__(
+            schedule_viewer.ScheduleRequestHandler)
+        self.handler.server = FakeServer(util.build_small_network(self))
+
+    def getSamples(self, time):
+        patterns = self.handler.handle_json_GET_routepatterns(
+            {'route': '0', 'time': str(time), 'date': '20110103'})
+        return sorted(sample for pattern in patterns for sample in pattern[3])
+
+    def testFrequencySample(self):
+        # trip4 runs every 10 minutes from 10:00 to 11:00, its next run after
+        # the time is sampled instead of the first one
+        self.assertEqual([(28800, 'trip1'), (29100, 'trip3'), (29700, 'trip2'),
+                          (37200, 'trip4')], self.getSamples(36700))
+        self.assertEqual((36000, 'trip4'), self.getSamples(0)[-1])
+        # After the last run the start time of the trip is shown
+        self.assertEqual((36000, 'trip4'), self.getSamples(40000)[-1])
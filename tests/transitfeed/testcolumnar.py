@@ -0,0 +1,90 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the columnar module.
+
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from tests import util
+import transitfeed
+
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+
+@unittest.skipIf(HAS_PYARROW, 'pyarrow is installed')
+class NoPyarrowTestCase(util.TestCase):
+
+    def testImportError(self):
+        schedule = util.build_small_network(self)
+        self.assertRaises(ImportError, transitfeed.get_arrow_table, schedule,
+                          'stops')
+
+
+@unittest.skipUnless(HAS_PYARROW, 'pyarrow is not installed')
+class ColumnarTestCase(util.TempFileTestCaseBase):
+
+    def setUp(self):
+        util.TempFileTestCaseBase.setUp(self)
+        self.schedule = util.build_small_network(self)
+        for stop in self.schedule.get_stop_list():
+            stop.location_type = 0
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        util.TempFileTestCaseBase.tearDown(self)
+
+    def testTypes(self):
+        import pyarrow
+        table = transitfeed.get_arrow_table(self.schedule, 'stop_times')
+        self.assertTrue(pyarrow.types.is_dictionary(
+            table.schema.field('trip_id').type))
+        self.assertEqual(pyarrow.int32(), table.schema.field('arrival_secs').type)
+        self.assertEqual(self.schedule.connection.execute(
+            'SELECT trip_id,arrival_secs FROM stop_times '
+            'ORDER BY trip_id,stop_sequence').fetchall(),
+            list(zip(table.column('trip_id').to_pylist(),
+                     table.column('arrival_secs').to_pylist())))
+        stops = transitfeed.get_arrow_table(self.schedule, 'stops')
+        self.assertEqual(pyarrow.float64(), stops.schema.field('stop_lat').type)
+        self.assertRaises(ValueError, transitfeed.get_arrow_table, self.schedule,
+                          'agency')
+
+    def testLoadStopTimes(self):
+        self.schedule.write_google_transit_feed(self.tempfilepath)
+        paths = self.schedule.export_parquet(self.directory)
+        self.assertEqual(['%s.parquet' % t for t in transitfeed.ARROW_TABLES],
+                         [os.path.basename(p) for p in paths])
+
+        # Load everything but stop_times from the feed
+        feed_path = os.path.join(self.directory, 'feed.zip')
+        with zipfile.ZipFile(self.tempfilepath) as source, \
+                zipfile.ZipFile(feed_path, 'w') as feed:
+            for name in source.namelist():
+                if name != 'stop_times.txt':
+                    feed.writestr(name, source.read(name))
+        loaded = transitfeed.Loader(
+            feed_path,
+            loader_problems=util.get_test_failure_problem_reporter(
+                self, ("ExpirationDate",)),
+            stop_times_parquet=os.path.join(
+                self.directory, 'stop_times.parquet')).load()
+        query = 'SELECT * FROM stop_times ORDER BY trip_id,stop_sequence'
+        self.assertEqual(self.schedule.connection.execute(query).fetchall(),
+                         loaded.connection.execute(query).fetchall())
@@ -0,0 +1,89 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the connectionscan module.
+from tests import util
+import transitfeed
+
+
+class ConnectionScanPlannerTestCase(util.TestCase):
+    def setUp(self):
+        self.schedule = util.build_small_network(self)
+
+    def testConnectionCount(self):
+        planner = transitfeed.ConnectionScanPlanner(self.schedule)
+        self.assertEqual(2 + 1 + 1 + 6, planner.get_connection_count())
+
+    def testEarliestArrival(self):
+        planner = transitfeed.ConnectionScanPlanner(self.schedule)
+        self.assertEqual(30600, planner.get_earliest_arrival("A", "D", "20110103", 28000))
+        self.assertEqual(32400, planner.get_earliest_arrival("A", "D", "20110103", 28900))
+        self.assertEqual(None, planner.get_earliest_arrival("A", "D", "20110103", 29200))
+        self.assertEqual(None, planner.get_earliest_arrival("A", "D", "20110101", 28000))
+        self.assertEqual(None, planner.get_earliest_arrival("D", "A", "20110103", 0))
+
+    def testFrequencyRuns(self):
+        planner = transitfeed.ConnectionScanPlanner(self.schedule)
+        self.assertEqual(37500, planner.get_earliest_arrival("C", "D", None, 37000))
+
+    def testJourney(self):
+        planner = transitfeed.ConnectionScanPlanner(self.schedule)
+        self.assertEqual([("trip1", "A", 28800, "B", 29400),
+                          ("trip2", "B", 29700, "D", 30600)],
+                         planner.get_journey("A", "D", "20110103", 28000))
+        self.assertEqual([], planner.get_journey("A", "A", "20110103", 28000))
+        self.assertEqual(None, planner.get_journey("D", "A", "20110103", 28000))
+
+    def testChangeTime(self):
+        self.schedule.add_transfer_object(transitfeed.Transfer(
+            from_stop_id="B", to_stop_id="B", transfer_type=2, min_transfer_time=600))
+        planner = transitfeed.ConnectionScanPlanner(self.schedule)
+        self.assertEqual(32400, planner.get_earliest_arrival("A", "D", "20110103", 28000))
+
+    def testFootpath(self):
+        self.schedule.add_transfer_object(transitfeed.Transfer(
+            from_stop_id="C", to_stop_id="D", transfer_type=2, min_transfer_time=120))
+        planner = transitfeed.ConnectionScanPlanner(self.schedule)
+        self.assertEqual(30120, planner.get_earliest_arrival("A", "D", "20110103", 28000))
+        self.assertEqual([("trip1", "A", 28800, "C", 30000),
+                          (None, "C", 30000, "D", 30120)],
+                         planner.get_journey("A", "D", "20110103", 28000))
+        self.assertEqual({"A": 28000, "B": 29400, "C": 30000, "D": 30120},
+                         planner.get_earliest_arrivals("A", "20110103", 28000))
+
+    def testProfile(self):
+        planner = transitfeed.ConnectionScanPlanner(self.schedule)
+        self.assertEqual([(28800, 30600), (29100, 32400)],
+                         planner.get_profile("A", "D", "20110103", 25200, 32400))
+        self.assertEqual([(29100, 32400)],
+                         planner.get_profile("A", "D", "20110103", 28900, 32400))
+        self.assertEqual([],
+                         planner.get_profile("A", "D", "20110101", 25200, 32400))
+
+    def testFrequencyTemplateWithoutFirstTime(self):
+        # The first stop of the template has no time, so like in DepartureBoard
+        # the trip is a single run at the times of its stop_times
+        route = self.schedule.get_route("0")
+        trip = route.add_trip(self.schedule, "Headsign", trip_id="trip5")
+        for stop_id, secs in (("A", 26700), ("B", 27000), ("C", 27300)):
+            trip.add_stop_time_object(transitfeed.StopTime(
+                None, self.schedule.get_stop(stop_id), arrival_secs=secs,
+                departure_secs=secs))
+        self.schedule.connection.execute(
+            "UPDATE stop_times SET arrival_secs=NULL, departure_secs=NULL "
+            "WHERE trip_id='trip5' AND stop_sequence=1")
+        trip.add_frequency("06:00:00", "06:30:00", 1800)
+        planner = transitfeed.ConnectionScanPlanner(self.schedule)
+        self.assertEqual(27300, planner.get_earliest_arrival("B", "C", "20110103",
+                                                             26000))
@@ -0,0 +1,97 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the departureboard module.
+from tests import util
+import transitfeed
+
+
+class DepartureBoardTestCase(util.TestCase):
+    def setUp(self):
+        problems = util.get_test_failure_problem_reporter(self)
+        schedule = transitfeed.Schedule(problem_reporter=problems)
+        self.schedule = schedule
+        schedule.add_agency("Agency", "http://iflyagency.com",
+                            "America/Los_Angeles")
+        weekdays = transitfeed.ServicePeriod('WEEKDAY')
+        weekdays.set_start_date('20110103')
+        weekdays.set_end_date('20110131')
+        weekdays.set_weekday_service(True)
+        schedule.add_service_period_object(weekdays)
+        weekends = transitfeed.ServicePeriod('WEEKEND')
+        weekends.set_start_date('20110101')
+        weekends.set_end_date('20110131')
+        weekends.set_weekend_service(True)
+        schedule.add_service_period_object(weekends)
+        self.stop1 = schedule.add_stop(lng=140.01, lat=0, name="140.01,0")
+        self.stop2 = schedule.add_stop(lng=140.02, lat=0, name="140.02,0")
+        self.stop3 = schedule.add_stop(lng=140.04, lat=0, name="140.04,0")
+        route = schedule.add_route("1", "One", "Bus")
+
+        self.trip1 = route.add_trip(schedule, "Last stop", trip_id="trip1")
+        self.trip1.service_id = 'WEEKDAY'
+        self.add_stop_times(self.trip1, ((self.stop1, 28800, None),
+                                         (self.stop2, None, "Middle"),
+                                         (self.stop3, 29700, None)))
+        self.trip2 = route.add_trip(schedule, "Last stop", trip_id="trip2")
+        self.trip2.service_id = 'WEEKEND'
+        self.add_stop_times(self.trip2, ((self.stop1, 29000, None),
+                                         (self.stop2, 29300, None),
+                                         (self.stop3, 29600, None)))
+        self.trip3 = route.add_trip(schedule, "Frequent", trip_id="trip3")
+        self.trip3.service_id = 'WEEKDAY'
+        self.add_stop_times(self.trip3, ((self.stop1, 36000, None),
+                                         (self.stop3, 36600, None)))
+        self.trip3.add_frequency("10:00:00", "11:00:00", 600)
+
+    def add_stop_times(self, trip, stop_times):
+        for stop, secs, headsign in stop_times:
+            trip.add_stop_time_object(transitfeed.StopTime(
+                self.schedule.problem_reporter, stop, arrival_secs=secs,
+                departure_secs=secs, stop_headsign=headsign))
+
+    def testNextDepartures(self):
+        board = self.schedule.get_departure_board()
+        departures = board.next_departures(self.stop1.stop_id, '20110104', 0, 3)
+        self.assertEqual([(28800, 'trip1'), (36000, 'trip3'), (36600, 'trip3')],
+                         [(d[0], d[1].trip_id) for d in departures])
+        departures = board.next_departures(self.stop1.stop_id, '20110108', 0, 3)
+        self.assertEqual([(29000, 'trip2')],
+                         [(d[0], d[1].trip_id) for d in departures])
+        departures = board.next_departures(self.stop1.stop_id, None, 28900, 2)
+        self.assertEqual([(29000, 'trip2'), (36000, 'trip3')],
+                         [(d[0], d[1].trip_id) for d in departures])
+
+    def testFrequencyRuns(self):
+        board = self.schedule.get_departure_board()
+        departures = board.next_departures(self.stop3.stop_id, '20110104', 37000, 10)
+        self.assertEqual([37200, 37800, 38400, 39000, 39600],
+                         [d[0] for d in departures])
+
+    def testHeadsignAndInterpolation(self):
+        board = self.schedule.get_departure_board()
+        (departure,) = board.next_departures(self.stop2.stop_id, '20110104', 0, 1)
+        secs, trip, index, headsign, is_timepoint = departure
+        self.assertEqual((29100, 'trip1', 1, 'Middle', False),
+                         (secs, trip.trip_id, index, headsign, is_timepoint))
+        (departure,) = board.next_departures(self.stop3.stop_id, '20110104', 0, 1)
+        self.assertEqual('Middle', departure[3])
+        (departure,) = board.next_departures(self.stop2.stop_id, '20110108', 0, 1)
+        self.assertEqual('Last stop', departure[3])
+
+    def testResetDepartureBoard(self):
+        board = self.schedule.get_departure_board()
+        self.assertTrue(board is self.schedule.get_departure_board())
+        self.schedule.reset_departure_board()
+        self.assertFalse(board is self.schedule.get_departure_board())
@@ -0,0 +1,108 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the feeddiff module.
+
+import json
+import os
+import shutil
+import tempfile
+
+from tests import util
+import transitfeed
+
+
+def assert_no_changes(test_case, changeset):
+    for section in transitfeed.CHANGESET_SECTIONS:
+        test_case.assertEqual({'added': [], 'removed': [], 'modified': {}},
+                              changeset[section], section)
+
+
+class FeedDiffTestCase(util.TestCase):
+
+    def testNoChanges(self):
+        schedule = util.build_golden_schedule(self)
+        changeset = transitfeed.diff_schedules(schedule, util.build_golden_schedule(self))
+        assert_no_changes(self, changeset)
+        self.assertEqual({'added': 0, 'removed': 0, 'modified': 0, 'unchanged': 2},
+                         changeset['summary']['trips'])
+        # Can be written as JSON
+        json.dumps(changeset)
+
+    def testChanges(self):
+        old_schedule = util.build_small_network(self)
+        schedule = util.build_small_network(self)
+        problems = schedule.problem_reporter
+        schedule.get_stop('B').stop_lon += 0.001
+        schedule.add_stop(lng=140.04, lat=0, name='E', stop_id='E')
+        schedule.get_route('0').route_long_name = 'Renamed'
+        del schedule.trips['trip3']
+        trip = schedule.get_route('0').add_trip(schedule, 'Headsign',
+                                                trip_id='trip5')
+        trip.add_stop_time_object(transitfeed.StopTime(
+            problems, schedule.get_stop('A'), arrival_secs=30000,
+            departure_secs=30000))
+        trip = schedule.get_trip('trip2')
+        stop_time = trip.get_stop_times()[0]
+        stop_time.departure_secs += 60
+        trip.replace_stop_time_object(stop_time)
+        schedule.get_trip('trip4').add_frequency('12:00:00', '13:00:00', 600)
+        schedule.get_default_service_period().set_date_has_service('20110103',
+                                                                   False)
+
+        changeset = transitfeed.diff_schedules(old_schedule, schedule)
+        self.assertEqual({'added': ['E'], 'removed': [], 'modified': {
+            'B': {'fields': {'stop_lon': ['140.01', '140.011']},
+                  'moved_meters': 111.3}}}, changeset['stops'])
+        self.assertEqual({'0': {'fields': {'route_long_name': ['One', 'Renamed']}}},
+                         changeset['routes']['modified'])
+        self.assertEqual(['trip5'], changeset['trips']['added'])
+        self.assertEqual(['trip3'], changeset['trips']['removed'])
+        modified = changeset['trips']['modified']
+        self.assertEqual(['trip2', 'trip4'], sorted(modified))
+        self.assertEqual({'fields': {}, 'stop_times': True}, modified['trip2'])
+        self.assertFalse(modified['trip4']['stop_times'])
+        self.assertEqual(2, len(modified['trip4']['frequencies'][1]))
+        self.assertEqual({'fields': {}, 'added_dates': [],
+                          'removed_dates': ['20110103']},
+                         changeset['service_periods']['modified']['0'])
+        self.assertEqual({'added': 1, 'removed': 0, 'modified': 1,
+                          'unchanged': 3}, changeset['summary']['stops'])
+        self.assertEqual({'added': 1, 'removed': 1, 'modified': 2,
+                          'unchanged': 1}, changeset['summary']['trips'])
+
+
+class FeedVersionTestCase(util.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testStoreAndFeedAreTheSame(self):
+        schedule = util.build_golden_schedule(self)
+        for stop in schedule.get_stop_list():
+            stop.location_type = 0
+        feed_path = os.path.join(self.directory, 'feed.zip')
+        store_path = os.path.join(self.directory, 'feed.sqlite')
+        schedule.write_google_transit_feed(feed_path)
+        problems = util.get_test_failure_problem_reporter(
+            self, ('ExpirationDate', 'OtherProblem', 'NoServiceExceptions',
+                   'TransferDistanceTooBig', 'TransferWalkingSpeedTooFast'))
+        # The store saved from the feed, like feed_diff.py --save_store does
+        transitfeed.load_feed_version(feed_path, problems).export_sqlite(
+            store_path)
+        assert_no_changes(self, transitfeed.diff_feeds(feed_path, store_path,
+                                                       problems))
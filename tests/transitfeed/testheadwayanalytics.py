@@ -0,0 +1,51 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the headwayanalytics module.
+from datetime import date
+from tests import util
+import transitfeed
+
+
+class HeadwayAnalyzerTestCase(util.TestCase):
+    def setUp(self):
+        self.schedule = util.build_small_network(self)
+        self.route_id = list(self.schedule.get_route_list())[0].route_id
+
+    def testGenerateRows(self):
+        analyzer = transitfeed.HeadwayAnalyzer(self.schedule)
+        rows = list(analyzer.generate_rows(date(2011, 1, 1), date(2011, 1, 4)))
+        self.assertEqual([
+            ('20110103', self.route_id, '', 'A', 28800, 2, 300.0, 300, 300),
+            ('20110103', self.route_id, '', 'B', 28800, 2, 300.0, 300, 300),
+            ('20110103', self.route_id, '', 'C', 36000, 6, 600.0, 600, 600)],
+            rows)
+
+    def testBins(self):
+        analyzer = transitfeed.HeadwayAnalyzer(self.schedule, bin_secs=1800)
+        rows = [row for row in analyzer.generate_rows(date(2011, 1, 3), date(2011, 1, 4))
+                if row[3] == 'C']
+        self.assertEqual([
+            ('20110103', self.route_id, '', 'C', 36000, 3, 600.0, 600, 600),
+            ('20110103', self.route_id, '', 'C', 37800, 3, 600.0, 600, 600)],
+            rows)
+
+    def testSharedServiceRows(self):
+        analyzer = transitfeed.HeadwayAnalyzer(self.schedule)
+        columns = analyzer.get_columns(date(2011, 1, 3), date(2011, 1, 10))
+        self.assertEqual(transitfeed.HeadwayAnalyzer.FIELD_NAMES, sorted(
+            columns, key=transitfeed.HeadwayAnalyzer.FIELD_NAMES.index))
+        self.assertEqual(['20110103'] * 3 + ['20110104'] * 3 + ['20110105'] * 3 +
+                         ['20110106'] * 3 + ['20110107'] * 3, columns['date'])
+        self.assertEqual([2, 2, 6] * 5, columns['departures'])
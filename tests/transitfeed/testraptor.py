@@ -0,0 +1,97 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the raptor module.
+from tests import util
+import transitfeed
+
+
+class RaptorRouterTestCase(util.TestCase):
+    def setUp(self):
+        self.schedule = util.build_small_network(self)
+
+    def testPatterns(self):
+        router = transitfeed.RaptorRouter(self.schedule, max_walk_distance=0)
+        self.assertEqual(4, router.get_pattern_count())
+
+    def testEarliestArrivals(self):
+        router = transitfeed.RaptorRouter(self.schedule, max_walk_distance=0)
+        self.assertEqual({"A": 28000, "B": 29400, "C": 30000, "D": 30600},
+                         router.get_earliest_arrivals("A", "20110103", 28000))
+        self.assertEqual({"A": 28000, "B": 29400, "C": 30000, "D": 32400},
+                         router.get_earliest_arrivals("A", "20110103", 28000,
+                                                      max_rounds=1))
+        self.assertEqual({"A": 28000},
+                         router.get_earliest_arrivals("A", "20110101", 28000))
+
+    def testParetoArrivals(self):
+        router = transitfeed.RaptorRouter(self.schedule, max_walk_distance=0)
+        arrivals = router.get_pareto_arrivals("A", "20110103", 28000)
+        self.assertEqual([(1, 32400), (2, 30600)], arrivals["D"])
+        self.assertEqual([(0, 28000)], arrivals["A"])
+
+    def testChangeTime(self):
+        self.schedule.add_transfer_object(transitfeed.Transfer(
+            from_stop_id="B", to_stop_id="B", transfer_type=2, min_transfer_time=600))
+        router = transitfeed.RaptorRouter(self.schedule, max_walk_distance=0)
+        self.assertEqual(32400, router.get_earliest_arrivals("A", "20110103", 28000)["D"])
+
+    def testWalkThenChange(self):
+        # trip1 reaches C at 30000 and the walk to D ends at 30120, in time for
+        # trip5 at 30300. The change time of D only applies after a vehicle.
+        self.schedule.add_transfer_object(transitfeed.Transfer(
+            from_stop_id="C", to_stop_id="D", transfer_type=2, min_transfer_time=120))
+        self.schedule.add_transfer_object(transitfeed.Transfer(
+            from_stop_id="D", to_stop_id="D", transfer_type=2, min_transfer_time=600))
+        self.schedule.add_stop(0.0, 140.04, "Stop E", "E")
+        trip = self.schedule.get_route("0").add_trip(self.schedule, "Headsign",
+                                                     trip_id="trip5")
+        for stop_id, secs in (("D", 30300), ("E", 31000)):
+            trip.add_stop_time_object(transitfeed.StopTime(
+                None, self.schedule.get_stop(stop_id), arrival_secs=secs,
+                departure_secs=secs))
+        router = transitfeed.RaptorRouter(self.schedule, max_walk_distance=0)
+        arrivals = router.get_earliest_arrivals("A", "20110103", 28000)
+        self.assertEqual(30120, arrivals["D"])
+        self.assertEqual(31000, arrivals["E"])
+
+    def testWalkingLinks(self):
+        # C and D are about 1113m apart
+        router = transitfeed.RaptorRouter(self.schedule, max_walk_distance=1200,
+                                          walking_speed=1.0)
+        arrivals = router.get_earliest_arrivals("C", None, 0)
+        self.assertEqual(1114, arrivals["D"])
+        self.assertEqual(1114, arrivals["B"])
+
+    def testFrequencyRuns(self):
+        router = transitfeed.RaptorRouter(self.schedule, max_walk_distance=0)
+        self.assertEqual(37500, router.get_earliest_arrivals("C", None, 37000)["D"])
+
+    def testTravelTimeMatrix(self):
+        router = transitfeed.RaptorRouter(self.schedule, max_walk_distance=0)
+        expected = {"A": {"A": 0, "D": 2600}, "D": {"A": None, "D": 0}}
+        self.assertEqual(expected, router.get_travel_time_matrix(
+            ["A", "D"], ["A", "D"], "20110103", 28000))
+        self.assertEqual(expected, router.get_travel_time_matrix(
+            ["A", "D"], ["A", "D"], "20110103", 28000, processes=2))
+
+
+class GridIndexTestCase(util.TestCase):
+    def testGetNearby(self):
+        index = transitfeed.GridIndex(100.0)
+        for i in range(10):
+            index.add(0.0, i * 0.001, i)
+        self.assertEqual([0, 1, 2], [item for _, item in index.get_nearby(0.0, 0.0, 250)])
+        self.assertEqual([5, 4, 6], [item for _, item in index.get_nearby(0.0, 0.005, 120)])
+        self.assertEqual([], index.get_nearby(1.0, 0.0, 1000))
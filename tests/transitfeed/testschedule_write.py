@@ -13,6 +13,12 @@
 # limitations under the License.
 
 # Unit tests for the schedule module.
+import concurrent.futures
+import io
+import os
+import zipfile
+import zlib
+
 from tests import util
 import transitfeed
 
@@ -526,3 +532,305 @@ class WriteSampleFeedTestCase(util.TempFileTestCaseBase):
         self.assertEqual(feed_info, read_schedule.feed_info)
         self.assertEqual(feed_info.feed_publisher_name, read_schedule.feed_info.feed_publisher_name)
         self.assertEqual("http://www.aurl.com", read_schedule.feed_info.feed_publisher_url)
+
+
+class StreamingWriteTestCase(util.TempFileTestCaseBase):
+    """Tests that tables are streamed into the zip members in chunks."""
+
+    def runTest(self):
+        schedule = util.build_small_network(self)
+        # Force many chunks per table
+        schedule._WRITE_CHUNK_SIZE = 16
+        schedule.write_google_transit_feed(self.tempfilepath)
+        archive = zipfile.ZipFile(self.tempfilepath)
+        self.assertEqual(['agency.txt', 'calendar.txt', 'stops.txt', 'routes.txt',
+                          'trips.txt', 'frequencies.txt', 'stop_times.txt'],
+                         archive.namelist())
+        for info in archive.infolist():
+            self.assertEqual(zipfile.ZIP_DEFLATED, info.compress_type)
+        self.assertEqual(10, len(archive.read('stop_times.txt').splitlines()))
+        self.assertEqual(2, len(archive.read('frequencies.txt').splitlines()))
+
+
+class StopTimesExportTestCase(util.TestCase):
+    """Tests that stop_times read straight from the database match the rows of
+    Trip.generate_stop_times_tuples."""
+
+    def runTest(self):
+        problems = util.get_test_failure_problem_reporter(
+            self, ("ExpirationDate", "OtherProblem"))
+        schedule = util.build_small_network(self)
+        stop_a = schedule.get_stop("A")
+        stop_b = schedule.get_stop("B")
+        route = list(schedule.get_route_list())[0]
+        # Added after trip4 so the order of self.trips isn't the order of ids
+        trip = route.add_trip(schedule, "Other", trip_id="trip0")
+        trip.add_stop_time_object(transitfeed.StopTime(
+            problems, stop_a, arrival_secs=0, departure_secs=59,
+            stop_headsign="To B", pickup_type=0, drop_off_type=1,
+            shape_dist_traveled=0, stop_sequence=0, timepoint=1))
+        trip.add_stop_time_object(transitfeed.StopTime(
+            problems, stop_b, stop_sequence=1, shape_dist_traveled=1.5))
+        trip.add_stop_time_object(transitfeed.StopTime(
+            problems, stop_a, arrival_secs=90000, departure_secs=90061,
+            stop_sequence=2, timepoint=0))
+        schedule._STOP_TIMES_BATCH_SIZE = 2
+
+        expected = []
+        for t in schedule.trips.values():
+            expected.extend(t.generate_stop_times_tuples())
+        rows = list(schedule._generate_stop_times_rows())
+        self.assertEqual(expected, rows)
+        self.assertEqual(("trip0", "00:00:00", "00:00:59", "A", 1, "To B", "",
+                          1, "", 1), rows[-3])
+        self.assertEqual(("trip0", "25:00:00", "25:01:01", "A", 3, "", "", "",
+                          "", ""), rows[-1])
+        # The temporary table is dropped and the rows can be read again
+        self.assertEqual(expected, list(schedule._generate_stop_times_rows()))
+
+
+class ParallelWriteTestCase(util.TempFileTestCaseBase):
+    """Tests that compressing tables in parallel writes the same feed."""
+
+    def runTest(self):
+        schedule = util.build_small_network(self)
+        # Split each table in several independently compressed chunks
+        schedule._WRITE_CHUNK_SIZE = 64
+        schedule.write_google_transit_feed(self.tempfilepath)
+        archive = zipfile.ZipFile(self.tempfilepath)
+        expected = [(name, archive.read(name)) for name in archive.namelist()]
+        archive.close()
+
+        for compression_level in (None, 0, 9):
+            output = io.BytesIO()
+            schedule.write_google_transit_feed(
+                output, workers=3, compression_level=compression_level)
+            archive = zipfile.ZipFile(output)
+            self.assertEqual(None, archive.testzip())
+            self.assertEqual(expected, [(name, archive.read(name))
+                                        for name in archive.namelist()])
+            for info in archive.infolist():
+                self.assertEqual(zipfile.ZIP_DEFLATED, info.compress_type)
+
+
+class ChunkedWriteTestCase(util.TestCase):
+    """Tests that tables are rendered and compressed a few chunks at a time."""
+
+    class ImmediateExecutor(object):
+        def __init__(self):
+            self.submitted = 0
+
+        def submit(self, function, *args):
+            self.submitted += 1
+            future = concurrent.futures.Future()
+            future.set_result(function(*args))
+            return future
+
+    class RecordingMember(object):
+        def __init__(self, executor):
+            self.executor = executor
+            self.chunks = []
+            self.most_pending = 0
+
+        def write(self, data):
+            self.most_pending = max(self.most_pending,
+                                    self.executor.submitted - len(self.chunks))
+            self.chunks.append(data)
+
+        def finish(self, file_size, crc):
+            self.file_size = file_size
+            self.crc = crc
+
+    class RecordingArchive(object):
+        def __init__(self, member):
+            self.member = member
+
+        def open_compressed(self, filename):
+            return self.member
+
+    def setUp(self):
+        self.schedule = transitfeed.Schedule()
+        self.schedule._WRITE_CHUNK_SIZE = 100
+        self.schedule._WRITE_ROWS_BATCH_SIZE = 3
+        self.consumed = []
+
+    def generateRows(self):
+        for i in range(1000):
+            self.consumed.append(i)
+            yield ['stop%d' % i, 'Stop %d' % i]
+
+    def expectedText(self):
+        return ('stop_id,stop_name\r\n' + ''.join(
+            'stop%d,Stop %d\r\n' % (i, i) for i in range(1000))).encode('utf-8')
+
+    def testTableChunks(self):
+        chunks = self.schedule._generate_table_chunks(['stop_id', 'stop_name'],
+                                                      self.generateRows())
+        first = next(chunks)
+        self.assertEqual(100, len(first))
+        self.assertTrue(len(self.consumed) < 20)
+        rest = list(chunks)
+        self.assertEqual([100] * (len(rest) - 1),
+                         [len(chunk) for chunk in rest[:-1]])
+        self.assertEqual(self.expectedText(), first + b''.join(rest))
+
+    def testPendingChunks(self):
+        executor = self.ImmediateExecutor()
+        member = self.RecordingMember(executor)
+        archive = self.RecordingArchive(member)
+        self.schedule._compress_archive_chunks(
+            archive, executor, 4, 'stops.txt',
+            self.schedule._generate_table_chunks(['stop_id', 'stop_name'],
+                                                 self.generateRows()), None)
+        text = self.expectedText()
+        self.assertTrue(executor.submitted > 4)
+        self.assertEqual(4, member.most_pending)
+        self.assertEqual((len(text), zlib.crc32(text)),
+                         (member.file_size, member.crc))
+        self.assertEqual(text, zlib.decompress(b''.join(member.chunks),
+                                               -zlib.MAX_WBITS))
+
+
+class SortedWriteTestCase(util.TestCase):
+    """Tests that sorted writes don't depend on the order objects were added
+    in."""
+
+    def write(self, schedule, sort):
+        output = io.BytesIO()
+        schedule.write_google_transit_feed(output, sort=sort)
+        return output.getvalue()
+
+    def runTest(self):
+        schedule = util.build_small_network(self)
+        unsorted = self.write(schedule, False)
+        expected = self.write(schedule, True)
+
+        # Move trip1 and stop A to the end of their dicts and the stop_times of
+        # trip1 to the end of the table
+        schedule.trips['trip1'] = schedule.trips.pop('trip1')
+        schedule.stops['A'] = schedule.stops.pop('A')
+        trip = schedule.get_trip('trip1')
+        stop_times = trip.get_stop_times()
+        trip.clear_stop_times()
+        for stop_time in stop_times:
+            trip.add_stop_time_object(stop_time)
+
+        self.assertNotEqual(unsorted, self.write(schedule, False))
+        self.assertEqual(expected, self.write(schedule, True))
+        archive = zipfile.ZipFile(io.BytesIO(expected))
+        stop_times = archive.read('stop_times.txt').decode('utf-8').splitlines()
+        self.assertEqual(['trip1'] * 3 + ['trip2'] * 2,
+                         [line.split(',')[0] for line in stop_times[1:6]])
+        stops = archive.read('stops.txt').decode('utf-8').splitlines()
+        self.assertEqual(['A', 'B', 'C', 'D'],
+                         [line.split(',')[stops[0].split(',').index('stop_id')]
+                          for line in stops[1:]])
+
+
+class GoldenFeedWriteTestCase(util.TempFileTestCaseBase):
+    """Tests that every table is written exactly like the files in
+    tests/data/write_golden."""
+
+    FILE_NAMES = ['agency.txt', 'feed_info.txt', 'calendar_dates.txt',
+                  'calendar.txt', 'stops.txt', 'routes.txt', 'trips.txt',
+                  'frequencies.txt', 'fare_attributes.txt', 'fare_rules.txt',
+                  'stop_times.txt', 'shapes.txt', 'transfers.txt']
+
+    def assertMatchesGolden(self, feed):
+        archive = zipfile.ZipFile(feed)
+        self.assertEqual(self.FILE_NAMES, archive.namelist())
+        for name in self.FILE_NAMES:
+            with open(util.data_path(os.path.join('write_golden', name)), 'rb') as f:
+                self.assertEqual(f.read(), archive.read(name), name)
+        archive.close()
+
+    def testWrite(self):
+        schedule = util.build_golden_schedule(self)
+        schedule.write_google_transit_feed(self.tempfilepath)
+        self.assertMatchesGolden(self.tempfilepath)
+
+    def testParallelWrite(self):
+        schedule = util.build_golden_schedule(self)
+        schedule.write_google_transit_feed(self.tempfilepath, workers=2)
+        self.assertMatchesGolden(self.tempfilepath)
+
+
+class IncrementalWriteTestCase(util.TempFileTestCaseBase):
+    """Tests writing a loaded schedule with the feed it was loaded from as
+    the base."""
+
+    def setUp(self):
+        util.TempFileTestCaseBase.setUp(self)
+        schedule = util.build_small_network(self)
+        for stop in schedule.get_stop_list():
+            stop.location_type = 0
+        schedule.write_google_transit_feed(self.tempfilepath)
+        self.schedule = transitfeed.Loader(
+            self.tempfilepath,
+            loader_problems=util.get_test_failure_problem_reporter(
+                self, ("ExpirationDate",))).load()
+
+    def getMembers(self, feed):
+        archive = zipfile.ZipFile(feed)
+        members = dict((info.filename, (info.compress_size, archive.read(info)))
+                       for info in archive.infolist())
+        archive.close()
+        return members
+
+    def assertCopied(self, base, output, copied):
+        base_members = self.getMembers(base)
+        output_members = self.getMembers(output)
+        self.assertEqual(sorted(base_members), sorted(output_members))
+        for name in base_members:
+            if name in copied:
+                self.assertEqual(base_members[name], output_members[name], name)
+            else:
+                self.assertNotEqual(base_members[name][1], output_members[name][1],
+                                    name)
+
+    def testNothingChanged(self):
+        self.assertEqual(set(), self.schedule.get_dirty_tables())
+        output = io.BytesIO()
+        self.schedule.write_google_transit_feed(output, compression_level=0,
+                                                base=self.tempfilepath)
+        self.assertCopied(self.tempfilepath, output, self.getMembers(self.tempfilepath))
+
+    def testChangedTables(self):
+        self.schedule.get_stop("A").stop_name = "Airport"
+        self.schedule.get_trip("trip4").add_frequency("12:00:00", "13:00:00", 600)
+        self.assertEqual(set(["stops", "frequencies"]), self.schedule.get_dirty_tables())
+        output = io.BytesIO()
+        self.schedule.write_google_transit_feed(output, compression_level=0,
+                                                base=self.tempfilepath)
+        self.assertCopied(self.tempfilepath, output,
+                          ["agency.txt", "calendar.txt", "routes.txt", "trips.txt",
+                           "stop_times.txt"])
+        self.assertTrue(b"Airport" in zipfile.ZipFile(output).read("stops.txt"))
+
+    def testUntrackedTable(self):
+        self.schedule.get_default_service_period().set_end_date("20121231")
+        output = io.BytesIO()
+        self.schedule.write_google_transit_feed(output, workers=2,
+                                                base=self.tempfilepath)
+        self.assertCopied(self.tempfilepath, output,
+                          ["agency.txt", "stops.txt", "routes.txt", "trips.txt",
+                           "frequencies.txt", "stop_times.txt"])
+
+    def testRemovedTrip(self):
+        del self.schedule.trips["trip1"]
+        self.assertEqual(set(["trips", "stop_times", "frequencies"]),
+                         self.schedule.get_dirty_tables())
+
+    def testSameFile(self):
+        stop = self.schedule.get_stop("B")
+        self.schedule.get_trip("trip2").add_stop_time_object(transitfeed.StopTime(
+            util.get_test_failure_problem_reporter(self), stop, arrival_secs=31000,
+            departure_secs=31000))
+        self.assertEqual(set(["stop_times"]), self.schedule.get_dirty_tables())
+        base_members = self.getMembers(self.tempfilepath)
+        self.schedule.write_google_transit_feed(self.tempfilepath,
+                                                base=self.tempfilepath)
+        members = self.getMembers(self.tempfilepath)
+        self.assertEqual(base_members["stops.txt"], members["stops.txt"])
+        self.assertEqual(len(base_members["stop_times.txt"][1].splitlines()) + 1,
+                         len(members["stop_times.txt"][1].splitlines()))
@@ -0,0 +1,207 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the scheduleupdate module.
+
+from tests import util
+import transitfeed
+
+
+def get_all_departures(board, schedule, date):
+    return dict((stop_id, [(d[0], d[1].trip_id, d[2], d[3])
+                           for d in board.next_departures(stop_id, date, 0, 100)])
+                for stop_id in schedule.stops)
+
+
+class ScheduleUpdateTestCase(util.TestCase):
+    def setUp(self):
+        self.schedule = util.build_small_network(self)
+        self.problems = self.schedule.problem_reporter
+
+    def new_stop_time(self, stop_id, secs, **kwargs):
+        return transitfeed.StopTime(self.problems, self.schedule.get_stop(stop_id),
+                                    arrival_secs=secs, departure_secs=secs,
+                                    **kwargs)
+
+    def get_stop_times(self, trip_id):
+        return [(st.stop_id, st.stop_sequence, st.arrival_secs)
+                for st in self.schedule.get_trip(trip_id).get_stop_times()]
+
+    def testCommit(self):
+        schedule = self.schedule
+        board = schedule.get_departure_board()
+        schedule.clear_dirty_tables()
+        route = schedule.get_route('0')
+        stop = transitfeed.Stop(lat=0, lng=140.04, name='E', stop_id='E')
+        with schedule.batch_update() as update:
+            update.add_stop(stop)
+            update.remove_trip('trip3')
+            update.set_stop_times('trip2', [self.new_stop_time('B', 29760),
+                                            self.new_stop_time('D', 30660)])
+            update.replace_stop_time('trip1', transitfeed.StopTime(
+                self.problems, schedule.get_stop('D'), arrival_secs=30060,
+                departure_secs=30060, stop_sequence=3))
+            update.remove_stop_time('trip1', 2)
+            trip = transitfeed.Trip(
+                headsign='New', route=route,
+                service_period=schedule.get_default_service_period(),
+                trip_id='trip5')
+            update.add_trip(trip, [self.new_stop_time('A', 31000),
+                                   transitfeed.StopTime(
+                                       self.problems, stop, arrival_secs=31600,
+                                       departure_secs=31600)])
+            update.set_date_has_service('0', '20110103', False)
+            # Nothing changes before the with block is left
+            self.assertTrue('trip3' in schedule.trips)
+            self.assertFalse('E' in schedule.stops)
+
+        self.assertEqual(['trip1', 'trip2', 'trip4', 'trip5'],
+                         sorted(schedule.trips))
+        self.assertEqual(['trip1', 'trip2', 'trip4', 'trip5'],
+                         sorted(t.trip_id for t in route.trips))
+        self.assertEqual([('A', 1, 28800), ('D', 3, 30060)],
+                         self.get_stop_times('trip1'))
+        self.assertEqual([('B', 1, 29760), ('D', 2, 30660)],
+                         self.get_stop_times('trip2'))
+        self.assertEqual([('A', 1, 31000), ('E', 2, 31600)],
+                         self.get_stop_times('trip5'))
+        self.assertFalse(schedule.get_service_period('0').is_active_on(
+            '20110103'))
+        self.assertEqual(set(['stops', 'trips', 'frequencies', 'stop_times']),
+                         schedule.get_dirty_tables())
+
+        # The cached board is updated like a new one
+        self.assertTrue(board is schedule.get_departure_board())
+        new_board = transitfeed.DepartureBoard(schedule)
+        for date in ('20110103', '20110104'):
+            self.assertEqual(get_all_departures(new_board, schedule, date),
+                             get_all_departures(board, schedule, date))
+        self.assertEqual([], board.next_departures('A', '20110103'))
+        self.assertEqual([(28800, 'trip1'), (31000, 'trip5')],
+                         [(d[0], d[1].trip_id)
+                          for d in board.next_departures('A', '20110104')])
+
+    def testReplaceStop(self):
+        schedule = self.schedule
+        board = schedule.get_departure_board()
+        stop = transitfeed.Stop(lat=0, lng=140.015, name='B', stop_id='B')
+        with schedule.batch_update() as update:
+            update.replace_trip(transitfeed.Trip(
+                headsign='Renamed', route=schedule.get_route('0'),
+                service_period=schedule.get_default_service_period(),
+                trip_id='trip2'))
+            update.replace_stop(stop)
+            # trip1 doesn't stop at B, whose time is interpolated
+            update.replace_stop_time('trip1', transitfeed.StopTime(
+                self.problems, stop, stop_sequence=2))
+        self.assertTrue(schedule.get_stop('B') is stop)
+        self.assertEqual('Renamed', schedule.get_trip('trip2').trip_headsign)
+        self.assertEqual([('B', 2, None)],
+                         self.get_stop_times('trip1')[1:2])
+        self.assertEqual([('B', 1, 29700)], self.get_stop_times('trip2')[:1])
+        self.assertEqual([(29700, 'trip1', 'Headsign'),
+                          (29700, 'trip2', 'Renamed')],
+                         [(d[0], d[1].trip_id, d[3])
+                          for d in board.next_departures('B', '20110103')])
+
+    def testRollback(self):
+        schedule = self.schedule
+        board = schedule.get_departure_board()
+        departures = get_all_departures(board, schedule, '20110103')
+        update = schedule.batch_update()
+        update.remove_trip('trip1')
+        update.set_stop_times('trip2', [self.new_stop_time('C', 29700)])
+        update.remove_stop('A')
+        # trip3 still stops at A
+        self.assertRaises(transitfeed.Error, update.commit)
+        self.assertEqual(['trip1', 'trip2', 'trip3', 'trip4'],
+                         sorted(schedule.trips))
+        self.assertEqual([('A', 1, 28800), ('B', 2, 29400), ('C', 3, 30000)],
+                         self.get_stop_times('trip1'))
+        self.assertEqual([('B', 1, 29700), ('D', 2, 30600)],
+                         self.get_stop_times('trip2'))
+        self.assertEqual(departures,
+                         get_all_departures(board, schedule, '20110103'))
+
+        try:
+            with schedule.batch_update() as update:
+                update.remove_trip('trip1')
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertTrue('trip1' in schedule.trips)
+
+    def testChecks(self):
+        update = self.schedule.batch_update()
+        self.assertRaises(transitfeed.Error, update.remove_trip, 'trip9')
+        self.assertRaises(transitfeed.Error, update.add_stop,
+                          transitfeed.Stop(lat=0, lng=140, name='A',
+                                           stop_id='A'))
+        update.remove_stop('D')
+        self.assertRaises(transitfeed.Error, update.set_stop_times, 'trip2',
+                          [self.new_stop_time('D', 29700)])
+        self.assertRaises(transitfeed.Error, update.set_date_has_service,
+                          'missing', '20110103')
+        update.remove_trip('trip1')
+        update.add_trip(transitfeed.Trip(route=self.schedule.get_route('0'),
+                                         trip_id='trip1'))
+        self.assertRaises(transitfeed.Error, update.add_trip,
+                          transitfeed.Trip(route=self.schedule.get_route('0'),
+                                           trip_id='trip1'))
+
+    def testRemoveReferencedStop(self):
+        schedule = self.schedule
+        parent = transitfeed.Stop(lat=0, lng=140.05, name='P', stop_id='P')
+        parent.location_type = 1
+        schedule.add_stop_object(parent)
+        child = transitfeed.Stop(lat=0, lng=140.05, name='E', stop_id='E')
+        child.parent_station = 'P'
+        schedule.add_stop_object(child)
+        update = schedule.batch_update()
+        update.remove_stop('P')
+        self.assertRaises(transitfeed.Error, update.commit)
+        self.assertTrue('P' in schedule.stops)
+
+        # Removing the child stop too is allowed
+        with schedule.batch_update() as update:
+            update.remove_stop('E')
+            update.remove_stop('P')
+        self.assertFalse('P' in schedule.stops)
+
+        schedule.add_transfer_object(transitfeed.Transfer(
+            from_stop_id='C', to_stop_id='D', transfer_type=0))
+        update = schedule.batch_update()
+        update.set_stop_times('trip4', [])
+        update.remove_stop('C')
+        update.set_stop_times('trip1', [self.new_stop_time('A', 28800)])
+        self.assertRaises(transitfeed.Error, update.commit)
+        self.assertTrue('C' in schedule.stops)
+
+    def testSetStopTimeSequences(self):
+        stop_times = [self.new_stop_time('A', 28800),
+                      self.new_stop_time('B', 29400, stop_sequence=5),
+                      self.new_stop_time('C', 30000)]
+        with self.schedule.batch_update() as update:
+            update.set_stop_times('trip1', stop_times)
+        self.assertEqual([('A', 1, 28800), ('B', 5, 29400), ('C', 6, 30000)],
+                         self.get_stop_times('trip1'))
+        # The StopTime objects passed aren't changed
+        self.assertEqual([None, 5, None],
+                         [getattr(st, 'stop_sequence', None)
+                          for st in stop_times])
+
+        update = self.schedule.batch_update()
+        self.assertRaises(transitfeed.Error, update.set_stop_times, 'trip2',
+                          [self.new_stop_time('A', 29700, stop_sequence=1),
+                           self.new_stop_time('B', 30000, stop_sequence=1)])
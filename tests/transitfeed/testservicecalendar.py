@@ -0,0 +1,69 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the servicecalendar module.
+from datetime import date
+from tests import util
+import transitfeed
+
+
+class ServiceCalendarTestCase(util.TestCase):
+    def setUp(self):
+        weekdays = transitfeed.ServicePeriod('WEEKDAY')
+        weekdays.set_start_date('20110103')
+        weekdays.set_end_date('20110114')
+        weekdays.set_weekday_service(True)
+        weekdays.set_date_has_service('20110105', False)
+        weekdays.set_date_has_service('20110122')
+        weekends = transitfeed.ServicePeriod('WEEKEND')
+        weekends.set_start_date('20110101')
+        weekends.set_end_date('20110131')
+        weekends.set_weekend_service(True)
+        self.periods = [weekdays, weekends]
+        self.calendar = transitfeed.ServiceCalendar(self.periods)
+
+    def testBaseDate(self):
+        self.assertEqual(date(2011, 1, 1), self.calendar.base_date)
+
+    def testMatchesServicePeriod(self):
+        for period in self.periods:
+            self.assertEqual(period.active_dates(),
+                             self.calendar.get_active_dates(period.service_id))
+            for day in range(1, 32):
+                date_string = '201101%02d' % day
+                self.assertEqual(
+                    bool(period.is_active_on(date_string)),
+                    self.calendar.is_active_on(period.service_id, date_string))
+
+    def testActiveServiceIds(self):
+        self.assertEqual(frozenset(['WEEKDAY']),
+                         self.calendar.get_active_service_ids('20110104'))
+        self.assertEqual(frozenset(),
+                         self.calendar.get_active_service_ids('20110105'))
+        self.assertEqual(frozenset(['WEEKDAY', 'WEEKEND']),
+                         self.calendar.get_active_service_ids(date(2011, 1, 22)))
+        self.assertEqual(frozenset(),
+                         self.calendar.get_active_service_ids('20101231'))
+        self.assertEqual(frozenset(),
+                         self.calendar.get_active_service_ids('bad date'))
+
+    def testUnknownServiceId(self):
+        self.assertFalse(self.calendar.is_active_on('NONE', '20110104'))
+        self.assertEqual(0, self.calendar.get_bitset('NONE'))
+        self.assertEqual([], self.calendar.get_active_dates('NONE'))
+
+    def testBitsetDates(self):
+        self.assertEqual(['20110101', '20110103', '20111231', '20130101'],
+                         self.calendar.get_bitset_dates(
+                             1 | 1 << 2 | 1 << 364 | 1 << 731))
@@ -292,6 +292,25 @@ class ServicePeriodTestCase(util.TestCase):
         self.assertFalse(period_empty.is_active_on('20071231', date(2007, 12, 31)))
         self.assertEquals(period_empty.active_dates(), [])
 
+    def testClipDates(self):
+        period = transitfeed.ServicePeriod()
+        period.start_date = '20070101'
+        period.end_date = '20071231'
+        period.set_date_has_service('20061224')
+        period.set_date_has_service('20070601', False)
+        period.set_date_has_service('20080101')
+        period.clip_dates('20070301', '20070701')
+        self.assertEquals(('20070301', '20070701'),
+                          (period.start_date, period.end_date))
+        self.assertEquals(['20070601'], list(period.date_exceptions))
+        period.clip_dates(end='20070531')
+        self.assertEquals(('20070301', '20070531'),
+                          (period.start_date, period.end_date))
+        self.assertEquals([], list(period.date_exceptions))
+        period.clip_dates(start='20070601')
+        self.assertEquals((None, None), (period.start_date, period.end_date))
+        self.assertEquals([], period.active_dates())
+
 
 class OnlyCalendarDatesTestCase(util.LoadTestCase):
     def runTest(self):
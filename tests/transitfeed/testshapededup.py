@@ -0,0 +1,91 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the shapededup module.
+
+from tests import util
+import transitfeed
+
+
+def make_shape(shape_id, points):
+    shape = transitfeed.Shape(shape_id)
+    for point in points:
+        shape.add_point(*point)
+    return shape
+
+
+class ShapeFingerprintTestCase(util.TestCase):
+
+    def testFingerprint(self):
+        shape = make_shape('s1', [(0.1, 140.0), (0.1, 140.01), (0.2, 140.02)])
+        same = make_shape('s2', [(0.1000001, 140.0), (0.1, 140.01),
+                                 (0.2, 140.0200004)])
+        self.assertEqual(shape.get_fingerprint(), same.get_fingerprint())
+        self.assertNotEqual(shape.get_fingerprint(7), same.get_fingerprint(7))
+        # The reverse path is a different shape
+        reverse = make_shape('s3', reversed(shape.points))
+        self.assertNotEqual(shape.get_fingerprint(), reverse.get_fingerprint())
+        # So are the same points with distances
+        distances = make_shape('s4', [(0.1, 140.0, 0), (0.1, 140.01, 1.1),
+                                      (0.2, 140.02, 2.5)])
+        self.assertNotEqual(shape.get_fingerprint(),
+                            distances.get_fingerprint())
+        self.assertEqual(transitfeed.Shape('s5').get_fingerprint(),
+                         transitfeed.Shape('s6').get_fingerprint())
+
+
+class DedupShapesTestCase(util.TestCase):
+
+    def testDedupShapes(self):
+        schedule = util.build_small_network(self)
+        points = [(0.0, 140.0), (0.0, 140.01), (0.0, 140.02)]
+        for shape_id, shape_points in (('s1', points),
+                                       ('s2', list(reversed(points))),
+                                       ('s3', points),
+                                       ('s4', [(lat + 0.000001, lon)
+                                               for lat, lon in points])):
+            schedule.add_shape_object(make_shape(shape_id, shape_points))
+        for trip_id, shape_id in (('trip1', 's3'), ('trip2', 's2'),
+                                  ('trip3', 's4')):
+            schedule.get_trip(trip_id).shape_id = shape_id
+        schedule.clear_dirty_tables()
+
+        self.assertEqual([[0, 2, 3]], transitfeed.group_duplicate_shapes(
+            list(schedule.get_shape_list())))
+        self.assertEqual({'s3': 's1', 's4': 's1'},
+                         transitfeed.dedup_shapes(schedule))
+        self.assertEqual(['s1', 's2'],
+                         sorted(s.shape_id for s in schedule.get_shape_list()))
+        self.assertTrue('shapes' in schedule.get_dirty_tables())
+        self.assertEqual(['s1', 's2', 's1'],
+                         [schedule.get_trip(trip_id).shape_id
+                          for trip_id in ('trip1', 'trip2', 'trip3')])
+        self.assertFalse(getattr(schedule.get_trip('trip4'), 'shape_id', None))
+        self.assertEqual({}, transitfeed.dedup_shapes(schedule))
+
+    def testNearDuplicates(self):
+        shapes = [
+            make_shape('s1', [(0.000004999, 140.0), (0.1, 140.01)]),
+            # Rounds to other decimals but is within 10 ** -5
+            make_shape('s2', [(0.000005001, 140.0), (0.1, 140.0100099)]),
+            make_shape('s3', [(0.00002, 140.0), (0.1, 140.01)]),
+            make_shape('s4', [(0.0, 140.0, 0), (0.1, 140.01, 1.1)]),
+            make_shape('s5', [(-0.000004, 139.999996), (0.1, 140.01)]),
+            make_shape('s6', [(0.0, 140.0, 0.000001), (0.1, 140.01, 1.1)]),
+        ]
+        self.assertNotEqual(shapes[0].get_fingerprint(),
+                            shapes[1].get_fingerprint())
+        self.assertEqual([[0, 1, 4], [3, 5]],
+                         transitfeed.group_duplicate_shapes(shapes))
+        self.assertEqual([], transitfeed.group_duplicate_shapes(shapes, 7))
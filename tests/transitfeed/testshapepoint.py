@@ -75,6 +75,46 @@ class ShapeValidationTestCase(util.ValidationTestCase):
         self.accumulator.assert_no_more_exceptions()
 
 
+class ShapePointsTestCase(util.TestCase):
+    def runTest(self):
+        shape = transitfeed.Shape('TEST')
+        shape.add_shape_point_object_unsorted(
+            transitfeed.ShapePoint('TEST', 36.2, -116.2, 2, 10.5), None)
+        shape.add_shape_point_object_unsorted(
+            transitfeed.ShapePoint('TEST', 36.123456789012345, -116.1, 1, 0), None)
+        self.assertEqual((36.2, -116.2, 10.5),
+                         shape.get_point_with_distance_traveled(11))
+        lat, lng, distance = shape.get_point_with_distance_traveled(5.25)
+        self.assertAlmostEqual(36.161728394506172, lat)
+        self.assertAlmostEqual(-116.15, lng)
+
+        shape.add_shape_point_object_unsorted(
+            transitfeed.ShapePoint('TEST', 36.1, -116.3, 3, None), None)
+        self.assertEqual([(36.123456789012345, -116.1, 0), (36.2, -116.2, 10.5),
+                          (36.1, -116.3, None)], shape.points)
+        self.assertEqual([1, 2, 3], list(shape.sequence))
+        self.assertEqual([('TEST', 36.123456789012345, -116.1, 1, 0),
+                          ('TEST', 36.2, -116.2, 2, 10.5),
+                          ('TEST', 36.1, -116.3, 3, None)],
+                         list(shape.generate_field_values_tuples()))
+
+        copy = shape.copy()
+        # A missing distance is equal to a missing distance
+        self.assertEqual(shape, copy)
+        copy.distance[1] = 10.25
+        self.assertNotEqual(shape, copy)
+        copy.distance[1] = 10.5
+        shape.add_shape_point_object_unsorted(
+            transitfeed.ShapePoint('TEST', 36.3, -116.3, 4, None), None)
+        self.assertNotEqual(shape, copy)
+        self.assertEqual(3, len(copy.points))
+        self.assertEqual('TEST', copy.shape_id)
+
+        shape.clear_points()
+        self.assertEqual([], shape.points)
+        self.assertEqual(0, len(shape.sequence))
+
+
 class ShapePointValidationTestCase(util.ValidationTestCase):
     def runTest(self):
         shapepoint = transitfeed.ShapePoint('', 36.915720, -116.7156, 0, 0)
@@ -0,0 +1,85 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the sqlitefeed module.
+
+import io
+import sqlite3
+import zipfile
+
+from tests import util
+import transitfeed
+
+
+class SqliteFeedTestCase(util.TempFileTestCaseBase):
+
+    def setUp(self):
+        util.TempFileTestCaseBase.setUp(self)
+        self.schedule = util.build_golden_schedule(self)
+        self.schedule.export_sqlite(self.tempfilepath)
+
+    def testSchema(self):
+        connection = sqlite3.connect(self.tempfilepath)
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        tables = set(row[0] for row in cursor)
+        for table in ['agency', 'stops', 'routes', 'trips', 'stop_times',
+                      'calendar', 'calendar_dates', 'shapes', 'frequencies',
+                      'fare_attributes', 'fare_rules', 'transfers', 'feed_info']:
+            self.assertTrue(table in tables, table)
+        cursor.execute("SELECT stop_id,typeof(stop_lat),typeof(stop_lon) "
+                       "FROM stops ORDER BY stop_id")
+        self.assertEqual([('S1', 'real', 'real'), ('S2', 'real', 'real')],
+                         cursor.fetchall())
+        cursor.execute("SELECT trip_id,stop_sequence,arrival_secs FROM stop_times "
+                       "ORDER BY trip_id,stop_sequence")
+        self.assertEqual(
+            self.schedule.connection.execute(
+                "SELECT trip_id,stop_sequence,arrival_secs FROM stop_times "
+                "ORDER BY trip_id,stop_sequence").fetchall(),
+            cursor.fetchall())
+        connection.close()
+
+    def testExportReplacesFile(self):
+        self.schedule.export_sqlite(self.tempfilepath)
+        connection = sqlite3.connect(self.tempfilepath)
+        self.assertEqual(2, connection.execute(
+            "SELECT COUNT(*) FROM stops").fetchone()[0])
+        connection.close()
+
+    def testRoundTrip(self):
+        loaded = transitfeed.load_sqlite(self.tempfilepath)
+        self.assertEqual(sorted(self.schedule.trips), sorted(loaded.trips))
+        self.assertEqual(
+            [st.get_field_values_tuple('T1') for st in
+             self.schedule.get_trip('T1').get_stop_times()],
+            [st.get_field_values_tuple('T1') for st in
+             loaded.get_trip('T1').get_stop_times()])
+        self.assertEqual(self.schedule.get_trip('T1').get_frequency_tuples(),
+                         loaded.get_trip('T1').get_frequency_tuples())
+
+        original = io.BytesIO()
+        self.schedule.write_google_transit_feed(original)
+        written = io.BytesIO()
+        loaded.write_google_transit_feed(written)
+        original_archive = zipfile.ZipFile(original)
+        written_archive = zipfile.ZipFile(written)
+        self.assertEqual(sorted(original_archive.namelist()),
+                         sorted(written_archive.namelist()))
+        for name in original_archive.namelist():
+            self.assertEqual(original_archive.read(name),
+                             written_archive.read(name), name)
+        self.assertEqual(self.schedule.get_shape('SH1').points,
+                         loaded.get_shape('SH1').points)
+        self.assertEqual(set(), loaded.get_dirty_tables())
@@ -0,0 +1,114 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the subset module.
+
+import io
+import zipfile
+
+from tests import util
+import transitfeed
+
+
+class SubsetScheduleTestCase(util.TestCase):
+
+    def setUp(self):
+        self.schedule = util.build_small_network(self)
+
+    def getStopTimes(self, schedule):
+        return schedule.connection.execute(
+            'SELECT * FROM stop_times ORDER BY trip_id,stop_sequence').fetchall()
+
+    def testEverything(self):
+        schedule = util.build_golden_schedule(self)
+        subset = transitfeed.subset_schedule(schedule)
+        expected = io.BytesIO()
+        schedule.write_google_transit_feed(expected)
+        written = io.BytesIO()
+        subset.write_google_transit_feed(written)
+        expected_archive = zipfile.ZipFile(expected)
+        written_archive = zipfile.ZipFile(written)
+        self.assertEqual(expected_archive.namelist(), written_archive.namelist())
+        for name in expected_archive.namelist():
+            self.assertEqual(expected_archive.read(name),
+                             written_archive.read(name), name)
+
+    def testBoundingBox(self):
+        # Only stop B is in the box
+        subset = transitfeed.subset_schedule(
+            self.schedule, bounding_box=(-1, 140.005, 1, 140.015))
+        self.assertEqual(['trip1', 'trip2'], sorted(subset.trips))
+        # Trips are kept whole
+        self.assertEqual(['A', 'B', 'C', 'D'], sorted(subset.stops))
+        self.assertEqual(
+            [row for row in self.getStopTimes(self.schedule)
+             if row[0] in ('trip1', 'trip2')],
+            self.getStopTimes(subset))
+
+    def testBoundingBoxStopWithoutLocation(self):
+        stop = transitfeed.Stop(name='Node', stop_id='N')
+        stop.location_type = 3
+        self.schedule.add_stop_object(stop)
+        self.assertEqual(None, self.schedule.get_stop('N').stop_lat)
+        subset = transitfeed.subset_schedule(
+            self.schedule, bounding_box=(-1, 140.005, 1, 140.015))
+        self.assertEqual(['trip1', 'trip2'], sorted(subset.trips))
+
+    def testRoutes(self):
+        subset = transitfeed.subset_schedule(self.schedule, route_ids=['0'])
+        self.assertEqual(sorted(self.schedule.trips), sorted(subset.trips))
+        self.assertEqual([(36000, 39600, 600, 0)],
+                         subset.get_trip('trip4').get_frequency_tuples())
+
+        subset = transitfeed.subset_schedule(self.schedule, route_ids=['unknown'])
+        self.assertEqual({}, subset.trips)
+        self.assertEqual({}, subset.stops)
+        self.assertEqual([], self.getStopTimes(subset))
+
+    def testDateRange(self):
+        subset = transitfeed.subset_schedule(
+            self.schedule, date_range=('20110301', '20110331'))
+        self.assertEqual(4, len(subset.trips))
+        period = subset.get_service_period('0')
+        self.assertEqual(('20110301', '20110331'),
+                         (period.start_date, period.end_date))
+        # The original isn't changed
+        self.assertEqual('20110101',
+                         self.schedule.get_service_period('0').start_date)
+
+        # Saturday and Sunday
+        subset = transitfeed.subset_schedule(
+            self.schedule, date_range=('20110305', '20110306'))
+        self.assertEqual({}, subset.trips)
+
+        # The first date is after the last one
+        subset = transitfeed.subset_schedule(
+            self.schedule, date_range=('20110331', '20110301'))
+        self.assertEqual({}, subset.trips)
+
+    def testStationsFaresAndTransfers(self):
+        schedule = util.build_golden_schedule(self)
+        station = schedule.add_stop(lat=36.4, lng=-116.7, name='Station',
+                                    stop_id='ST')
+        station.location_type = 1
+        schedule.get_stop('S1').parent_station = 'ST'
+
+        subset = transitfeed.subset_schedule(schedule, route_ids=['R1'])
+        self.assertEqual(['S1', 'S2', 'ST'], sorted(subset.stops))
+        self.assertEqual(['F1'], sorted(subset.fares))
+        self.assertEqual(1, len(subset.get_transfer_list()))
+
+        subset = transitfeed.subset_schedule(schedule, route_ids=[])
+        self.assertEqual({}, subset.fares)
+        self.assertEqual([], subset.get_transfer_list())
@@ -890,3 +890,68 @@ class GetFrequencyTimesTestCase(util.TestCase):
                 for name in st.__slots__:
                     if name not in ('arrival_secs', 'departure_secs'):
                         self.assertEqual(getattr(st, name), getattr(st_clone, name))
+
+
+class FrequencyExpansionTestCase(util.TestCase):
+    """Test for the lazy and indexed frequency expansion methods"""
+
+    def setUp(self):
+        problems = util.get_test_failure_problem_reporter(self)
+        schedule = transitfeed.Schedule(problem_reporter=problems)
+        self.schedule = schedule
+        schedule.add_agency("Agency", "http://iflyagency.com",
+                            "America/Los_Angeles")
+        service_period = schedule.get_default_service_period()
+        service_period.set_start_date("20080101")
+        service_period.set_end_date("20090101")
+        service_period.set_weekday_service(True)
+        stop1 = schedule.add_stop(lng=140.01, lat=0, name="140.01,0")
+        stop2 = schedule.add_stop(lng=140.02, lat=0, name="140.02,0")
+        stop3 = schedule.add_stop(lng=140.03, lat=0, name="140.03,0")
+        route = schedule.add_route("1", "One", "Bus")
+        self.trip = route.add_trip(schedule, "trip 1", trip_id="trip1")
+        for stop, arrival_secs, departure_secs in (
+                (stop1, 61200, 61260), (stop2, None, None),
+                (stop3, 63900, 63900)):
+            self.trip.add_stop_time_object(transitfeed.StopTime(
+                problems, stop, arrival_secs=arrival_secs,
+                departure_secs=departure_secs))
+        self.trip.add_frequency("16:00:00", "18:00:00", 1800)  # each 30 min
+        self.trip.add_frequency("18:00:00", "20:00:00", 2700)  # each 45 min
+
+    def testIterFrequencyStartTimes(self):
+        start_times = self.trip.iter_frequency_start_times()
+        self.assertEqual(57600, next(start_times))
+        self.assertEqual(self.trip.get_frequency_start_times()[1:],
+                         list(start_times))
+
+    def testGetFrequencyRunCount(self):
+        self.assertEqual(7, self.trip.get_frequency_run_count())
+        self.trip.clear_frequencies()
+        self.assertEqual(0, self.trip.get_frequency_run_count())
+
+    def testGetFrequencyStartTimesAfter(self):
+        self.assertEqual(
+            ["17:00:00", "17:30:00", "18:00:00"],
+            [transitfeed.format_seconds_since_midnight(secs) for secs in
+             self.trip.get_frequency_start_times_after(61200, 3)])
+        self.assertEqual(
+            ["18:45:00", "19:30:00"],
+            [transitfeed.format_seconds_since_midnight(secs) for secs in
+             self.trip.get_frequency_start_times_after(64801)])
+        self.assertEqual(self.trip.get_frequency_start_times(),
+                         self.trip.get_frequency_start_times_after(0))
+        self.assertEqual([], self.trip.get_frequency_start_times_after(72000))
+
+    def testGetFrequencyOffsets(self):
+        self.assertEqual(([0, None, 2700], [60, None, 2700]),
+                         self.trip.get_frequency_offsets())
+
+    def testIterFrequencyStopTimes(self):
+        runs = self.trip.iter_frequency_stop_times()
+        first_run = next(runs)
+        self.assertEqual([57600, None, 60300],
+                         [st.arrival_secs for st in first_run])
+        self.assertEqual([57660, None, 60300],
+                         [st.departure_secs for st in first_run])
+        self.assertEqual(6, len(list(runs)))
@@ -236,6 +236,21 @@ class NonNegIntStringToIntTestCase(test_util.TestCase):
         accumulator.assert_no_more_exceptions()
 
 
+class CsvUnicodeWriterTestCase(test_util.TestCase):
+    def testWriteRow(self):
+        output = StringIO(newline='')
+        writer = util.CsvUnicodeWriter(output)
+        writer.writerow(['id', u'name \u020b', 'quote " and, comma', 1, 2.5, ''])
+        self.assertEqual(u'id,name \u020b,"quote "" and, comma",1,2.5,\r\n',
+                         output.getvalue())
+
+    def testWriteRows(self):
+        output = StringIO(newline='')
+        writer = util.CsvUnicodeWriter(output)
+        writer.writerows(iter([('a', 1), (u'\u03b2', None)]))
+        self.assertEqual(u'a,1\r\n\u03b2,\r\n', output.getvalue())
+
+
 class CheckVersionTestCase(test_util.TempDirTestCaseBase):
     def setUp(self):
         self.orig_urlopen = urllib.request.urlopen
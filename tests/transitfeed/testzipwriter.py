@@ -0,0 +1,103 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for the zipwriter module.
+
+import io
+import zipfile
+import zlib
+
+from tests import util
+from transitfeed import zipwriter
+
+
+class UnseekableOutput(io.RawIOBase):
+    def __init__(self):
+        io.RawIOBase.__init__(self)
+        self.data = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.data.write(data)
+
+
+class ZipWriterTestCase(util.TestCase):
+
+    def testMembers(self):
+        text = b'stop_id,stop_name\n' + b'S,Stop\n' * 1000
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(text) + compressor.flush()
+        output = UnseekableOutput()
+        with zipwriter.ZipWriter(output) as writer:
+            with writer.open('stops.txt', 1) as member:
+                member.write(text[:10])
+                member.write(text[10:])
+            writer.write_compressed('compressed.txt',
+                                    [compressed[:5], compressed[5:]],
+                                    len(text), len(compressed), zlib.crc32(text))
+            member = writer.open_compressed('streamed.txt')
+            member.write(compressed[:5])
+            member.write(compressed[5:])
+            member.finish(len(text), zlib.crc32(text))
+            writer.write_compressed(u'hält.txt', [b'abc'], 3, 3,
+                                    zlib.crc32(b'abc'), zipfile.ZIP_STORED)
+
+        archive = zipfile.ZipFile(io.BytesIO(output.data.getvalue()))
+        self.assertEqual(None, archive.testzip())
+        self.assertEqual(['stops.txt', 'compressed.txt', 'streamed.txt',
+                          u'hält.txt'], archive.namelist())
+        self.assertEqual(text, archive.read('stops.txt'))
+        self.assertEqual(text, archive.read('compressed.txt'))
+        self.assertEqual(text, archive.read('streamed.txt'))
+        self.assertEqual(len(compressed),
+                         archive.getinfo('streamed.txt').compress_size)
+        self.assertEqual(b'abc', archive.read(u'hält.txt'))
+        info = archive.getinfo('compressed.txt')
+        self.assertEqual((zipfile.ZIP_DEFLATED, len(compressed)),
+                         (info.compress_type, info.compress_size))
+        self.assertEqual((1980, 1, 1, 0, 0, 0), info.date_time)
+
+    def testErrors(self):
+        writer = zipwriter.ZipWriter(io.BytesIO())
+        self.assertRaises(ValueError, writer.write_compressed, 'short.txt',
+                          [b'ab'], 3, 3, zlib.crc32(b'abc'), zipfile.ZIP_STORED)
+        member = writer.open('a.txt')
+        self.assertRaises(ValueError, writer.open, 'b.txt')
+        self.assertRaises(ValueError, writer.close)
+        member.close()
+        member = writer.open_compressed('c.txt')
+        self.assertRaises(ValueError, writer.open_compressed, 'd.txt')
+        member.finish(0, 0)
+        writer.close()
+
+    def testCopyRawMember(self):
+        text = b'route_id,route_short_name\n' + b'R,1\n' * 100
+        base = io.BytesIO()
+        with zipfile.ZipFile(base, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('routes.txt', text)
+        info = zipfile.ZipFile(base).getinfo('routes.txt')
+        output = io.BytesIO()
+        with zipwriter.ZipWriter(output) as writer:
+            writer.write_compressed(
+                info.filename,
+                zipwriter.generate_raw_member_chunks(base, info, 7),
+                info.file_size, info.compress_size, info.CRC,
+                info.compress_type)
+        archive = zipfile.ZipFile(output)
+        self.assertEqual(None, archive.testzip())
+        self.assertEqual(text, archive.read('routes.txt'))
+        self.assertEqual(info.compress_size,
+                         archive.getinfo('routes.txt').compress_size)
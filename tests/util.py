@@ -636,6 +636,85 @@ def get_test_failure_problem_reporter(test_case, ignore_types=("ExpirationDate",
     return problems
 
 
+def build_small_network(test_case):
+    """Return a Schedule with stops A to D and four trips on weekdays.
+
+    trip1 goes A 08:00, B 08:10, C 08:20. trip2 goes B 08:15, D 08:30. trip3
+    goes A 08:05, D 09:00. trip4 runs every 10 minutes from 10:00 to 11:00 and
+    takes 5 minutes from C to D.
+    """
+    problems = get_test_failure_problem_reporter(test_case)
+    schedule = transitfeed.Schedule(problem_reporter=problems)
+    schedule.add_agency("Agency", "http://iflyagency.com", "America/Los_Angeles")
+    service_period = schedule.get_default_service_period()
+    service_period.set_start_date("20110101")
+    service_period.set_end_date("20111231")
+    service_period.set_weekday_service(True)
+    stops = {}
+    for i, stop_id in enumerate("ABCD"):
+        stops[stop_id] = schedule.add_stop(lng=140.0 + i * 0.01, lat=0,
+                                           name=stop_id, stop_id=stop_id)
+    route = schedule.add_route("1", "One", "Bus")
+    for trip_id, stop_times in (
+            ("trip1", (("A", 28800), ("B", 29400), ("C", 30000))),
+            ("trip2", (("B", 29700), ("D", 30600))),
+            ("trip3", (("A", 29100), ("D", 32400))),
+            ("trip4", (("C", 36000), ("D", 36300)))):
+        trip = route.add_trip(schedule, "Headsign", trip_id=trip_id)
+        for stop_id, secs in stop_times:
+            trip.add_stop_time_object(transitfeed.StopTime(
+                problems, stops[stop_id], arrival_secs=secs, departure_secs=secs))
+    schedule.get_trip("trip4").add_frequency("10:00:00", "11:00:00", 600)
+    return schedule
+
+
+def build_golden_schedule(test_case):
+    """Return a Schedule with at least one row in every table it can write."""
+    problems = get_test_failure_problem_reporter(
+        test_case, ("ExpirationDate", "OtherProblem", "NoServiceExceptions"))
+    schedule = transitfeed.Schedule(problem_reporter=problems)
+    schedule.add_agency(u"\u020b Fly Agency", "http://iflyagency.com",
+                        "America/Los_Angeles", agency_id="DTA")
+    schedule.add_feed_info_object(transitfeed.FeedInfo(field_dict={
+        "feed_publisher_name": "Publisher, Inc.",
+        "feed_publisher_url": "http://example.com", "feed_lang": "en"}))
+    week = transitfeed.ServicePeriod("WEEK")
+    week.set_start_date("20070101")
+    week.set_end_date("20071231")
+    week.set_weekday_service(True)
+    week.set_date_has_service("20070704", False)
+    schedule.add_service_period_object(week)
+    holiday = transitfeed.ServicePeriod("HOLIDAY")
+    holiday.set_date_has_service("20071225")
+    schedule.add_service_period_object(holiday)
+    stop1 = schedule.add_stop(lng=-116.751677, lat=36.425288, name=u"Stop \u020b",
+                              stop_id="S1")
+    stop2 = schedule.add_stop(lng=-116.76218, lat=36.868446,
+                              name='Quote " and, comma', stop_id="S2")
+    route = schedule.add_route(u"β", "Beta", "Bus", route_id="R1")
+    shape = transitfeed.Shape("SH1")
+    shape.add_point(36.425288, -116.751677, 0)
+    shape.add_point(36.868446, -116.76218, 1500.5)
+    schedule.add_shape_object(shape)
+    for trip_id, service_period, secs in (("T1", week, 36000), ("T2", holiday, 90000)):
+        trip = route.add_trip(schedule, "To S2", trip_id=trip_id,
+                              service_period=service_period)
+        trip.shape_id = "SH1"
+        trip.add_stop_time_object(transitfeed.StopTime(
+            problems, stop1, arrival_secs=secs, departure_secs=secs + 30,
+            stop_headsign="Via S1", shape_dist_traveled=0))
+        trip.add_stop_time_object(transitfeed.StopTime(
+            problems, stop2, arrival_secs=secs + 600, departure_secs=secs + 600,
+            pickup_type=1, shape_dist_traveled=1500.5, timepoint=1))
+    schedule.get_trip("T1").add_frequency("10:00:00", "12:00:00", 1800)
+    fare = transitfeed.FareAttribute("F1", "1.25", "USD", 1, 0, 3600)
+    schedule.add_fare_attribute_object(fare)
+    schedule.add_fare_rule_object(transitfeed.FareRule("F1", "R1"))
+    schedule.add_transfer_object(transitfeed.Transfer(
+        from_stop_id="S1", to_stop_id="S2", transfer_type=2, min_transfer_time=300))
+    return schedule
+
+
 class ExceptionProblemReporterNoExpiration(transitfeed.ProblemReporter):
     """Ignores feed expiration problems.
 
@@ -62,24 +62,37 @@ Stop object which has attributes such as stop_lat and stop_name.
 # TODO: Solve this problem cleanly
 from .util import *
 from .agency import *
+from .columnar import *
+from .connectionscan import *
+from .departureboard import *
 from .fareattribute import *
 from .farerule import *
+from .feeddiff import *
 from .frequency import *
 from .gtfsfactory import *
 from .gtfsfactoryuser import *
 from .gtfsobjectbase import *
+from .headwayanalytics import *
 from .loader import *
 from .problems import *
+from .raptor import *
 from .route import *
 from .schedule import *
+from .scheduleupdate import *
+from .servicecalendar import *
 from .serviceperiod import *
 from .shape import *
+from .shapededup import *
 from .shapelib import *
 from .shapeloader import *
 from .shapepoint import *
+from .spatialindex import *
+from .sqlitefeed import *
 from .stop import *
 from .stoptime import *
+from .subset import *
 from .transfer import *
 from .trip import *
+from .zipwriter import *
 
 from transitfeed.version import __version__
@@ -67,7 +67,7 @@ class Agency(GtfsObjectBase):
             if timezone:
                 kwargs['agency_timezone'] = timezone
             if idd:
-                kwargs['agency_id'] = id
+                kwargs['agency_id'] = idd
             if lang:
                 kwargs['agency_lang'] = lang
             if email:
@@ -0,0 +1,154 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Export the large tables of a Schedule to Arrow and Parquet and load
+stop_times back from Parquet.
+
+The stops, trips, stop_times and shapes tables have the same columns as in
+sqlitefeed: times are integer seconds since midnight in columns such as
+arrival_secs, numeric columns are int32 or float64, ids are dictionary
+encoded strings and empty values are null. pyarrow is only imported when one
+of these functions is called, so it is an optional dependency.
+"""
+
+import os
+
+from . import gtfsfactoryuser
+from . import problems as problems_module
+from . import sqlitefeed
+
+ARROW_TABLES = ['stops', 'trips', 'stop_times', 'shapes']
+
+_SHAPE_COLUMNS = ['shape_id', 'shape_pt_lat', 'shape_pt_lon',
+                  'shape_pt_sequence', 'shape_dist_traveled']
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('The pyarrow package is needed to read and write Arrow '
+                          'and Parquet tables (pip install pyarrow)')
+    return pyarrow
+
+
+def _make_array(pyarrow, column, values):
+    column_type = sqlitefeed._COLUMN_TYPES.get(column)
+    if column_type == 'INTEGER':
+        return pyarrow.array([None if v is None else int(v) for v in values],
+                             pyarrow.int32())
+    if column_type == 'REAL':
+        return pyarrow.array([None if v is None else float(v) for v in values],
+                             pyarrow.float64())
+    array = pyarrow.array([None if v is None else str(v) for v in values],
+                          pyarrow.string())
+    if column.endswith('_id') or column == 'parent_station':
+        return array.dictionary_encode()
+    return array
+
+
+def _make_table(pyarrow, columns, rows):
+    values = [[] for _ in columns]
+    appenders = [column_values.append for column_values in values]
+    for row in rows:
+        for append, value in zip(appenders, row):
+            append(None if value == '' else value)
+    return pyarrow.Table.from_arrays(
+        [_make_array(pyarrow, c, v) for c, v in zip(columns, values)],
+        names=list(columns))
+
+
+def get_arrow_table(schedule, table):
+    """Return one of ARROW_TABLES of schedule as a pyarrow.Table.
+
+    stop_times are read from the database of the schedule ordered by trip_id
+    and stop_sequence. The result can be passed to pandas with to_pandas().
+    """
+    pyarrow = _import_pyarrow()
+    if table == 'stop_times':
+        columns = schedule._gtfs_factory.StopTime.SQL_FIELD_NAMES
+        cursor = schedule.connection.cursor()
+        cursor.execute('SELECT %s FROM stop_times ORDER BY trip_id,stop_sequence'
+                       % ','.join(columns))
+        rows = cursor
+    elif table == 'shapes':
+        columns = _SHAPE_COLUMNS
+        rows = schedule._generate_shape_rows()
+    elif table == 'stops':
+        columns = schedule.get_table_columns('stops')
+        rows = sqlitefeed._generate_object_values(schedule.get_stop_list(), columns)
+    elif table == 'trips':
+        columns = schedule.get_table_columns('trips')
+        rows = sqlitefeed._generate_object_values(schedule.get_trip_list(), columns)
+    else:
+        raise ValueError('%s is not one of %s' % (table, ', '.join(ARROW_TABLES)))
+    return _make_table(pyarrow, columns, rows)
+
+
+def export_parquet(schedule, directory):
+    """Write each of ARROW_TABLES of schedule to directory/<table>.parquet.
+
+    Returns:
+      a list of the paths written
+    """
+    pyarrow = _import_pyarrow()
+    paths = []
+    for table in ARROW_TABLES:
+        path = os.path.join(directory, '%s.parquet' % table)
+        pyarrow.parquet.write_table(get_arrow_table(schedule, table), path)
+        paths.append(path)
+    return paths
+
+
+def load_stop_times_parquet(schedule, path,
+                            problems=problems_module.default_problem_reporter,
+                            gtfs_factory=None):
+    """Add the stop_times in a Parquet file, as written by export_parquet, to
+    schedule.
+
+    The columns are inserted into the database of the schedule with one
+    executemany, without creating a StopTime object for each row. Rows with a
+    trip_id or stop_id that isn't in schedule are reported once per value and
+    skipped. The stop_times are validated by Schedule.validate like those
+    loaded from stop_times.txt.
+    """
+    pyarrow = _import_pyarrow()
+    if gtfs_factory is None:
+        gtfs_factory = gtfsfactoryuser.GtfsFactoryUser().get_gtfs_factory()
+    columns = gtfs_factory.StopTime.SQL_FIELD_NAMES
+    table = pyarrow.parquet.read_table(path)
+    values = []
+    for column in columns:
+        if column in table.schema.names:
+            values.append(table.column(column).to_pylist())
+        else:
+            values.append([None] * table.num_rows)
+
+    trip_ids = values[columns.index('trip_id')]
+    stop_ids = values[columns.index('stop_id')]
+    for column, ids, known_ids, file_name in (
+            ('trip_id', trip_ids, schedule.trips, 'trips.txt'),
+            ('stop_id', stop_ids, schedule.stops, 'stops.txt')):
+        for value in sorted(set(ids).difference(known_ids), key=str):
+            problems.invalid_value(column, value,
+                                   'This value wasn\'t defined in %s' % file_name)
+
+    cursor = schedule.connection.cursor()
+    cursor.executemany(
+        'INSERT INTO stop_times (%s) VALUES (%s)' % (
+            ','.join(columns), ','.join(['?'] * len(columns))),
+        (row for row, trip_id, stop_id in zip(zip(*values), trip_ids, stop_ids)
+         if trip_id in schedule.trips and stop_id in schedule.stops))
+    schedule.mark_table_dirty('stop_times')
@@ -0,0 +1,343 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from array import array
+import bisect
+import itertools
+from operator import itemgetter
+
+from . import util
+
+INFINITY = float('inf')
+
+
+class ConnectionScanPlanner:
+    """A journey planner using the Connection Scan Algorithm.
+
+    Every pair of consecutive stops of every trip is a connection. Connections
+    are kept in parallel arrays sorted by departure time, so a query is a
+    single scan from the requested departure time. Each run of a
+    frequency-based trip is expanded into its own connections.
+
+    Footpaths come from transfers.txt. A transfer between two different stops
+    is a footpath of min_transfer_time seconds (0 if it is not set) and a
+    transfer from a stop to itself sets the time needed to change vehicles at
+    that stop. Transfers of type 3 (not possible) are ignored.
+
+    The planner is a snapshot: build a new one after changing the schedule.
+    """
+
+    def __init__(self, schedule):
+        self._stop_ids = list(schedule.stops.keys())
+        self._stop_index = dict((stop_id, i) for i, stop_id in enumerate(self._stop_ids))
+        self._calendar = schedule.get_service_calendar()
+        # trip_id and service_id of each trip run
+        self._run_trip_ids = []
+        self._run_service_ids = []
+        self._active_runs = {}
+        self._build_connections(schedule)
+        self._build_footpaths(schedule)
+
+    def _build_connections(self, schedule):
+        stops = schedule.stops
+        trips = schedule.trips
+        connections = []
+        cursor = schedule.connection.cursor()
+        cursor.execute(
+            'SELECT trip_id,stop_id,arrival_secs,departure_secs '
+            'FROM stop_times ORDER BY trip_id,stop_sequence')
+        for trip_id, rows in itertools.groupby(cursor, key=itemgetter(0)):
+            trip = trips.get(trip_id)
+            if trip is None:
+                continue
+            rows = list(rows)
+            times = util.interpolate_times([row[2:4] for row in rows],
+                                           [stops[row[1]] for row in rows])
+            # Consecutive stops that have a time, possibly interpolated
+            hops = []
+            previous = None
+            for row, (arrival_secs, departure_secs, _) in zip(rows, times):
+                if arrival_secs is None:
+                    continue
+                if previous is not None:
+                    hops.append((previous[1], arrival_secs,
+                                 self._stop_index[previous[0]],
+                                 self._stop_index[row[1]]))
+                previous = (row[1], departure_secs)
+            if not hops:
+                continue
+
+            run_shifts = [0]
+            # Like DepartureBoard, a template without a first time is a
+            # single run
+            if times[0][0] is not None and trip.get_frequency_tuples():
+                run_shifts = [run_secs - times[0][0] for run_secs in
+                              trip.iter_frequency_start_times()]
+            for shift in run_shifts:
+                run = len(self._run_trip_ids)
+                self._run_trip_ids.append(trip_id)
+                self._run_service_ids.append(trip.service_id)
+                for departure_secs, arrival_secs, from_index, to_index in hops:
+                    connections.append((departure_secs + shift, arrival_secs + shift,
+                                        from_index, to_index, run))
+
+        connections.sort()
+        self._departure_secs = array('l', (c[0] for c in connections))
+        self._arrival_secs = array('l', (c[1] for c in connections))
+        self._from_stops = array('l', (c[2] for c in connections))
+        self._to_stops = array('l', (c[3] for c in connections))
+        self._runs = array('l', (c[4] for c in connections))
+
+    def _build_footpaths(self, schedule):
+        self._footpaths = [[] for _ in self._stop_ids]
+        self._reverse_footpaths = [[] for _ in self._stop_ids]
+        self._change_secs = {}
+        for transfer in schedule.get_transfer_iter():
+            if transfer.transfer_type == 3:
+                continue
+            from_index = self._stop_index.get(transfer.from_stop_id)
+            to_index = self._stop_index.get(transfer.to_stop_id)
+            if from_index is None or to_index is None:
+                continue
+            secs = transfer.min_transfer_time
+            if not isinstance(secs, int):
+                secs = 0
+            if from_index == to_index:
+                self._change_secs[from_index] = secs
+            else:
+                self._footpaths[from_index].append((to_index, secs))
+                self._reverse_footpaths[to_index].append((from_index, secs))
+
+    def get_connection_count(self):
+        """Return the number of connections, counting every run of
+        frequency-based trips."""
+        return len(self._departure_secs)
+
+    def _get_active_runs(self, date):
+        """Return a bytearray with a true value for each trip run active on
+        date. If date is None all runs are active."""
+        if not date:
+            return None
+        service_ids = self._calendar.get_active_service_ids(date)
+        if service_ids not in self._active_runs:
+            self._active_runs[service_ids] = bytearray(
+                service_id in service_ids for service_id in self._run_service_ids)
+        return self._active_runs[service_ids]
+
+    def _scan(self, origin, date, secs, target=None):
+        arrival = [INFINITY] * len(self._stop_ids)
+        # The earliest time a vehicle can be boarded, which includes the time
+        # needed to change vehicles after arriving by another one
+        ready = [INFINITY] * len(self._stop_ids)
+        # The connection or (stop, footpath secs) used to first reach each stop
+        reached_by = [None] * len(self._stop_ids)
+        boarded = {}
+
+        arrival[origin] = ready[origin] = secs
+        for to_index, walk_secs in self._footpaths[origin]:
+            if secs + walk_secs < arrival[to_index]:
+                arrival[to_index] = ready[to_index] = secs + walk_secs
+                reached_by[to_index] = (origin, walk_secs)
+
+        active_runs = self._get_active_runs(date)
+        departure_secs = self._departure_secs
+        arrival_secs = self._arrival_secs
+        from_stops = self._from_stops
+        to_stops = self._to_stops
+        runs = self._runs
+        for c in range(bisect.bisect_left(departure_secs, secs), len(departure_secs)):
+            if target is not None and departure_secs[c] >= arrival[target]:
+                break
+            run = runs[c]
+            if active_runs is not None and not active_runs[run]:
+                continue
+            if run not in boarded:
+                if ready[from_stops[c]] > departure_secs[c]:
+                    continue
+                boarded[run] = c
+            arr = arrival_secs[c]
+            to_index = to_stops[c]
+            if arr >= arrival[to_index]:
+                continue
+            arrival[to_index] = arr
+            reached_by[to_index] = c
+            ready[to_index] = min(ready[to_index], arr + self._change_secs.get(to_index, 0))
+            for walk_index, walk_secs in self._footpaths[to_index]:
+                if arr + walk_secs < arrival[walk_index]:
+                    arrival[walk_index] = arr + walk_secs
+                    ready[walk_index] = min(ready[walk_index], arr + walk_secs)
+                    reached_by[walk_index] = (to_index, walk_secs)
+        return arrival, reached_by, boarded
+
+    def get_earliest_arrival(self, origin_stop_id, destination_stop_id, date, secs):
+        """Return the earliest arrival at a stop.
+
+        Args:
+          origin_stop_id: the stop_id the journey starts at
+          destination_stop_id: the stop_id the journey ends at
+          date: a "YYYYMMDD" string or a date object. Only trips active on date
+              are used. If it is None or empty all trips are used.
+          secs: seconds since midnight the journey starts at
+
+        Returns:
+          seconds since midnight or None if the destination can't be reached
+        """
+        origin = self._stop_index[origin_stop_id]
+        target = self._stop_index[destination_stop_id]
+        arrival, _, _ = self._scan(origin, date, secs, target)
+        if arrival[target] == INFINITY:
+            return None
+        return arrival[target]
+
+    def get_earliest_arrivals(self, origin_stop_id, date, secs):
+        """Return the earliest arrival at every stop reachable from a stop.
+
+        Args:
+          origin_stop_id: the stop_id the journeys start at
+          date: a "YYYYMMDD" string, a date object or None, see
+              get_earliest_arrival
+          secs: seconds since midnight the journeys start at
+
+        Returns:
+          a dict mapping stop_id to seconds since midnight
+        """
+        arrival, _, _ = self._scan(self._stop_index[origin_stop_id], date, secs)
+        return dict((self._stop_ids[i], arr) for i, arr in enumerate(arrival)
+                    if arr != INFINITY)
+
+    def get_journey(self, origin_stop_id, destination_stop_id, date, secs):
+        """Return the legs of a journey arriving as early as possible.
+
+        Args:
+          origin_stop_id: the stop_id the journey starts at
+          destination_stop_id: the stop_id the journey ends at
+          date: a "YYYYMMDD" string, a date object or None, see
+              get_earliest_arrival
+          secs: seconds since midnight the journey starts at
+
+        Returns:
+          a list of (trip_id, from_stop_id, departure_secs, to_stop_id,
+          arrival_secs) tuples, with a trip_id of None for footpaths. The list
+          is empty if the origin is the destination and None if the destination
+          can't be reached.
+        """
+        origin = self._stop_index[origin_stop_id]
+        target = self._stop_index[destination_stop_id]
+        arrival, reached_by, boarded = self._scan(origin, date, secs, target)
+        if arrival[target] == INFINITY:
+            return None
+        legs = []
+        stop_index = target
+        while stop_index != origin:
+            step = reached_by[stop_index]
+            if isinstance(step, tuple):
+                from_index, walk_secs = step
+                legs.append((None, self._stop_ids[from_index],
+                             arrival[stop_index] - walk_secs,
+                             self._stop_ids[stop_index], arrival[stop_index]))
+            else:
+                first = boarded[self._runs[step]]
+                from_index = self._from_stops[first]
+                legs.append((self._run_trip_ids[self._runs[step]],
+                             self._stop_ids[from_index], self._departure_secs[first],
+                             self._stop_ids[stop_index], self._arrival_secs[step]))
+            stop_index = from_index
+        legs.reverse()
+        return legs
+
+    def get_profile(self, origin_stop_id, destination_stop_id, date,
+                    start_secs, end_secs):
+        """Return the best journeys between two stops over a time range.
+
+        The connections are scanned once, latest first, keeping for every stop
+        the pareto set of (departure, arrival at destination) pairs.
+
+        Args:
+          origin_stop_id: the stop_id the journeys start at
+          destination_stop_id: the stop_id the journeys end at
+          date: a "YYYYMMDD" string, a date object or None, see
+              get_earliest_arrival
+          start_secs: seconds since midnight of the earliest departure
+          end_secs: seconds since midnight of the latest departure
+
+        Returns:
+          a list of (departure_secs, arrival_secs) tuples sorted by departure,
+          where a later departure always arrives later.
+        """
+        origin = self._stop_index[origin_stop_id]
+        target = self._stop_index[destination_stop_id]
+        walk_to_target = {target: 0}
+        for from_index, walk_secs in self._reverse_footpaths[target]:
+            walk_to_target[from_index] = walk_secs
+        # Map from stop index to a pair of lists (departures, arrivals) sorted by
+        # departure, where arrivals are increasing too
+        profiles = {}
+        run_arrival = {}
+        active_runs = self._get_active_runs(date)
+        for c in range(len(self._departure_secs) - 1,
+                       bisect.bisect_left(self._departure_secs, start_secs) - 1, -1):
+            run = self._runs[c]
+            if active_runs is not None and not active_runs[run]:
+                continue
+            arr = self._arrival_secs[c]
+            to_index = self._to_stops[c]
+            best = run_arrival.get(run, INFINITY)
+            if to_index in walk_to_target:
+                best = min(best, arr + walk_to_target[to_index])
+            best = min(best, self._evaluate_profile(
+                profiles.get(to_index), arr + self._change_secs.get(to_index, 0)))
+            if best == INFINITY:
+                continue
+            run_arrival[run] = best
+            dep = self._departure_secs[c]
+            from_index = self._from_stops[c]
+            self._add_to_profile(profiles, from_index, dep, best)
+            for walk_index, walk_secs in self._reverse_footpaths[from_index]:
+                self._add_to_profile(profiles, walk_index, dep - walk_secs, best)
+
+        if origin not in profiles:
+            return []
+        departures, arrivals = profiles[origin]
+        return [(dep, arr) for dep, arr in zip(departures, arrivals)
+                if start_secs <= dep <= end_secs]
+
+    @staticmethod
+    def _evaluate_profile(profile, secs):
+        """Return the earliest arrival of a profile when leaving at secs."""
+        if not profile:
+            return INFINITY
+        departures, arrivals = profile
+        i = bisect.bisect_left(departures, secs)
+        if i == len(departures):
+            return INFINITY
+        return arrivals[i]
+
+    @staticmethod
+    def _add_to_profile(profiles, stop_index, dep, arr):
+        departures, arrivals = profiles.setdefault(stop_index, ([], []))
+        i = bisect.bisect_left(departures, dep)
+        if i < len(departures) and arrivals[i] <= arr:
+            # Dominated by a later or equal departure arriving no later
+            return
+        if i < len(departures) and departures[i] == dep:
+            del departures[i]
+            del arrivals[i]
+        # Remove earlier departures that don't arrive earlier
+        j = i
+        while j > 0 and arrivals[j - 1] >= arr:
+            j -= 1
+        del departures[j:i]
+        del arrivals[j:i]
+        departures.insert(j, dep)
+        arrivals.insert(j, arr)
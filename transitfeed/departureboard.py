@@ -0,0 +1,190 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import heapq
+import itertools
+from operator import itemgetter
+import weakref
+
+from .servicecalendar import ServiceCalendar
+from .util import defaultdict
+from . import util
+
+
+class DepartureBoard:
+    """The departures from every stop of a schedule, sorted for fast lookup.
+
+    The stop_times table is read once and, for each stop and service, the
+    times trips visit the stop are kept in a sorted list. Trips defined by
+    frequencies contribute one departure per run. Each departure is a tuple
+    (secs, trip, index, headsign, is_timepoint) where secs is an integer that
+    might be interpolated, index is the offset of the stop in
+    trip.get_stop_times() and headsign is the most recent stop_headsign of the
+    trip or its trip_headsign.
+
+    The board is a snapshot: build a new one after changing the schedule, or
+    call update_trips and update_calendar with what changed.
+    """
+
+    def __init__(self, schedule):
+        # A proxy avoids a reference cycle when the schedule caches the board
+        self._schedule = weakref.proxy(schedule)
+        self._calendar = ServiceCalendar(schedule.get_service_period_list())
+        # Map from stop_id to a dict mapping service_id to a tuple of
+        # (sorted list of secs, list of departures in the same order)
+        self._stop_departures = {}
+        # Map from trip_id to the set of (stop_id, service_id) keys of
+        # _stop_departures with departures of the trip
+        self._trip_keys = defaultdict(set)
+        self._build()
+
+    # Number of trip_ids read with one query by update_trips
+    _TRIP_BATCH_SIZE = 500
+
+    def _add_trip_departures(self, departures, trip, rows):
+        """Append the departures of trip, given its stop_times rows ordered by
+        stop_sequence, to the lists of departures keyed by (stop_id,
+        service_id)."""
+        stops = self._schedule.stops
+        # secs is the arrival time when there is one, like in
+        # Trip.get_time_interpolated_stops
+        times = [(arrival_secs, is_timepoint) for arrival_secs, _, is_timepoint in
+                 util.interpolate_times([row[2:4] for row in rows],
+                                        [stops[row[1]] for row in rows])]
+        # Each run of a frequency-based trip is the template shifted in time
+        run_shifts = [0]
+        if times[0][0] is not None and trip.get_frequency_tuples():
+            run_shifts = [run_secs - times[0][0] for run_secs in
+                          trip.iter_frequency_start_times()]
+        headsign = None
+        trip_keys = self._trip_keys[trip.trip_id]
+        for index, (row, (secs, is_timepoint)) in enumerate(zip(rows, times)):
+            if row[4]:
+                headsign = row[4]
+            if secs is None:
+                continue
+            key = (row[1], trip.service_id)
+            trip_keys.add(key)
+            stop_departures = departures[key]
+            for shift in run_shifts:
+                stop_departures.append(
+                    (secs + shift, trip.trip_id, index,
+                     (secs + shift, trip, index,
+                      headsign or trip.trip_headsign, is_timepoint)))
+
+    def _add_rows_departures(self, departures, cursor):
+        trips = self._schedule.trips
+        for trip_id, rows in itertools.groupby(cursor, key=itemgetter(0)):
+            trip = trips.get(trip_id)
+            if trip is not None:
+                self._add_trip_departures(departures, trip, list(rows))
+
+    def _set_departures(self, key, stop_departures):
+        stop_id, service_id = key
+        stop_departures.sort(key=itemgetter(0, 1, 2))
+        if stop_departures:
+            self._stop_departures.setdefault(stop_id, {})[service_id] = (
+                [d[0] for d in stop_departures], [d[3] for d in stop_departures])
+        elif not self._stop_departures.get(stop_id):
+            self._stop_departures.pop(stop_id, None)
+
+    def _build(self):
+        departures = defaultdict(list)
+        cursor = self._schedule.connection.cursor()
+        cursor.execute(
+            'SELECT trip_id,stop_id,arrival_secs,departure_secs,stop_headsign '
+            'FROM stop_times ORDER BY trip_id,stop_sequence')
+        self._add_rows_departures(departures, cursor)
+        for key, stop_departures in departures.items():
+            self._set_departures(key, stop_departures)
+
+    def update_trips(self, trip_ids):
+        """Replace the departures of the given trips with the departures of
+        their current stop_times, frequencies and service.
+
+        Only the stops and services the trips visited or now visit are sorted
+        again, so this is much faster than building a new board when a few
+        trips change. Trips which are no longer in the schedule are removed.
+        """
+        trip_ids = set(trip_ids)
+        # Map from key to the departures of the key, minus those of trip_ids
+        departures = {}
+
+        def get_departures(key):
+            if key not in departures:
+                stop_id, service_id = key
+                times, key_departures = self._stop_departures.get(
+                    stop_id, {}).pop(service_id, ((), ()))
+                departures[key] = [(d[0], d[1].trip_id, d[2], d)
+                                   for d in key_departures
+                                   if d[1].trip_id not in trip_ids]
+            return departures[key]
+
+        for trip_id in trip_ids:
+            for key in self._trip_keys.pop(trip_id, ()):
+                get_departures(key)
+        new_departures = defaultdict(list)
+        cursor = self._schedule.connection.cursor()
+        sorted_trip_ids = sorted(t for t in trip_ids if t in self._schedule.trips)
+        for i in range(0, len(sorted_trip_ids), self._TRIP_BATCH_SIZE):
+            batch = sorted_trip_ids[i:i + self._TRIP_BATCH_SIZE]
+            cursor.execute(
+                'SELECT trip_id,stop_id,arrival_secs,departure_secs,stop_headsign '
+                'FROM stop_times WHERE trip_id IN (%s) '
+                'ORDER BY trip_id,stop_sequence' % ','.join('?' * len(batch)),
+                batch)
+            self._add_rows_departures(new_departures, cursor)
+        for key, key_departures in new_departures.items():
+            get_departures(key).extend(key_departures)
+        for key, key_departures in departures.items():
+            self._set_departures(key, key_departures)
+
+    def update_calendar(self):
+        """Read the dates of the service periods of the schedule again, after
+        they were changed."""
+        self._calendar = ServiceCalendar(self._schedule.get_service_period_list())
+
+    def next_departures(self, stop_id, date=None, secs=0, limit=5):
+        """Return the next departures from a stop.
+
+        Finding the first departure of each service active on date is a binary
+        search, after which the sorted departures of the services are merged
+        until limit departures are found.
+
+        Args:
+          stop_id: the id of the stop
+          date: a "YYYYMMDD" string or a date object. If it is None or empty
+              departures of all services are returned.
+          secs: seconds since midnight of the first departure to return
+          limit: the maximum number of departures to return
+
+        Returns:
+          a list of (secs, trip, index, headsign, is_timepoint) tuples, sorted
+          by secs.
+        """
+        if date:
+            active_service_ids = self._calendar.get_active_service_ids(date)
+        else:
+            active_service_ids = None
+        service_departures = []
+        for service_id, (times, departures) in self._stop_departures.get(stop_id, {}).items():
+            if active_service_ids is not None and service_id not in active_service_ids:
+                continue
+            start = bisect.bisect_left(times, secs)
+            if start < len(departures):
+                service_departures.append(
+                    map(departures.__getitem__, range(start, len(departures))))
+        return list(itertools.islice(
+            heapq.merge(*service_departures, key=itemgetter(0)), limit))
@@ -0,0 +1,337 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compute what changed between two versions of a feed.
+
+The entities of both versions are aligned by id and compared by a hash of
+their contents, so only the entities that changed are compared field by
+field. The stop_times of every trip are hashed in one ordered pass over the
+stop_times table of each schedule, without creating StopTime objects. The
+changes are a dict of lists and dicts of strings which can be written with
+json.dump.
+"""
+
+import hashlib
+import itertools
+import os
+
+from . import loader
+from . import problems as problems_module
+from . import servicecalendar
+from . import sqlitefeed
+from . import util
+
+# The sections of a changeset, one for each type of entity
+CHANGESET_SECTIONS = ['agency', 'stops', 'routes', 'service_periods', 'shapes',
+                      'trips', 'fares']
+
+# Shapes are compared with coordinates rounded to about 10 cm
+_SHAPE_PRECISION = 6
+
+_SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def _is_sqlite_database(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(_SQLITE_HEADER)) == _SQLITE_HEADER
+
+
+def load_feed_version(path, problems=None, memory_db=True):
+    """Return a Schedule of one version of a feed.
+
+    Args:
+      path: a GTFS zip file or directory, or a database written by
+          export_sqlite, such as the previous version of the feed saved by the
+          last diff. A database is loaded without parsing and validating the
+          feed again.
+      problems: a ProblemReporter, by default problems.default_problem_reporter
+      memory_db: passed to the Schedule
+    """
+    if problems is None:
+        problems = problems_module.default_problem_reporter
+    if _is_sqlite_database(path):
+        return sqlitefeed.load_sqlite(path, problems, memory_db)
+    return loader.Loader(path, loader_problems=problems,
+                         memory_db=memory_db).load()
+
+
+def _get_field_values(entity):
+    """Return a dict of the fields of entity which aren't empty, as strings.
+
+    The values are strings so a feed loaded from a GTFS file and one loaded
+    from a database, where the numbers have been parsed, compare equal."""
+    fields = {}
+    for name in entity.keys():
+        value = getattr(entity, name, None)
+        if value is None or value == '' or isinstance(value, (list, dict)):
+            continue
+        fields[name] = str(value)
+    return fields
+
+
+def _hash(value):
+    return hashlib.sha1(repr(value).encode('utf-8')).digest()
+
+
+def _get_changed_fields(old_fields, new_fields):
+    """Return a dict of the names of the fields which differ to a list
+    [old value, new value], None for a missing value."""
+    return dict((name, [old_fields.get(name), new_fields.get(name)])
+                for name in sorted(set(old_fields) | set(new_fields))
+                if old_fields.get(name) != new_fields.get(name))
+
+
+def _get_stop_times_hashes(schedule):
+    """Return a dict of trip_id to a hash of the stop_times of the trip.
+
+    The stop_times are read in one query, in the order of trip_index, and
+    hashed one trip at a time. The stop_sequence numbers aren't part of the
+    hash, only the order of the stops, so renumbered stop_times are the same.
+    """
+    cursor = schedule.connection.cursor()
+    cursor.execute(
+        'SELECT trip_id,arrival_secs,departure_secs,stop_id,'
+        "ifnull(stop_headsign,''),pickup_type,drop_off_type,"
+        'shape_dist_traveled,timepoint FROM stop_times INDEXED BY trip_index '
+        'ORDER BY trip_id,stop_sequence')
+    hashes = {}
+    try:
+        for trip_id, rows in itertools.groupby(cursor, lambda row: row[0]):
+            hashes[trip_id] = _hash([row[1:] for row in rows])
+    finally:
+        cursor.close()
+    return hashes
+
+
+def _get_period_fields(period):
+    """Return a dict of the calendar.txt fields of period which aren't empty."""
+    return dict((name, str(value)) for name, value in
+                zip(period.FIELD_NAMES,
+                    period.get_calendar_field_values_tuple() or [])
+                if value is not None and value != '')
+
+
+def _hash_period(period):
+    return _hash((sorted(_get_period_fields(period).items()),
+                  sorted((date, exception_type) for date, (exception_type, _)
+                         in period.date_exceptions.items())))
+
+
+def _get_changes(old_entities, new_entities, old_hashes, new_hashes, describe):
+    """Return the changes between two dicts of id to entity as a dict.
+
+    Args:
+      old_entities, new_entities: dicts of id to entity
+      old_hashes, new_hashes: dicts of id to the hash of the entity
+      describe: a function of the old and new entity of a modified id which
+          returns a dict of its changes
+    """
+    old_ids = set(old_hashes)
+    new_ids = set(new_hashes)
+    modified_ids = sorted(i for i in old_ids & new_ids
+                          if old_hashes[i] != new_hashes[i])
+    return {
+        'added': sorted(new_ids - old_ids),
+        'removed': sorted(old_ids - new_ids),
+        'modified': dict((i, describe(old_entities[i], new_entities[i]))
+                         for i in modified_ids),
+    }
+
+
+def _diff_entities(old_entities, new_entities, get_hash, describe):
+    return _get_changes(old_entities, new_entities,
+                        dict((i, get_hash(e)) for i, e in old_entities.items()),
+                        dict((i, get_hash(e)) for i, e in new_entities.items()),
+                        describe)
+
+
+def _hash_fields(entity):
+    return _hash(sorted(_get_field_values(entity).items()))
+
+
+def _describe_fields(old, new):
+    return {'fields': _get_changed_fields(_get_field_values(old),
+                                          _get_field_values(new))}
+
+
+def _diff_stops(old_schedule, new_schedule):
+    def describe(old, new):
+        changes = _describe_fields(old, new)
+        if (old.stop_lat, old.stop_lon) != (new.stop_lat, new.stop_lon):
+            distance = util.approximate_distance_between_stops(old, new)
+            if distance is not None:
+                changes['moved_meters'] = round(distance, 1)
+        return changes
+
+    return _diff_entities(old_schedule.stops, new_schedule.stops, _hash_fields,
+                          describe)
+
+
+def _diff_objects(old_objects, new_objects, get_id):
+    return _diff_entities(dict((get_id(o), o) for o in old_objects),
+                          dict((get_id(o), o) for o in new_objects),
+                          _hash_fields, _describe_fields)
+
+
+def _diff_service_periods(old_schedule, new_schedule):
+    old_periods = old_schedule.get_service_period_list()
+    new_periods = new_schedule.get_service_period_list()
+    # Both calendars start on the same date so their bitsets can be compared
+    base_date = servicecalendar.ServiceCalendar._get_earliest_date(
+        list(old_periods) + list(new_periods))
+    old_calendar = servicecalendar.ServiceCalendar(old_periods, base_date)
+    new_calendar = servicecalendar.ServiceCalendar(new_periods, base_date)
+
+    def describe(old, new):
+        old_bitset = old_calendar.get_bitset(old.service_id)
+        new_bitset = new_calendar.get_bitset(new.service_id)
+        return {
+            'fields': _get_changed_fields(_get_period_fields(old),
+                                          _get_period_fields(new)),
+            'added_dates': new_calendar.get_bitset_dates(
+                new_bitset & ~old_bitset),
+            'removed_dates': old_calendar.get_bitset_dates(
+                old_bitset & ~new_bitset),
+        }
+
+    return _diff_entities(dict((p.service_id, p) for p in old_periods),
+                          dict((p.service_id, p) for p in new_periods),
+                          _hash_period, describe)
+
+
+def _diff_shapes(old_schedule, new_schedule):
+    def describe(old, new):
+        return {'points': [len(old.sequence), len(new.sequence)]}
+
+    return _diff_entities(
+        dict((s.shape_id, s) for s in old_schedule.get_shape_list()),
+        dict((s.shape_id, s) for s in new_schedule.get_shape_list()),
+        lambda shape: shape.get_fingerprint(_SHAPE_PRECISION), describe)
+
+
+def _diff_trips(old_schedule, new_schedule):
+    old_stop_times = _get_stop_times_hashes(old_schedule)
+    new_stop_times = _get_stop_times_hashes(new_schedule)
+
+    def get_hash(trip, stop_times_hashes):
+        return _hash((sorted(_get_field_values(trip).items()),
+                      trip.get_frequency_tuples(),
+                      stop_times_hashes.get(trip.trip_id)))
+
+    def describe(old, new):
+        changes = _describe_fields(old, new)
+        if old.get_frequency_tuples() != new.get_frequency_tuples():
+            changes['frequencies'] = [old.get_frequency_tuples(),
+                                      new.get_frequency_tuples()]
+        changes['stop_times'] = (old_stop_times.get(old.trip_id) !=
+                                 new_stop_times.get(new.trip_id))
+        return changes
+
+    return _get_changes(old_schedule.trips, new_schedule.trips,
+                        dict((i, get_hash(t, old_stop_times))
+                             for i, t in old_schedule.trips.items()),
+                        dict((i, get_hash(t, new_stop_times))
+                             for i, t in new_schedule.trips.items()),
+                        describe)
+
+
+def _diff_fares(old_schedule, new_schedule):
+    def get_rules(fare):
+        return sorted(tuple(str(v) for v in rule.get_field_values_tuple())
+                      for rule in fare.get_fare_rule_list())
+
+    def get_hash(fare):
+        return _hash((sorted(_get_field_values(fare).items()), get_rules(fare)))
+
+    def describe(old, new):
+        changes = _describe_fields(old, new)
+        changes['rules'] = get_rules(old) != get_rules(new)
+        return changes
+
+    return _diff_entities(old_schedule.fares, new_schedule.fares, get_hash,
+                          describe)
+
+
+def diff_schedules(old_schedule, new_schedule):
+    """Return the changes from old_schedule to new_schedule.
+
+    Entities are matched by id and the agencies by agency_id or, if it isn't
+    set, by name. Service periods are compared by their fields and date
+    exceptions and shapes by Shape.get_fingerprint. A trip is modified if its
+    fields, frequencies or stop_times changed.
+
+    Args:
+      old_schedule: a Schedule
+      new_schedule: a Schedule
+
+    Returns:
+      a dict with a key for each of CHANGESET_SECTIONS and 'summary'. Each
+      section is a dict with the sorted lists of ids of the 'added' and
+      'removed' entities and a dict 'modified' from the id of each modified
+      entity to a dict of its changes:
+        fields: a dict of the name of each changed field to a list
+            [old value, new value], as strings or None if the field is empty
+        moved_meters: for stops, how far the stop moved
+        added_dates, removed_dates: for service periods, the lists of dates
+            which became active or inactive
+        points: for shapes, the numbers of points [old, new]
+        frequencies: for trips, the frequency tuples [old, new] if they changed
+        stop_times: for trips, True if the stop_times changed
+        rules: for fares, True if the fare rules changed
+      summary is a dict from each section to a dict of the numbers of 'added',
+      'removed', 'modified' and 'unchanged' entities.
+    """
+    changeset = {
+        'agency': _diff_objects(
+            old_schedule.get_agency_list(), new_schedule.get_agency_list(),
+            lambda agency: agency.agency_id or agency.agency_name),
+        'stops': _diff_stops(old_schedule, new_schedule),
+        'routes': _diff_objects(
+            old_schedule.get_route_list(), new_schedule.get_route_list(),
+            lambda route: route.route_id),
+        'service_periods': _diff_service_periods(old_schedule, new_schedule),
+        'shapes': _diff_shapes(old_schedule, new_schedule),
+        'trips': _diff_trips(old_schedule, new_schedule),
+        'fares': _diff_fares(old_schedule, new_schedule),
+    }
+    old_counts = {
+        'agency': len(old_schedule.get_agency_list()),
+        'stops': len(old_schedule.stops),
+        'routes': len(old_schedule.routes),
+        'service_periods': len(old_schedule.get_service_period_list()),
+        'shapes': len(old_schedule.get_shape_list()),
+        'trips': len(old_schedule.trips),
+        'fares': len(old_schedule.fares),
+    }
+    summary = {}
+    for section in CHANGESET_SECTIONS:
+        changes = changeset[section]
+        summary[section] = {
+            'added': len(changes['added']),
+            'removed': len(changes['removed']),
+            'modified': len(changes['modified']),
+            'unchanged': (old_counts[section] - len(changes['removed']) -
+                          len(changes['modified'])),
+        }
+    changeset['summary'] = summary
+    return changeset
+
+
+def diff_feeds(old_path, new_path, problems=None, memory_db=True):
+    """Load two versions of a feed with load_feed_version and return the
+    changes from the old to the new one, see diff_schedules."""
+    return diff_schedules(load_feed_version(old_path, problems, memory_db),
+                          load_feed_version(new_path, problems, memory_db))
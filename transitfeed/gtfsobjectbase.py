@@ -79,6 +79,7 @@ class GtfsObjectBase(GtfsFactoryUser):
         object.__setattr__(self, name, value)
         if name[0] != '_' and self._schedule:
             self._schedule.add_table_column(self.__class__._TABLE_NAME, name)
+            self._schedule.mark_table_dirty(self.__class__._TABLE_NAME)
 
     def __eq__(self, other):
         """Return true iff self and other are equivalent"""
@@ -88,7 +89,7 @@ class GtfsObjectBase(GtfsFactoryUser):
         if id(self) == id(other):
             return True
 
-        for k in self.keys().union(other.keys()):
+        for k in set(self.keys()).union(other.keys()):
             # use __getitem__ which returns "" for missing columns values
             if self[k] != other[k]:
                 return False
@@ -97,22 +98,16 @@ class GtfsObjectBase(GtfsFactoryUser):
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    # TODO(Tom): According to
-    # http://docs.python.org/reference/datamodel.html#object.__hash__
-    # this class should set '__hash__ = None' because it defines __eq__. This
-    # can't be fixed until the merger is changed to not use a/b_merge_map.
+    # Defining __eq__ sets __hash__ to None, so GTFS objects can't be dict
+    # keys. The merger keys them by identity, see merge.EntityMap.
 
     def __repr__(self):
         return "<%s %s>" % (self.__class__.__name__, sorted(self.items()))
 
     def keys(self):
-        """Return iterable of columns used by this object."""
-        columns = set()
-        for name in vars(self):
-            if (not name) or name[0] == "_":
-                continue
-            columns.add(name)
-        return columns
+        """Return list of columns used by this object, in the order they were
+        set, so tables are written with the same columns every time."""
+        return [name for name in vars(self) if name and name[0] != "_"]
 
     def column_names(self):
         return self.keys()
@@ -0,0 +1,164 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import heapq
+import itertools
+from operator import itemgetter
+
+from .util import defaultdict
+from . import util
+
+
+class HeadwayAnalyzer:
+    """Departure counts and headways per route, direction, stop, time bin and
+    date.
+
+    The stop_times table is read once and the departure times of every
+    (route_id, direction_id, stop_id, service_id) are kept sorted. Trips
+    defined by frequencies contribute one departure per run and the last stop
+    of a trip, where nothing departs, is skipped. A date only needs the
+    departures of the services active on it, and dates with the same active
+    services share their results.
+
+    Each headway is the time between a departure and the previous departure
+    of the same route and direction at the stop, and is counted in the time
+    bin of the later departure.
+    """
+
+    FIELD_NAMES = ['date', 'route_id', 'direction_id', 'stop_id', 'bin_start_secs',
+                   'departures', 'mean_headway_secs', 'min_headway_secs',
+                   'max_headway_secs']
+
+    def __init__(self, schedule, bin_secs=3600):
+        """Read the departures of schedule.
+
+        Args:
+          schedule: the Schedule to analyze
+          bin_secs: the length of the time bins in seconds
+        """
+        self.bin_secs = bin_secs
+        self._calendar = schedule.get_service_calendar()
+        # Map from (route_id, direction_id, stop_id) to a dict mapping service_id
+        # to a sorted list of departure secs
+        self._departures = defaultdict(lambda: defaultdict(list))
+        self._read_departures(schedule)
+        for service_departures in self._departures.values():
+            for departures in service_departures.values():
+                departures.sort()
+        self._service_rows = {}
+
+    def _read_departures(self, schedule):
+        stops = schedule.stops
+        trips = schedule.trips
+        cursor = schedule.connection.cursor()
+        cursor.execute(
+            'SELECT trip_id,stop_id,arrival_secs,departure_secs '
+            'FROM stop_times ORDER BY trip_id,stop_sequence')
+        for trip_id, rows in itertools.groupby(cursor, key=itemgetter(0)):
+            trip = trips.get(trip_id)
+            if trip is None:
+                continue
+            rows = list(rows)
+            times = util.interpolate_times([row[2:4] for row in rows],
+                                           [stops[row[1]] for row in rows])
+            run_shifts = [0]
+            if trip.get_frequency_tuples() and times[0][0] is not None:
+                run_shifts = [run_secs - times[0][0] for run_secs in
+                              trip.iter_frequency_start_times()]
+            direction_id = trip.direction_id or ''
+            for row, (_, departure_secs, _) in zip(rows[:-1], times[:-1]):
+                if departure_secs is None:
+                    continue
+                departures = self._departures[
+                    (trip.route_id, direction_id, row[1])][trip.service_id]
+                departures.extend(departure_secs + shift for shift in run_shifts)
+
+    def _get_service_rows(self, service_ids):
+        """Return the rows, without date, for a set of active services."""
+        if service_ids in self._service_rows:
+            return self._service_rows[service_ids]
+        rows = []
+        for key in sorted(self._departures):
+            service_departures = self._departures[key]
+            departures = [service_departures[service_id] for service_id in
+                          service_departures if service_id in service_ids]
+            if not departures:
+                continue
+            previous_secs = None
+            bin_index = None
+            for secs in heapq.merge(*departures):
+                if secs // self.bin_secs != bin_index:
+                    if bin_index is not None:
+                        rows.append(self._make_row(key, bin_index, count, headways))
+                    bin_index = secs // self.bin_secs
+                    count = 0
+                    headways = []
+                count += 1
+                if previous_secs is not None:
+                    headways.append(secs - previous_secs)
+                previous_secs = secs
+            rows.append(self._make_row(key, bin_index, count, headways))
+        self._service_rows[service_ids] = rows
+        return rows
+
+    def _make_row(self, key, bin_index, count, headways):
+        if headways:
+            headway_stats = (float(sum(headways)) / len(headways), min(headways),
+                             max(headways))
+        else:
+            headway_stats = (None, None, None)
+        return key + (bin_index * self.bin_secs, count) + headway_stats
+
+    def generate_rows(self, date_start, date_end):
+        """Generate a row for each route, direction, stop, time bin and date
+        with departures.
+
+        Args:
+          date_start: The first date, a date object
+          date_end: The first date after the range, a date object
+
+        Returns:
+          a generator of tuples with a value for each of FIELD_NAMES. The date
+          is a "YYYYMMDD" string and headway values are None when the bin only
+          has the first departure of the day.
+        """
+        date = date_start
+        while date < date_end:
+            date_string = date.strftime("%Y%m%d")
+            service_ids = self._calendar.get_active_service_ids(date)
+            for row in self._get_service_rows(service_ids):
+                yield (date_string,) + row
+            date += datetime.timedelta(days=1)
+
+    def get_columns(self, date_start, date_end):
+        """Return the rows of generate_rows as columns.
+
+        Returns:
+          a dict mapping each of FIELD_NAMES to a list of values
+        """
+        columns = dict((name, []) for name in self.FIELD_NAMES)
+        appenders = [columns[name].append for name in self.FIELD_NAMES]
+        for row in self.generate_rows(date_start, date_end):
+            for append, value in zip(appenders, row):
+                append(value)
+        return columns
+
+    def write_csv(self, file_obj, date_start, date_end):
+        """Write the rows of generate_rows, with a header, as CSV to a file
+        object opened in text mode."""
+        writer = util.CsvUnicodeWriter(file_obj)
+        writer.writerow(self.FIELD_NAMES)
+        for row in self.generate_rows(date_start, date_end):
+            writer.writerow(['' if value is None else value for value in row])
@@ -18,6 +18,7 @@ import os
 import re
 import zipfile
 
+from . import columnar
 from . import gtfsfactoryuser
 from . import problems
 from . import util
@@ -34,7 +35,8 @@ class Loader:
                  memory_db=True,
                  zip_content=None,
                  check_duplicate_trips=False,
-                 gtfs_factory=None):
+                 gtfs_factory=None,
+                 stop_times_parquet=None):
         """Initialize a new Loader object.
 
         Args:
@@ -48,6 +50,9 @@ class Loader:
           memory_db: if creating a new Schedule object use an in-memory sqlite
             database instead of creating one in a temporary file
           zip: a zipfile.ZipFile object, optionally used instead of path
+          stop_times_parquet: path of a stop_times.parquet file written by
+            Schedule.export_parquet to load stop_times from instead of
+            stop_times.txt. pyarrow must be installed.
         """
         if gtfs_factory is None:
             gtfs_factory = gtfsfactoryuser.GtfsFactoryUser().get_gtfs_factory()
@@ -62,6 +67,7 @@ class Loader:
         self._path = feed_path
         self._zip = zip_content
         self._loaded_stop_times = load_stop_times
+        self._stop_times_parquet = stop_times_parquet
         self._gtfs_factory = gtfs_factory
 
     def _determine_format(self):
@@ -586,7 +592,12 @@ class Loader:
         self._load_feed()
 
         if self._loaded_stop_times:
-            self._load_stop_times()
+            if self._stop_times_parquet:
+                columnar.load_stop_times_parquet(
+                    self._schedule, self._stop_times_parquet, self._problems,
+                    self._gtfs_factory)
+            else:
+                self._load_stop_times()
 
         if self._zip:
             self._zip.close()
@@ -595,4 +606,5 @@ class Loader:
         if self._extra_validation:
             self._schedule.validate(self._problems, validate_children=False)
 
+        self._schedule.clear_dirty_tables()
         return self._schedule
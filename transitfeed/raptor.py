@@ -0,0 +1,361 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from array import array
+import itertools
+import math
+import multiprocessing
+from operator import itemgetter
+
+from .spatialindex import GridIndex
+from . import util
+
+INFINITY = float('inf')
+
+
+class RaptorRouter:
+    """A multi-criteria router using the RAPTOR algorithm.
+
+    Trips of a route that visit the same sequence of stops form a pattern.
+    Each run of a frequency-based trip is a trip of its own. The trips of a
+    pattern are sorted by their first departure and their times are kept in
+    flat arrays, trip after trip, so the earliest trip that can be boarded at
+    a stop is found by binary search. Trips that overtake each other within a
+    pattern break that assumption and may lead to slightly late arrivals.
+
+    Round k of a query finds the earliest arrival at every stop using at most
+    k trips, so the rounds together give the pareto set of arrival time and
+    number of trips. Between rounds the footpaths of the stops improved in the
+    round are followed. Footpaths are the transfers in transfers.txt plus
+    walking links between stops closer than max_walk_distance, found with a
+    GridIndex. A transfer from a stop to itself sets the time needed to change
+    vehicles at that stop and transfers of type 3 (not possible) are ignored.
+
+    The router keeps no reference to the schedule, so it can be sent to other
+    processes, and it is a snapshot: build a new one after changing the
+    schedule.
+    """
+
+    MAX_ROUNDS = 8
+
+    def __init__(self, schedule, max_walk_distance=400.0, walking_speed=1.2):
+        """Build the router.
+
+        Args:
+          schedule: the Schedule to route on
+          max_walk_distance: the longest walking link between stops, in
+              meters. 0 disables walking links.
+          walking_speed: the walking speed in meters per second
+        """
+        self._stop_ids = list(schedule.stops.keys())
+        self._stop_index = dict((stop_id, i) for i, stop_id in enumerate(self._stop_ids))
+        self._calendar = schedule.get_service_calendar()
+        self._active_trips = {}
+        self._build_patterns(schedule)
+        self._build_footpaths(schedule, max_walk_distance, walking_speed)
+
+    def _build_patterns(self, schedule):
+        stops = schedule.stops
+        trips = schedule.trips
+        pattern_trips = {}
+        cursor = schedule.connection.cursor()
+        cursor.execute(
+            'SELECT trip_id,stop_id,arrival_secs,departure_secs '
+            'FROM stop_times ORDER BY trip_id,stop_sequence')
+        for trip_id, rows in itertools.groupby(cursor, key=itemgetter(0)):
+            trip = trips.get(trip_id)
+            if trip is None:
+                continue
+            rows = list(rows)
+            times = util.interpolate_times([row[2:4] for row in rows],
+                                           [stops[row[1]] for row in rows])
+            timed = [(self._stop_index[row[1]], arrival_secs, departure_secs)
+                     for row, (arrival_secs, departure_secs, _) in zip(rows, times)
+                     if arrival_secs is not None]
+            if len(timed) < 2:
+                continue
+            key = (trip.route_id, tuple(t[0] for t in timed))
+            run_shifts = [0]
+            if trip.get_frequency_tuples():
+                run_shifts = [run_secs - timed[0][1] for run_secs in
+                              trip.iter_frequency_start_times()]
+            for shift in run_shifts:
+                pattern_trips.setdefault(key, []).append(
+                    (timed[0][2] + shift, trip_id, trip.service_id,
+                     [t[1] + shift for t in timed], [t[2] + shift for t in timed]))
+
+        self._pattern_stops = []
+        self._pattern_trip_ids = []
+        self._pattern_service_ids = []
+        self._pattern_arrivals = []
+        self._pattern_departures = []
+        self._stop_patterns = [[] for _ in self._stop_ids]
+        for (_, pattern_stops), runs in sorted(pattern_trips.items()):
+            runs.sort(key=itemgetter(0, 1))
+            pattern = len(self._pattern_stops)
+            self._pattern_stops.append(pattern_stops)
+            self._pattern_trip_ids.append([run[1] for run in runs])
+            self._pattern_service_ids.append([run[2] for run in runs])
+            self._pattern_arrivals.append(array('l', itertools.chain(*[run[3] for run in runs])))
+            self._pattern_departures.append(array('l', itertools.chain(*[run[4] for run in runs])))
+            for position, stop_index in enumerate(pattern_stops):
+                self._stop_patterns[stop_index].append((pattern, position))
+
+    def _build_footpaths(self, schedule, max_walk_distance, walking_speed):
+        footpaths = [{} for _ in self._stop_ids]
+        if max_walk_distance > 0:
+            index = GridIndex(max_walk_distance)
+            index.add_stops(schedule.stops.values())
+            for stop in schedule.stops.values():
+                if stop.stop_lat is None or stop.stop_lon is None:
+                    continue
+                from_index = self._stop_index[stop.stop_id]
+                for distance, other in index.get_nearby(stop.stop_lat, stop.stop_lon,
+                                                        max_walk_distance):
+                    if other is not stop:
+                        footpaths[from_index][self._stop_index[other.stop_id]] = \
+                            int(math.ceil(distance / walking_speed))
+
+        self._change_secs = {}
+        for transfer in schedule.get_transfer_iter():
+            from_index = self._stop_index.get(transfer.from_stop_id)
+            to_index = self._stop_index.get(transfer.to_stop_id)
+            if from_index is None or to_index is None:
+                continue
+            if transfer.transfer_type == 3:
+                footpaths[from_index].pop(to_index, None)
+                continue
+            secs = transfer.min_transfer_time
+            if not isinstance(secs, int):
+                secs = 0
+            if from_index == to_index:
+                self._change_secs[from_index] = secs
+            else:
+                footpaths[from_index][to_index] = secs
+        self._footpaths = [sorted(f.items()) for f in footpaths]
+
+    def get_pattern_count(self):
+        """Return the number of patterns."""
+        return len(self._pattern_stops)
+
+    def _get_active_trips(self, date):
+        """Return a list with a bytearray for each pattern with a true value for
+        each trip active on date. If date is None all trips are active."""
+        if not date:
+            return None
+        service_ids = self._calendar.get_active_service_ids(date)
+        if service_ids not in self._active_trips:
+            self._active_trips[service_ids] = [
+                bytearray(service_id in service_ids for service_id in pattern_service_ids)
+                for pattern_service_ids in self._pattern_service_ids]
+        return self._active_trips[service_ids]
+
+    def _get_earliest_trip(self, pattern, position, secs, active_trips):
+        """Return the index of the earliest active trip of pattern leaving the
+        stop at position at or after secs, or None."""
+        departures = self._pattern_departures[pattern]
+        stop_count = len(self._pattern_stops[pattern])
+        trip_count = len(self._pattern_trip_ids[pattern])
+        low, high = 0, trip_count
+        while low < high:
+            middle = (low + high) // 2
+            if departures[middle * stop_count + position] < secs:
+                low = middle + 1
+            else:
+                high = middle
+        for trip in range(low, trip_count):
+            if active_trips is None or active_trips[pattern][trip]:
+                return trip
+        return None
+
+    def _relax_footpaths(self, arrivals, best, boardings, marked):
+        """Walk from the stops in marked to the stops of their footpaths.
+
+        A walk already includes its transfer time, so a trip can be boarded
+        when it ends without the change time of the stop. boardings is updated
+        with the end of the walk even if the stop was reached earlier by a
+        vehicle, since boarding after that arrival needs the change time."""
+        for stop_index, secs in [(i, arrivals[i]) for i in marked]:
+            for walk_index, walk_secs in self._footpaths[stop_index]:
+                walk_arrival = secs + walk_secs
+                if walk_arrival < boardings[walk_index]:
+                    boardings[walk_index] = walk_arrival
+                    marked.add(walk_index)
+                if walk_arrival < arrivals[walk_index]:
+                    arrivals[walk_index] = walk_arrival
+                    best[walk_index] = min(best[walk_index], walk_arrival)
+
+    def _run(self, origin, date, secs, max_rounds):
+        """Return a list with the earliest arrival at each stop for each round.
+
+        Element k of the list is a list, indexed by stop, of the earliest
+        arrival using at most k trips."""
+        if max_rounds is None:
+            max_rounds = self.MAX_ROUNDS
+        active_trips = self._get_active_trips(date)
+        best = [INFINITY] * len(self._stop_ids)
+        arrivals = [INFINITY] * len(self._stop_ids)
+        # The earliest time a trip can be boarded at each stop: the arrival of
+        # a vehicle plus the change time of the stop, or the end of a walk
+        boardings = [INFINITY] * len(self._stop_ids)
+        arrivals[origin] = best[origin] = boardings[origin] = secs
+        marked = {origin}
+        self._relax_footpaths(arrivals, best, boardings, marked)
+        rounds = [arrivals]
+
+        for k in range(1, max_rounds + 1):
+            previous_boardings = boardings
+            boardings = list(previous_boardings)
+            arrivals = list(rounds[-1])
+            # The earliest position of a marked stop in each pattern
+            queue = {}
+            for stop_index in marked:
+                for pattern, position in self._stop_patterns[stop_index]:
+                    if position < queue.get(pattern, len(self._pattern_stops[pattern])):
+                        queue[pattern] = position
+            marked = set()
+
+            for pattern, start in queue.items():
+                pattern_stops = self._pattern_stops[pattern]
+                stop_count = len(pattern_stops)
+                pattern_arrivals = self._pattern_arrivals[pattern]
+                pattern_departures = self._pattern_departures[pattern]
+                trip = None
+                for position in range(start, stop_count):
+                    stop_index = pattern_stops[position]
+                    if trip is not None:
+                        arr = pattern_arrivals[trip * stop_count + position]
+                        if arr < best[stop_index]:
+                            arrivals[stop_index] = best[stop_index] = arr
+                            boardings[stop_index] = min(
+                                boardings[stop_index],
+                                arr + self._change_secs.get(stop_index, 0))
+                            marked.add(stop_index)
+                    board_secs = previous_boardings[stop_index]
+                    if board_secs == INFINITY:
+                        continue
+                    if (trip is None or
+                            board_secs <= pattern_departures[trip * stop_count + position]):
+                        earlier_trip = self._get_earliest_trip(pattern, position, board_secs,
+                                                               active_trips)
+                        if earlier_trip is not None and (trip is None or earlier_trip < trip):
+                            trip = earlier_trip
+
+            self._relax_footpaths(arrivals, best, boardings, marked)
+            rounds.append(arrivals)
+            if not marked:
+                break
+        return rounds
+
+    def get_earliest_arrivals(self, origin_stop_id, date, secs, max_rounds=None):
+        """Return the earliest arrival at every stop reachable from a stop.
+
+        Args:
+          origin_stop_id: the stop_id the journeys start at
+          date: a "YYYYMMDD" string or a date object. Only trips active on date
+              are used. If it is None or empty all trips are used.
+          secs: seconds since midnight the journeys start at
+          max_rounds: the maximum number of trips of a journey, MAX_ROUNDS if
+              None
+
+        Returns:
+          a dict mapping stop_id to seconds since midnight
+        """
+        rounds = self._run(self._stop_index[origin_stop_id], date, secs, max_rounds)
+        return dict((self._stop_ids[i], arr) for i, arr in enumerate(rounds[-1])
+                    if arr != INFINITY)
+
+    def get_pareto_arrivals(self, origin_stop_id, date, secs, max_rounds=None):
+        """Return the pareto set of arrival time and number of trips for every
+        stop reachable from a stop.
+
+        Args:
+          origin_stop_id: the stop_id the journeys start at
+          date: a "YYYYMMDD" string, a date object or None, see
+              get_earliest_arrivals
+          secs: seconds since midnight the journeys start at
+          max_rounds: the maximum number of trips of a journey, MAX_ROUNDS if
+              None
+
+        Returns:
+          a dict mapping stop_id to a list of (number of trips, arrival secs)
+          tuples where using more trips always arrives earlier
+        """
+        rounds = self._run(self._stop_index[origin_stop_id], date, secs, max_rounds)
+        result = {}
+        for k, arrivals in enumerate(rounds):
+            for stop_index, arr in enumerate(arrivals):
+                if arr == INFINITY:
+                    continue
+                if k == 0 or arr < rounds[k - 1][stop_index]:
+                    result.setdefault(self._stop_ids[stop_index], []).append((k, arr))
+        return result
+
+    def get_travel_time_matrix(self, origin_stop_ids, destination_stop_ids, date,
+                               secs, max_rounds=None, processes=1):
+        """Return the travel times from each origin to each destination.
+
+        Args:
+          origin_stop_ids: an iterable of stop_id strings
+          destination_stop_ids: an iterable of stop_id strings
+          date: a "YYYYMMDD" string, a date object or None, see
+              get_earliest_arrivals
+          secs: seconds since midnight the journeys start at
+          max_rounds: the maximum number of trips of a journey, MAX_ROUNDS if
+              None
+          processes: the number of worker processes running the one to all
+              queries of the origins, or None for one per CPU
+
+        Returns:
+          a dict mapping each origin stop_id to a dict mapping each destination
+          stop_id to the travel time in seconds, or None if it can't be reached
+        """
+        destination_stop_ids = list(destination_stop_ids)
+        queries = [(origin_stop_id, destination_stop_ids, date, secs, max_rounds)
+                   for origin_stop_id in origin_stop_ids]
+        if processes == 1 or len(queries) < 2:
+            return dict(self._get_travel_times(*query) for query in queries)
+        pool = multiprocessing.Pool(processes, _init_worker, (self,))
+        try:
+            return dict(pool.imap_unordered(_get_worker_travel_times, queries,
+                                            chunksize=16))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _get_travel_times(self, origin_stop_id, destination_stop_ids, date, secs,
+                          max_rounds):
+        arrivals = self._run(self._stop_index[origin_stop_id], date, secs,
+                             max_rounds)[-1]
+        travel_times = {}
+        for stop_id in destination_stop_ids:
+            arr = arrivals[self._stop_index[stop_id]]
+            if arr == INFINITY:
+                travel_times[stop_id] = None
+            else:
+                travel_times[stop_id] = arr - secs
+        return origin_stop_id, travel_times
+
+
+# The router of a worker process of RaptorRouter.get_travel_time_matrix
+_worker_router = None
+
+
+def _init_worker(router):
+    global _worker_router
+    _worker_router = router
+
+
+def _get_worker_travel_times(query):
+    return _worker_router._get_travel_times(*query)
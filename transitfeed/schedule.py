@@ -13,7 +13,10 @@
 # limitations under the License.
 
 import bisect
+import collections
+import concurrent.futures
 import datetime
+import io
 import itertools
 import os
 from operator import attrgetter
@@ -27,15 +30,49 @@ import warnings
 # reference cycles containing objects with custom cleanup code.
 import weakref
 import zipfile
+import zlib
 
 from . import gtfsfactoryuser
 from . import problems as problems_module
 from .util import defaultdict
 from . import util
-from .compat import StringIO
+from .departureboard import DepartureBoard
+from .scheduleupdate import ScheduleUpdate
+from .servicecalendar import ServiceCalendar
+from . import columnar
+from . import sqlitefeed
+from .stoptime import StopTime
+from . import zipwriter
 
 native_sqlite = True
 
+# Size of the window of DEFLATE, the most data a chunk can refer back to
+_DEFLATE_WINDOW_SIZE = 1 << 15
+
+
+def _deflate_chunk(data, previous, level, last):
+    """Compress a chunk of a member as raw DEFLATE blocks.
+
+    A chunk that isn't the last ends with a sync flush, which aligns the output
+    to a byte so the compressed chunks can be concatenated into one stream.
+
+    Args:
+      data: the bytes to compress
+      previous: up to _DEFLATE_WINDOW_SIZE bytes just before data, used as the
+          preset dictionary so chunks compress as well as a single stream
+      level: the zlib compression level or None for the default
+      last: True if this is the last chunk of the member
+    """
+    if level is None:
+        level = zlib.Z_DEFAULT_COMPRESSION
+    if len(previous):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zdict=previous)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
 
 class Schedule:
     """Represents a Schedule, a collection of stops, routes, trips and
@@ -44,6 +81,16 @@ class Schedule:
     _temp_db_file = None
     _temp_db_filename = None
     connection = None
+    # Size of the chunks in which tables are written into a feed zip
+    _WRITE_CHUNK_SIZE = 1 << 20
+    # Number of rows handed to the CSV writer at a time when writing a feed
+    _WRITE_ROWS_BATCH_SIZE = 1000
+    # Number of stop_times rows fetched at a time when writing a feed
+    _STOP_TIMES_BATCH_SIZE = 10000
+    # Tables whose changes are recorded by mark_table_dirty. Other tables are
+    # compared to the base feed after they are rendered.
+    _TRACKED_TABLES = frozenset(['agency', 'feed_info', 'stops', 'routes', 'trips',
+                                 'transfers', 'stop_times', 'frequencies'])
 
     def __init__(self, problem_reporter=None,
                  memory_db=True, check_duplicate_trips=False,
@@ -78,6 +125,11 @@ class Schedule:
         else:
             self.problem_reporter = problem_reporter
         self._check_duplicate_trips = check_duplicate_trips
+        self._departure_board = None
+        # Tables changed since clear_dirty_tables was called and the number of
+        # rows of the tables in _get_table_sizes at that time
+        self._dirty_tables = set()
+        self._table_sizes = {}
         self.connect_db(memory_db)
 
     def add_table_column(self, table, column):
@@ -100,6 +152,46 @@ class Schedule:
         """Return list of columns in a table."""
         return self._table_columns[table]
 
+    def mark_table_dirty(self, table):
+        """Record that a table, named like 'stops', has changed.
+
+        Objects and Trip stop time methods call this for the tables in
+        _TRACKED_TABLES. Call it after changing one of those tables in a way this
+        class can't see, such as with SQL on the stop_times table.
+        """
+        self._dirty_tables.add(table)
+
+    def clear_dirty_tables(self):
+        """Forget the changes to all tables. The Loader calls this once a feed is
+        loaded, so the feed can be used as the base of write_google_transit_feed.
+        """
+        self._dirty_tables = set()
+        self._table_sizes = self._get_table_sizes()
+
+    def _get_table_sizes(self):
+        # Deleting from the dicts of objects isn't seen by mark_table_dirty, but
+        # changes the number of rows
+        return {'agency': len(self._agencies),
+                'feed_info': int(self.feed_info is not None),
+                'stops': len(self.stops),
+                'routes': len(self.routes),
+                'trips': len(self.trips),
+                'transfers': sum(len(t) for t in self._transfers.values())}
+
+    def get_dirty_tables(self):
+        """Return the set of tables of _TRACKED_TABLES that changed since
+        clear_dirty_tables was called. Every table is dirty in a schedule that
+        wasn't loaded."""
+        dirty_tables = set(self._dirty_tables)
+        sizes = self._get_table_sizes()
+        for table, size in sizes.items():
+            if size != self._table_sizes.get(table):
+                dirty_tables.add(table)
+        if sizes['trips'] != self._table_sizes.get('trips'):
+            # Rows of removed trips aren't written
+            dirty_tables.update(('stop_times', 'frequencies'))
+        return dirty_tables
+
     def __del__(self):
         self.connection.cursor().close()
         self.connection.close()
@@ -141,7 +233,9 @@ class Schedule:
             );
             """
         )
-        cursor.execute("CREATE INDEX trip_index ON stop_times (trip_id);")
+        # Also used to read stop_times ordered by trip_id and stop_sequence
+        cursor.execute(
+            "CREATE INDEX trip_index ON stop_times (trip_id, stop_sequence);")
         cursor.execute("CREATE INDEX stop_index ON stop_times (stop_id);")
 
     def get_stop_bounding_box(self):
@@ -168,6 +262,7 @@ class Schedule:
             return
 
         self.add_table_columns('agency', agency.column_names())
+        self.mark_table_dirty('agency')
         agency._schedule = weakref.proxy(self)
 
         if validate:
@@ -244,6 +339,21 @@ class Schedule:
         if service_period.service_id not in self.service_periods:
             self.add_service_period_object(service_period, validate=validate)
 
+    def remove_service_period(self, service_id):
+        """Remove the service period with service_id and the trips which use
+        it."""
+        trip_ids = [trip_id for trip_id, trip in self.trips.items()
+                    if trip.service_id == service_id]
+        if trip_ids:
+            with self.batch_update() as update:
+                for trip_id in trip_ids:
+                    update.remove_trip(trip_id)
+        period = self.service_periods.pop(service_id)
+        if self._default_service_period is period:
+            self._default_service_period = None
+        if self._departure_board is not None:
+            self._departure_board.update_calendar()
+
     def add_service_period_object(self, service_period, problem_reporter=None,
                                   validate=True):
         if not problem_reporter:
@@ -366,6 +476,7 @@ class Schedule:
 
         stop._schedule = weakref.proxy(self)
         self.add_table_columns('stops', stop.column_names())
+        self.mark_table_dirty('stops')
         self.stops[stop.stop_id] = stop
         if hasattr(stop, 'zone_id') and stop.zone_id:
             self.fare_zones[stop.zone_id] = True
@@ -410,6 +521,7 @@ class Schedule:
                 return
 
         self.add_table_columns('routes', route.column_names())
+        self.mark_table_dirty('routes')
         route._schedule = weakref.proxy(self)
         self.routes[route.route_id] = route
 
@@ -437,6 +549,12 @@ class Schedule:
     def get_shape(self, shape_id):
         return self._shapes[shape_id]
 
+    def remove_shape(self, shape_id):
+        """Remove the shape with shape_id. Trips which use it must be changed to
+        another shape by the caller."""
+        del self._shapes[shape_id]
+        self.mark_table_dirty('shapes')
+
     def add_trip_object(self, trip, problem_reporter=None, validate=False):
         if not problem_reporter:
             problem_reporter = self.problem_reporter
@@ -446,6 +564,7 @@ class Schedule:
             return
 
         self.add_table_columns('trips', trip.column_names())
+        self.mark_table_dirty('trips')
         trip._schedule = weakref.proxy(self)
         self.trips[trip.trip_id] = trip
 
@@ -542,6 +661,7 @@ class Schedule:
         if validate:
             feed_info.validate(problem_reporter)
         self.add_table_columns('feed_info', feed_info.column_names())
+        self.mark_table_dirty('feed_info')
         self.feed_info = feed_info
 
     def add_transfer_object(self, transfer, problem_reporter=None):
@@ -560,6 +680,7 @@ class Schedule:
 
         transfer._schedule = weakref.proxy(self)  # See weakref comment at top
         self.add_table_columns('transfers', transfer.column_names())
+        self.mark_table_dirty('transfers')
         self._transfers[transfer_id].append(transfer)
 
     def get_transfer_iter(self):
@@ -607,162 +728,459 @@ class Schedule:
                                            extra_validation=extra_validation)
         loader.load()
 
-    @staticmethod
-    def _write_archive_string(archive, filename, stringio):
-        zi = zipfile.ZipInfo(filename)
-        # See
-        # http://stackoverflow.com/questions/434641/how-do-i-set-permissions-attributes-on-a-file-in-a-zip-file-using-pythons-zipf
-        zi.external_attr = 0o666 << 16  # Set unix permissions to -rw-rw-rw
-        # ZIP_DEFLATED requires zlib. zlib comes with Python 2.4 and 2.5
-        zi.compress_type = zipfile.ZIP_DEFLATED
-        archive.writestr(zi, stringio.getvalue())
-
-    def write_google_transit_feed(self, file):
-        """Output this schedule as a Google Transit Feed in file_name.
+    def _copy_archive_member(self, archive, base_file, base_info):
+        """Copy a member of the base feed to archive without recompressing it."""
+        archive.write_compressed(
+            base_info.filename,
+            zipwriter.generate_raw_member_chunks(base_file, base_info,
+                                                 self._WRITE_CHUNK_SIZE),
+            base_info.file_size, base_info.compress_size, base_info.CRC,
+            base_info.compress_type)
+
+    def _generate_table_chunks(self, header, rows):
+        """Generate a table as UTF-8 CSV in chunks of _WRITE_CHUNK_SIZE bytes.
+        The last chunk may be shorter.
+
+        The rows are handed to the CSV writer _WRITE_ROWS_BATCH_SIZE at a time,
+        so only about a chunk and a batch of text are in memory at once.
+        """
+        chunk_size = self._WRITE_CHUNK_SIZE
+        buf = io.BytesIO()
+        text = io.TextIOWrapper(buf, encoding='utf-8', newline='')
+        writer = util.CsvUnicodeWriter(text)
+        writer.writerow(header)
+        rows = iter(rows)
+        while True:
+            start = buf.tell()
+            writer.writerows(itertools.islice(rows, self._WRITE_ROWS_BATCH_SIZE))
+            text.flush()
+            last = buf.tell() == start
+            if buf.tell() >= chunk_size or last:
+                data = buf.getvalue()
+                end = len(data) if last else len(data) - len(data) % chunk_size
+                for i in range(0, end, chunk_size):
+                    yield data[i:i + chunk_size]
+                buf.seek(0)
+                buf.truncate()
+                buf.write(data[end:])
+            if last:
+                break
+
+    def _write_archive_chunks(self, archive, filename, chunks,
+                              compression_level=None):
+        """Compress the chunks of a table into a new member of archive."""
+        with archive.open(filename, compression_level) as member:
+            for chunk in chunks:
+                member.write(chunk)
+
+    def _compress_archive_chunks(self, archive, executor, max_pending, filename,
+                                 chunks, compression_level):
+        """Compress the chunks of a table on executor into a new member of
+        archive.
+
+        Each chunk is compressed independently, primed with the end of the
+        chunk before, like pigz does. The compressed chunks are written in
+        order as they are done, and no more than max_pending chunks are waiting
+        to be compressed or written at once, so memory use doesn't grow with the
+        size of the table. The CRC-32 is computed as the chunks are submitted.
+        """
+        member = archive.open_compressed(filename)
+        pending = collections.deque()
+        previous = b''
+        file_size = 0
+        crc = 0
+        chunks = iter(chunks)
+        # The compressed stream must have a last block, even for no data
+        chunk = next(chunks, b'')
+        while chunk is not None:
+            next_chunk = next(chunks, None)
+            pending.append(executor.submit(_deflate_chunk, chunk, previous,
+                                           compression_level, next_chunk is None))
+            file_size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            if len(chunk) < _DEFLATE_WINDOW_SIZE:
+                chunk = previous + chunk
+            previous = chunk[-_DEFLATE_WINDOW_SIZE:]
+            while len(pending) >= max_pending:
+                member.write(pending.popleft().result())
+            chunk = next_chunk
+        while pending:
+            member.write(pending.popleft().result())
+        member.finish(file_size, crc)
+
+    def _write_archive_table(self, archive, filename, header, rows, executor,
+                             max_pending, base_file, base_infos, dirty_tables,
+                             compression_level):
+        """Write a table to archive, compressing it on executor if it isn't
+        None.
+
+        A table with a member in the base feed, whose ZipInfo objects are in
+        base_infos by file name, is copied from base_file when the table is
+        tracked and not dirty, or, for a table that isn't tracked, when it
+        renders to the same size and CRC-32 as the member. To compare them an
+        untracked table is rendered to a temporary file, which stays in memory
+        only while it is smaller than a chunk, and read back from it if the
+        member can't be copied.
+        """
+        table = os.path.splitext(filename)[0]
+        base_info = base_infos.get(filename)
+        with tempfile.SpooledTemporaryFile(
+                max_size=self._WRITE_CHUNK_SIZE) as rendered:
+            chunks = self._generate_table_chunks(header, rows)
+            if base_info is not None:
+                if table in self._TRACKED_TABLES:
+                    unchanged = table not in dirty_tables
+                else:
+                    file_size = 0
+                    crc = 0
+                    for chunk in chunks:
+                        rendered.write(chunk)
+                        file_size += len(chunk)
+                        crc = zlib.crc32(chunk, crc)
+                    unchanged = (file_size == base_info.file_size and
+                                 crc == base_info.CRC)
+                    rendered.seek(0)
+                    chunks = iter(
+                        lambda: rendered.read(self._WRITE_CHUNK_SIZE), b'')
+                if unchanged:
+                    self._copy_archive_member(archive, base_file, base_info)
+                    return
+            if executor is None:
+                self._write_archive_chunks(archive, filename, chunks,
+                                           compression_level)
+            else:
+                self._compress_archive_chunks(archive, executor, max_pending,
+                                              filename, chunks,
+                                              compression_level)
 
-        Args:
-          file: path of new feed file (a string) or a file-like object
+    @staticmethod
+    def _generate_column_values(objects, columns):
+        for o in objects:
+            yield [o[c] for c in columns]
 
-        Returns:
-          None
-        """
-        # Compression type given when adding each file
-        archive = zipfile.ZipFile(file, 'w')
+    @staticmethod
+    def _peek_rows(rows):
+        """Return None if the iterable rows is empty, else an iterator over all
+        of rows."""
+        rows = iter(rows)
+        for first in rows:
+            return itertools.chain([first], rows)
+        return None
 
+    @staticmethod
+    def _get_values(objects, sort, key=None):
+        """Return the values of the dict objects, ordered by their keys if sort
+        is True."""
+        if not sort:
+            return objects.values()
+        return [objects[k] for k in sorted(objects, key=key)]
+
+    def _generate_feed_tables(self, sort=False):
+        """Generate a (file name, header, rows) tuple for each table of the feed
+        in the order they are written. rows is an iterator over lists of
+        values. Optional tables without rows are skipped.
+
+        If sort is True the rows of each table are ordered by their ids, and
+        stop_times by trip_id and stop_sequence, instead of the order the
+        objects were added in."""
         if 'agency' in self._table_columns:
-            agency_string = StringIO()
-            writer = util.CsvUnicodeWriter(agency_string)
             columns = self.get_table_columns('agency')
-            writer.writerow(columns)
-            for a in self._agencies.values():
-                writer.writerow([a[c] for c in columns])
-            self._write_archive_string(archive, 'agency.txt', agency_string)
+            yield ('agency.txt', columns,
+                   self._generate_column_values(
+                       self._get_values(self._agencies, sort), columns))
 
         if 'feed_info' in self._table_columns:
-            feed_info_string = StringIO()
-            writer = util.CsvUnicodeWriter(feed_info_string)
             columns = self.get_table_columns('feed_info')
-            writer.writerow(columns)
-            writer.writerow([self.feed_info[c] for c in columns])
-            self._write_archive_string(archive, 'feed_info.txt', feed_info_string)
-
-        calendar_dates_string = StringIO()
-        writer = util.CsvUnicodeWriter(calendar_dates_string)
-        writer.writerow(
-            self._gtfs_factory.ServicePeriod.FIELD_NAMES_CALENDAR_DATES)
-        has_data = False
-        for period in self.service_periods.values():
-            for row in period.generate_calendar_dates_field_values_tuples():
-                has_data = True
-                writer.writerow(row)
+            yield ('feed_info.txt', columns,
+                   self._generate_column_values([self.feed_info], columns))
+
+        service_periods = self._get_values(self.service_periods, sort)
+        if sort:
+            rows = self._peek_rows(itertools.chain.from_iterable(
+                period.get_calendar_dates_field_values_tuples()
+                for period in service_periods))
+        else:
+            rows = self._peek_rows(itertools.chain.from_iterable(
+                period.generate_calendar_dates_field_values_tuples()
+                for period in service_periods))
         wrote_calendar_dates = False
-        if has_data:
+        if rows is not None:
             wrote_calendar_dates = True
-            self._write_archive_string(archive, 'calendar_dates.txt',
-                                       calendar_dates_string)
-
-        calendar_string = StringIO()
-        writer = util.CsvUnicodeWriter(calendar_string)
-        writer.writerow(self._gtfs_factory.ServicePeriod.FIELD_NAMES)
-        has_data = False
-        for s in self.service_periods.values():
-            row = s.get_calendar_field_values_tuple()
-            if row:
-                has_data = True
-                writer.writerow(row)
-        if has_data or not wrote_calendar_dates:
-            self._write_archive_string(archive, 'calendar.txt', calendar_string)
+            yield ('calendar_dates.txt',
+                   self._gtfs_factory.ServicePeriod.FIELD_NAMES_CALENDAR_DATES, rows)
+
+        rows = self._peek_rows(
+            row for row in (s.get_calendar_field_values_tuple()
+                            for s in service_periods) if row)
+        if rows is not None or not wrote_calendar_dates:
+            yield ('calendar.txt', self._gtfs_factory.ServicePeriod.FIELD_NAMES,
+                   rows or [])
 
         if 'stops' in self._table_columns:
-            stop_string = StringIO()
-            writer = util.CsvUnicodeWriter(stop_string)
             columns = self.get_table_columns('stops')
-            writer.writerow(columns)
-            for s in self.stops.values():
-                writer.writerow([s[c] for c in columns])
-            self._write_archive_string(archive, 'stops.txt', stop_string)
+            yield ('stops.txt', columns,
+                   self._generate_column_values(
+                       self._get_values(self.stops, sort), columns))
 
         if 'routes' in self._table_columns:
-            route_string = StringIO()
-            writer = util.CsvUnicodeWriter(route_string)
             columns = self.get_table_columns('routes')
-            writer.writerow(columns)
-            for r in self.routes.values():
-                writer.writerow([r[c] for c in columns])
-            self._write_archive_string(archive, 'routes.txt', route_string)
+            yield ('routes.txt', columns,
+                   self._generate_column_values(
+                       self._get_values(self.routes, sort), columns))
 
         if 'trips' in self._table_columns:
-            trips_string = StringIO()
-            writer = util.CsvUnicodeWriter(trips_string)
             columns = self.get_table_columns('trips')
-            writer.writerow(columns)
-            for t in self.trips.values():
-                writer.writerow([t[c] for c in columns])
-            self._write_archive_string(archive, 'trips.txt', trips_string)
+            yield ('trips.txt', columns,
+                   self._generate_column_values(
+                       self._get_values(self.trips, sort), columns))
 
         # write frequencies.txt (if applicable)
-        headway_rows = []
-        for trip in self.get_trip_list():
-            headway_rows += trip.get_frequency_output_tuples()
-        if headway_rows:
-            headway_string = StringIO()
-            writer = util.CsvUnicodeWriter(headway_string)
-            writer.writerow(self._gtfs_factory.Frequency.FIELD_NAMES)
-            writer.writerows(headway_rows)
-            self._write_archive_string(archive, 'frequencies.txt', headway_string)
+        trips = self._get_values(self.trips, sort)
+        if sort:
+            rows = self._peek_rows(itertools.chain.from_iterable(
+                sorted(trip.get_frequency_output_tuples()) for trip in trips))
+        else:
+            rows = self._peek_rows(itertools.chain.from_iterable(
+                trip.get_frequency_output_tuples() for trip in trips))
+        if rows is not None:
+            yield 'frequencies.txt', self._gtfs_factory.Frequency.FIELD_NAMES, rows
 
         # write fares (if applicable)
-        if self.get_fare_attribute_list():
-            fare_string = StringIO()
-            writer = util.CsvUnicodeWriter(fare_string)
-            writer.writerow(self._gtfs_factory.FareAttribute.FIELD_NAMES)
-            writer.writerows(
-                f.get_field_values_tuple() for f in self.get_fare_attribute_list())
-            self._write_archive_string(archive, 'fare_attributes.txt', fare_string)
+        fares = self._get_values(self.fares, sort)
+        if fares:
+            yield ('fare_attributes.txt', self._gtfs_factory.FareAttribute.FIELD_NAMES,
+                   (f.get_field_values_tuple() for f in fares))
 
         # write fare rules (if applicable)
-        rule_rows = []
-        for fare in self.get_fare_attribute_list():
-            for rule in fare.get_fare_rule_list():
-                rule_rows.append(rule.get_field_values_tuple())
-        if rule_rows:
-            rule_string = StringIO()
-            writer = util.CsvUnicodeWriter(rule_string)
-            writer.writerow(self._gtfs_factory.FareRule.FIELD_NAMES)
-            writer.writerows(rule_rows)
-            self._write_archive_string(archive, 'fare_rules.txt', rule_string)
-        stop_times_string = StringIO()
-        writer = util.CsvUnicodeWriter(stop_times_string)
-        writer.writerow(self._gtfs_factory.StopTime.FIELD_NAMES)
-        for t in self.trips.values():
-            writer.writerows(t.generate_stop_times_tuples())
-        self._write_archive_string(archive, 'stop_times.txt', stop_times_string)
+        if sort:
+            rows = self._peek_rows(itertools.chain.from_iterable(
+                sorted(rule.get_field_values_tuple()
+                       for rule in fare.get_fare_rule_list())
+                for fare in fares))
+        else:
+            rows = self._peek_rows(
+                rule.get_field_values_tuple()
+                for fare in fares
+                for rule in fare.get_fare_rule_list())
+        if rows is not None:
+            yield 'fare_rules.txt', self._gtfs_factory.FareRule.FIELD_NAMES, rows
+
+        stoptime_class = self._gtfs_factory.StopTime
+        if (stoptime_class.FIELD_NAMES == StopTime.FIELD_NAMES and
+                stoptime_class.get_field_values_tuple is
+                StopTime.get_field_values_tuple):
+            rows = self._generate_stop_times_rows(sort)
+        else:
+            # An extension might add columns or format them differently
+            rows = itertools.chain.from_iterable(
+                t.generate_stop_times_tuples() for t in trips)
+        yield 'stop_times.txt', stoptime_class.FIELD_NAMES, rows
 
         # write shapes (if applicable)
-        shape_rows = []
-        for shape in self.get_shape_list():
-            seq = 1
-            for (lat, lon, dist) in shape.points:
-                shape_rows.append((shape.shape_id, lat, lon, seq, dist))
-                seq += 1
-        if shape_rows:
-            shape_string = StringIO()
-            writer = util.CsvUnicodeWriter(shape_string)
-            writer.writerow(self._gtfs_factory.Shape.FIELD_NAMES)
-            writer.writerows(shape_rows)
-            self._write_archive_string(archive, 'shapes.txt', shape_string)
+        rows = self._peek_rows(self._generate_shape_rows(sort))
+        if rows is not None:
+            yield 'shapes.txt', self._gtfs_factory.Shape.FIELD_NAMES, rows
 
         if 'transfers' in self._table_columns:
-            transfer_string = StringIO()
-            writer = util.CsvUnicodeWriter(transfer_string)
             columns = self.get_table_columns('transfers')
-            writer.writerow(columns)
-            for t in self.get_transfer_iter():
-                writer.writerow([t[c] for c in columns])
-            self._write_archive_string(archive, 'transfers.txt', transfer_string)
+            yield ('transfers.txt', columns,
+                   self._generate_column_values(itertools.chain.from_iterable(
+                       self._get_values(self._transfers, sort,
+                                        key=lambda ids: tuple(map(str, ids)))),
+                       columns))
+
+    def _generate_stop_times_rows(self, sort=False):
+        """Generate the rows of stop_times.txt straight from the database.
+
+        The rows are the same, in the same order, as those of
+        Trip.generate_stop_times_tuples for each trip in self.trips but are read
+        with one ordered query, in batches of _STOP_TIMES_BATCH_SIZE, without
+        creating a StopTime object for each row. If sort is True the rows are
+        ordered by trip_id instead, which is a scan of trip_index.
+        """
+        cursor = self.connection.cursor()
+        columns = ('stop_times.trip_id,arrival_secs,departure_secs,stop_id,'
+                   'stop_sequence,stop_headsign,pickup_type,drop_off_type,'
+                   'shape_dist_traveled,timepoint')
+        if sort:
+            cursor.execute('SELECT %s FROM stop_times INDEXED BY trip_index '
+                           'ORDER BY trip_id,stop_sequence' % columns)
+            try:
+                for row in self._format_stop_times_rows(cursor):
+                    # Skip stop_times left by trips that have been removed, like
+                    # the join below
+                    if row[0] in self.trips:
+                        yield row
+            finally:
+                cursor.close()
+            return
+
+        cursor.execute('DROP TABLE IF EXISTS temp.write_trip_order')
+        cursor.execute('CREATE TEMP TABLE write_trip_order ('
+                       'trip_id CHAR(50) PRIMARY KEY, trip_order INTEGER)')
+        cursor.executemany('INSERT INTO write_trip_order VALUES (?,?)',
+                           ((trip_id, i) for i, trip_id in enumerate(self.trips)))
+        try:
+            cursor.execute(
+                'SELECT %s FROM stop_times JOIN write_trip_order '
+                'ON stop_times.trip_id=write_trip_order.trip_id '
+                'ORDER BY trip_order,stop_sequence' % columns)
+            for row in self._format_stop_times_rows(cursor):
+                yield row
+        finally:
+            cursor.execute('DROP TABLE IF EXISTS temp.write_trip_order')
+
+    def _format_stop_times_rows(self, cursor):
+        """Generate the rows of stop_times.txt for the rows of a query of the
+        stop_times table."""
+        format_secs = util.format_seconds_since_midnight
+        while True:
+            batch = cursor.fetchmany(self._STOP_TIMES_BATCH_SIZE)
+            if not batch:
+                break
+            # Empty values are written as empty strings, like in
+            # StopTime.get_field_values_tuple
+            for (trip_id, arrival_secs, departure_secs, stop_id, stop_sequence,
+                 stop_headsign, pickup_type, drop_off_type, shape_dist_traveled,
+                 timepoint) in batch:
+                yield (trip_id,
+                       '' if arrival_secs is None else format_secs(arrival_secs),
+                       '' if departure_secs is None else format_secs(departure_secs),
+                       stop_id,
+                       stop_sequence or '',
+                       stop_headsign or '',
+                       pickup_type or '',
+                       drop_off_type or '',
+                       shape_dist_traveled or '',
+                       timepoint or '')
+
+    def _generate_shape_rows(self, sort=False):
+        return itertools.chain.from_iterable(
+            shape.generate_field_values_tuples()
+            for shape in self._get_values(self._shapes, sort))
+
+    def write_google_transit_feed(self, file, workers=1, compression_level=None,
+                                  base=None, sort=False):
+        """Output this schedule as a Google Transit Feed in file_name.
+
+        Each table is rendered in chunks that are compressed into its zip member
+        as they are produced, so memory use doesn't grow with the size of the
+        tables. With more than one worker the chunks are compressed by a pool of
+        threads, which run in parallel because zlib releases the GIL, while the
+        next chunks are rendered. The members are in the same order either way.
+
+        With a base feed, members of tables that haven't changed since the
+        schedule was loaded are copied from it without being rendered or
+        recompressed. See get_dirty_tables.
+
+        With sort the rows of each table are ordered by their ids, so schedules
+        with the same contents are written to the same bytes whatever order
+        their objects were added in.
+
+        Args:
+          file: path of new feed file (a string) or a file-like object
+          workers: number of threads compressing tables
+          compression_level: zlib compression level from 0 (none, fastest) to 9
+              (smallest). None uses the zlib default.
+          base: path or file-like object of the zip file this schedule was
+              loaded from. It may be the same path as file.
+          sort: order the rows of each table by id, and stop_times by trip_id
+              and stop_sequence. The tables tracked by get_dirty_tables are
+              then always written again, since the base may not be sorted.
+
+        Returns:
+          None
+        """
+        if (isinstance(file, str) and isinstance(base, str) and
+                os.path.exists(file) and os.path.samefile(file, base)):
+            # Write next to the base and replace it once it is no longer read
+            fd, temp_path = tempfile.mkstemp(
+                suffix='.zip', dir=os.path.dirname(os.path.abspath(file)))
+            os.close(fd)
+            try:
+                self.write_google_transit_feed(temp_path, workers, compression_level,
+                                               base, sort)
+                os.replace(temp_path, file)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            return
 
+        archive = zipwriter.ZipWriter(file)
+        base_file = None
+        base_infos = {}
+        if base is not None:
+            with zipfile.ZipFile(base) as base_archive:
+                base_infos = dict((info.filename, info)
+                                  for info in base_archive.infolist())
+            if isinstance(base, str):
+                base_file = open(base, 'rb')
+            else:
+                base_file = base
+        if sort:
+            dirty_tables = self._TRACKED_TABLES
+        else:
+            dirty_tables = self.get_dirty_tables()
+        executor = None
+        if workers > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        try:
+            for filename, header, rows in self._generate_feed_tables(sort):
+                # Each worker has a chunk to compress and another one waiting
+                self._write_archive_table(
+                    archive, filename, header, rows, executor, 2 * workers,
+                    base_file, base_infos, dirty_tables, compression_level)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            if base_file is not None and base_file is not base:
+                base_file.close()
         archive.close()
 
+    def export_sqlite(self, path):
+        """Write every table of this schedule to a new SQLite database at path.
+
+        See the sqlitefeed module for the layout of the database and load_sqlite
+        for loading it back."""
+        sqlitefeed.export_sqlite(self, path)
+
+    def export_parquet(self, directory):
+        """Write the stops, trips, stop_times and shapes of this schedule to
+        Parquet files in directory. pyarrow must be installed.
+
+        See the columnar module for the types of the columns and
+        Loader(stop_times_parquet=...) for loading stop_times back."""
+        return columnar.export_parquet(self, directory)
+
+    def get_service_calendar(self, base_date=None):
+        """Return a ServiceCalendar with the compiled active dates of every
+        service period in this schedule."""
+        return ServiceCalendar(self.get_service_period_list(), base_date)
+
+    def get_departure_board(self):
+        """Return a DepartureBoard of this schedule.
+
+        The board is built on the first call and cached. Call
+        reset_departure_board after changing the schedule."""
+        if self._departure_board is None:
+            self._departure_board = DepartureBoard(self)
+        return self._departure_board
+
+    def reset_departure_board(self):
+        """Drop the cached DepartureBoard so the next call of
+        get_departure_board builds a new one."""
+        self._departure_board = None
+
+    def batch_update(self):
+        """Return a ScheduleUpdate to change many stops, trips, stop_times and
+        service dates of this schedule in one transaction. The cached
+        DepartureBoard is updated instead of reset.
+
+          with schedule.batch_update() as update:
+            update.set_stop_times(trip_id, stop_times)
+        """
+        return ScheduleUpdate(self)
+
     def generate_date_trips_departures_list(self, date_start, date_end):
         """Return a list of (date object, number of trips, number of departures).
 
@@ -779,10 +1197,8 @@ class Schedule:
         service_id_to_trips = defaultdict(lambda: 0)
         service_id_to_departures = defaultdict(lambda: 0)
         for trip in self.get_trip_list():
-            headway_start_times = trip.get_frequency_start_times()
-            if headway_start_times:
-                trip_runs = len(headway_start_times)
-            else:
+            trip_runs = trip.get_frequency_run_count()
+            if not trip_runs:
                 trip_runs = 1
 
             service_id_to_trips[trip.service_id] += trip_runs
@@ -0,0 +1,361 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Apply many changes to a loaded Schedule at once.
+
+The changes to stops, trips, stop_times and service dates are collected and
+applied together: the stop_times table is changed with one executemany per
+kind of statement inside a single savepoint, and the objects of the schedule
+and its cached DepartureBoard are only updated where the changes touch them.
+"""
+
+from . import problems as problems_module
+from .util import defaultdict
+
+
+class ScheduleUpdate:
+    """A batch of changes to a Schedule, returned by Schedule.batch_update.
+
+    Each change is checked against the schedule and the earlier changes of the
+    batch when it is made, but the schedule isn't changed until commit is
+    called, which happens when the with block is left without an exception:
+
+      with schedule.batch_update() as update:
+        update.remove_trip('t1')
+        update.set_stop_times('t2', stop_times)
+
+    If the with block raises an exception the changes are dropped. If the
+    changes leave stop_times, child stops or transfers of a removed stop,
+    commit raises an Error and neither the table nor the objects are
+    changed.
+    """
+
+    def __init__(self, schedule):
+        self._schedule = schedule
+        # Maps from id to the new object, or None for removed objects
+        self._stops = {}
+        self._trips = {}
+        # trip_ids whose stop_times are all deleted
+        self._cleared_trip_ids = set()
+        # Map from trip_id to the set of stop_sequence of deleted stop_times
+        self._deleted_stop_times = defaultdict(set)
+        # Map from trip_id to a dict mapping stop_sequence to the row to insert
+        self._inserted_stop_times = defaultdict(dict)
+        # List of (service_id, date, has_service), with has_service None to
+        # reset the date to normal service
+        self._date_changes = []
+        self._committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def _get_stop(self, stop_id):
+        if stop_id in self._stops:
+            return self._stops[stop_id]
+        return self._schedule.stops.get(stop_id)
+
+    def _get_trip(self, trip_id):
+        if trip_id in self._trips:
+            return self._trips[trip_id]
+        return self._schedule.trips.get(trip_id)
+
+    def _check_stop(self, stop_id, exists=True):
+        if (self._get_stop(stop_id) is not None) != exists:
+            raise problems_module.Error('Stop "%s" %s' % (
+                stop_id, exists and "doesn't exist" or 'already exists'))
+
+    def _check_trip(self, trip_id, exists=True):
+        if (self._get_trip(trip_id) is not None) != exists:
+            raise problems_module.Error('Trip "%s" %s' % (
+                trip_id, exists and "doesn't exist" or 'already exists'))
+
+    def add_stop(self, stop):
+        """Add a Stop object with a new stop_id."""
+        self._check_stop(stop.stop_id, exists=False)
+        self._stops[stop.stop_id] = stop
+
+    def replace_stop(self, stop):
+        """Replace the stop with the stop_id of a Stop object by the object."""
+        self._check_stop(stop.stop_id)
+        self._stops[stop.stop_id] = stop
+
+    def remove_stop(self, stop_id):
+        """Remove a stop. Its stop_times and the stops whose parent_station it
+        is must be removed or replaced by the same update, and no transfer may
+        be from or to it."""
+        self._check_stop(stop_id)
+        self._stops[stop_id] = None
+
+    def add_trip(self, trip, stop_times=None):
+        """Add a Trip object with a new trip_id to its route.
+
+        Args:
+          trip: a Trip object which isn't in a schedule
+          stop_times: None or the StopTime objects of the trip, see
+              set_stop_times
+        """
+        self._check_trip(trip.trip_id, exists=False)
+        if trip.route_id not in self._schedule.routes:
+            raise problems_module.Error('Route "%s" of trip "%s" doesn\'t exist' %
+                                        (trip.route_id, trip.trip_id))
+        self._trips[trip.trip_id] = trip
+        if stop_times is not None:
+            self.set_stop_times(trip.trip_id, stop_times)
+
+    def replace_trip(self, trip):
+        """Replace the trip with the trip_id of a Trip object by the object.
+        The stop_times of the trip are kept."""
+        self._check_trip(trip.trip_id)
+        if trip.route_id not in self._schedule.routes:
+            raise problems_module.Error('Route "%s" of trip "%s" doesn\'t exist' %
+                                        (trip.route_id, trip.trip_id))
+        self._trips[trip.trip_id] = trip
+
+    def remove_trip(self, trip_id):
+        """Remove a trip and its stop_times."""
+        self._check_trip(trip_id)
+        self._trips[trip_id] = None
+        self._clear_stop_times(trip_id)
+
+    def _clear_stop_times(self, trip_id):
+        self._cleared_trip_ids.add(trip_id)
+        self._deleted_stop_times.pop(trip_id, None)
+        self._inserted_stop_times.pop(trip_id, None)
+
+    def _get_stop_time_row(self, trip_id, stop_time, stop_sequence=None):
+        """Return the stop_times row of a StopTime object, with stop_sequence
+        instead of the one of the object if it isn't None."""
+        self._check_stop(stop_time.stop_id)
+        if stop_sequence is None:
+            stop_sequence = getattr(stop_time, 'stop_sequence', None)
+        if stop_sequence is None:
+            raise problems_module.Error(
+                'StopTime of trip "%s" at stop "%s" has no stop_sequence' %
+                (trip_id, stop_time.stop_id))
+        # Like StopTime.get_sql_values_tuple, which needs the stop_sequence
+        # attribute
+        return tuple(trip_id if name == 'trip_id' else
+                     stop_sequence if name == 'stop_sequence' else
+                     getattr(stop_time, name)
+                     for name in stop_time.SQL_FIELD_NAMES)
+
+    def set_stop_times(self, trip_id, stop_times):
+        """Replace all stop_times of a trip.
+
+        StopTime objects without a stop_sequence are numbered after the
+        previous one, from 1, like Trip.add_stop_time_object does. The objects
+        themselves aren't changed.
+
+        Args:
+          trip_id: the id of the trip
+          stop_times: the StopTime objects of the trip in the order visited
+
+        Raises:
+          Error: two of stop_times have the same stop_sequence
+        """
+        self._check_trip(trip_id)
+        rows = {}
+        stop_sequence = 0
+        for stop_time in stop_times:
+            if getattr(stop_time, 'stop_sequence', None) is None:
+                stop_sequence += 1
+            else:
+                stop_sequence = stop_time.stop_sequence
+            if stop_sequence in rows:
+                raise problems_module.Error(
+                    'Trip "%s" has more than one stop_time with stop_sequence '
+                    '%s' % (trip_id, stop_sequence))
+            rows[stop_sequence] = self._get_stop_time_row(trip_id, stop_time,
+                                                          stop_sequence)
+        self._clear_stop_times(trip_id)
+        self._inserted_stop_times[trip_id] = rows
+
+    def replace_stop_time(self, trip_id, stop_time):
+        """Replace the stop_time of a trip with the stop_sequence of a StopTime
+        object by the object, or add the object if there is no such stop_time.
+
+        Unlike Trip.replace_stop_time_object, the stop_id of the replaced
+        stop_time can be different, so a stop of a trip can be changed.
+        """
+        self._check_trip(trip_id)
+        row = self._get_stop_time_row(trip_id, stop_time)
+        if trip_id not in self._cleared_trip_ids:
+            self._deleted_stop_times[trip_id].add(stop_time.stop_sequence)
+        self._inserted_stop_times[trip_id][stop_time.stop_sequence] = row
+
+    def remove_stop_time(self, trip_id, stop_sequence):
+        """Remove the stop_time of a trip with stop_sequence, if there is one."""
+        self._check_trip(trip_id)
+        if trip_id not in self._cleared_trip_ids:
+            self._deleted_stop_times[trip_id].add(stop_sequence)
+        self._inserted_stop_times.get(trip_id, {}).pop(stop_sequence, None)
+
+    def set_date_has_service(self, service_id, date, has_service=True):
+        """Add a calendar exception to a service period, like
+        ServicePeriod.set_date_has_service."""
+        if service_id not in self._schedule.service_periods:
+            raise problems_module.Error('Service period "%s" doesn\'t exist' %
+                                        service_id)
+        self._date_changes.append((service_id, date, has_service))
+
+    def reset_date_to_normal_service(self, service_id, date):
+        """Remove a calendar exception of a service period, like
+        ServicePeriod.reset_date_to_normal_service."""
+        if service_id not in self._schedule.service_periods:
+            raise problems_module.Error('Service period "%s" doesn\'t exist' %
+                                        service_id)
+        self._date_changes.append((service_id, date, None))
+
+    def _check_removed_stops(self):
+        removed_stop_ids = set(stop_id for stop_id, stop in self._stops.items()
+                               if stop is None)
+        if not removed_stop_ids:
+            return
+        stops = dict(self._schedule.stops)
+        stops.update(self._stops)
+        for stop in stops.values():
+            if (stop is not None and
+                    getattr(stop, 'parent_station', None) in removed_stop_ids):
+                raise problems_module.Error(
+                    'Removed stop "%s" is still the parent_station of stop "%s"'
+                    % (stop.parent_station, stop.stop_id))
+        for transfer in self._schedule.get_transfer_iter():
+            for stop_id in (transfer.from_stop_id, transfer.to_stop_id):
+                if stop_id in removed_stop_ids:
+                    raise problems_module.Error(
+                        'Removed stop "%s" is still used by a transfer from '
+                        '"%s" to "%s"' % (stop_id, transfer.from_stop_id,
+                                          transfer.to_stop_id))
+
+    def _update_stop_times(self, cursor):
+        stop_time_class = self._schedule._gtfs_factory.StopTime
+        cursor.executemany('DELETE FROM stop_times WHERE trip_id=?',
+                           [(trip_id,) for trip_id in self._cleared_trip_ids])
+        cursor.executemany(
+            'DELETE FROM stop_times WHERE trip_id=? AND stop_sequence=?',
+            [(trip_id, stop_sequence)
+             for trip_id, stop_sequences in self._deleted_stop_times.items()
+             for stop_sequence in stop_sequences])
+        cursor.executemany(
+            'INSERT INTO stop_times (%s) VALUES (%s);' % (
+                ','.join(stop_time_class.SQL_FIELD_NAMES),
+                ','.join(['?'] * len(stop_time_class.SQL_FIELD_NAMES))),
+            [row for rows in self._inserted_stop_times.values()
+             for row in rows.values()])
+        for stop_id, stop in self._stops.items():
+            if stop is not None:
+                continue
+            cursor.execute('SELECT trip_id FROM stop_times WHERE stop_id=? '
+                           'LIMIT 1', (stop_id,))
+            row = cursor.fetchone()
+            if row:
+                raise problems_module.Error(
+                    'Removed stop "%s" is still visited by trip "%s"' %
+                    (stop_id, row[0]))
+
+    def _update_stops(self):
+        schedule = self._schedule
+        zones_changed = False
+        for stop_id, stop in self._stops.items():
+            old_stop = schedule.stops.pop(stop_id, None)
+            if old_stop is not None and getattr(old_stop, 'zone_id', None):
+                zones_changed = True
+            if stop is not None:
+                schedule.add_stop_object(stop)
+        if zones_changed:
+            schedule.fare_zones = dict(
+                (stop.zone_id, True) for stop in schedule.stops.values()
+                if getattr(stop, 'zone_id', None))
+        schedule.mark_table_dirty('stops')
+
+    def _update_trips(self):
+        schedule = self._schedule
+        route_ids = set()
+        for trip_id in self._trips:
+            old_trip = schedule.trips.pop(trip_id, None)
+            if old_trip is not None:
+                route_ids.add(old_trip.route_id)
+        for route_id in route_ids:
+            route = schedule.routes.get(route_id)
+            if route is not None:
+                route._trips = [t for t in route._trips
+                                if t.trip_id not in self._trips]
+        for trip in self._trips.values():
+            if trip is not None:
+                schedule.add_trip_object(trip)
+        schedule.mark_table_dirty('trips')
+        schedule.mark_table_dirty('frequencies')
+
+    def _update_departure_board(self, board, cursor):
+        trip_ids = set(self._trips)
+        trip_ids.update(self._cleared_trip_ids, self._deleted_stop_times,
+                        self._inserted_stop_times)
+        # Times of trips at the stops around a moved stop are interpolated
+        # again
+        for stop_id, stop in self._stops.items():
+            if stop is not None:
+                cursor.execute(
+                    'SELECT DISTINCT trip_id FROM stop_times WHERE stop_id=?',
+                    (stop_id,))
+                trip_ids.update(row[0] for row in cursor)
+        if self._date_changes:
+            board.update_calendar()
+        board.update_trips(trip_ids)
+
+    def commit(self):
+        """Apply the changes to the schedule. Called when the with block is
+        left.
+
+        Raises:
+          Error: the update was already committed, or a removed stop is still
+              visited by a trip, the parent_station of a stop or used by a
+              transfer
+        """
+        if self._committed:
+            raise problems_module.Error('The update was already committed')
+        self._check_removed_stops()
+        schedule = self._schedule
+        cursor = schedule.connection.cursor()
+        # A savepoint, unlike a transaction, doesn't commit or roll back the
+        # changes made to the table before the update
+        cursor.execute('SAVEPOINT schedule_update')
+        try:
+            self._update_stop_times(cursor)
+        except Exception:
+            cursor.execute('ROLLBACK TO schedule_update')
+            cursor.execute('RELEASE schedule_update')
+            raise
+        cursor.execute('RELEASE schedule_update')
+        self._committed = True
+
+        if self._stops:
+            self._update_stops()
+        if self._trips:
+            self._update_trips()
+        if (self._cleared_trip_ids or self._deleted_stop_times or
+                self._inserted_stop_times):
+            schedule.mark_table_dirty('stop_times')
+        for service_id, date, has_service in self._date_changes:
+            period = schedule.service_periods[service_id]
+            if has_service is None:
+                period.reset_date_to_normal_service(date)
+            else:
+                period.set_date_has_service(date, has_service)
+        if schedule._departure_board is not None:
+            self._update_departure_board(schedule._departure_board, cursor)
@@ -0,0 +1,122 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+from . import util
+
+
+class ServiceCalendar:
+    """The active dates of a set of service periods, compiled into bitsets.
+
+    Bit i of the bitset of a service is set if the service is active on the
+    date i days after base_date. Checking a date is then a shift and a mask
+    instead of the string comparisons and date parsing done by
+    ServicePeriod.is_active_on, and the services active on a date are only
+    computed once.
+    """
+
+    def __init__(self, service_periods, base_date=None):
+        """Compile the active dates of service_periods.
+
+        Args:
+          service_periods: an iterable of ServicePeriod objects
+          base_date: a date object. Dates before it are not compiled. Defaults
+              to the earliest date of any of the service periods.
+        """
+        service_periods = list(service_periods)
+        if base_date is None:
+            base_date = self._get_earliest_date(service_periods)
+        self.base_date = base_date
+        self._base_ordinal = base_date.toordinal()
+        self._bitsets = {}
+        for period in service_periods:
+            self._bitsets[period.service_id] = period.get_active_date_bitset(base_date)
+        self._date_service_ids = {}
+
+    @staticmethod
+    def _get_earliest_date(service_periods):
+        earliest = None
+        for period in service_periods:
+            start, _ = period.get_date_range()
+            if start is not None and (earliest is None or start < earliest):
+                earliest = start
+        date_object = earliest and util.date_string_to_date_object(earliest)
+        if date_object is None:
+            return datetime.date.today()
+        return date_object
+
+    def get_date_index(self, date):
+        """Return the bit index of date, a "YYYYMMDD" string or a date object.
+
+        Returns None for dates that can't be parsed."""
+        if isinstance(date, str):
+            date = util.date_string_to_date_object(date)
+            if date is None:
+                return None
+        return date.toordinal() - self._base_ordinal
+
+    def get_date(self, index):
+        """Return the date object of a bit index."""
+        return datetime.date.fromordinal(self._base_ordinal + index)
+
+    def get_service_ids(self):
+        """Return the ids of the compiled service periods."""
+        return list(self._bitsets.keys())
+
+    def get_bitset(self, service_id):
+        """Return the bitset of a service, 0 for an unknown service_id."""
+        return self._bitsets.get(service_id, 0)
+
+    def is_active_on(self, service_id, date):
+        """Test if a service is active on date, a "YYYYMMDD" string or a date
+        object."""
+        index = self.get_date_index(date)
+        if index is None or index < 0:
+            return False
+        return bool(self._bitsets.get(service_id, 0) >> index & 1)
+
+    def get_active_service_ids(self, date):
+        """Return a frozenset of the ids of the services active on date.
+
+        Args:
+          date: a "YYYYMMDD" string or a date object
+
+        Returns:
+          a frozenset of service_id strings
+        """
+        index = self.get_date_index(date)
+        if index is None or index < 0:
+            return frozenset()
+        if index not in self._date_service_ids:
+            self._date_service_ids[index] = frozenset(
+                service_id for service_id, bitset in self._bitsets.items()
+                if bitset >> index & 1)
+        return self._date_service_ids[index]
+
+    def get_active_dates(self, service_id):
+        """Return the dates a service is active as a list of "YYYYMMDD"."""
+        return self.get_bitset_dates(self._bitsets.get(service_id, 0))
+
+    def get_bitset_dates(self, bitset):
+        """Return the dates of the bits set in bitset as a list of "YYYYMMDD".
+
+        Only the set bits are visited, lowest first, so the cost depends on the
+        number of dates and not on the span of the calendar."""
+        dates = []
+        while bitset:
+            lowest = bitset & -bitset
+            dates.append(self.get_date(lowest.bit_length() - 1).strftime("%Y%m%d"))
+            bitset ^= lowest
+        return dates
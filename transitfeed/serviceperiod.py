@@ -141,6 +141,29 @@ class ServicePeriod:
         """Set the last day of service as a string in YYYYMMDD format"""
         self.end_date = end_date
 
+    def clip_dates(self, start=None, end=None):
+        """Remove the dates outside of the range [start, end] from the start and
+        end dates and the exceptions of this service period. If no date of the
+        range between start_date and end_date is left both are set to None.
+
+        Args:
+          start: the first date to keep as a string in YYYYMMDD format, or None
+              to keep the dates before end
+          end: the last date to keep as a string in YYYYMMDD format, or None to
+              keep the dates from start
+        """
+        if self.start_date and self.end_date:
+            if start is not None:
+                self.start_date = max(self.start_date, start)
+            if end is not None:
+                self.end_date = min(self.end_date, end)
+            if self.start_date > self.end_date:
+                self.start_date = self.end_date = None
+        for date in [date for date in self.date_exceptions
+                     if (start is not None and date < start) or
+                     (end is not None and date > end)]:
+            del self.date_exceptions[date]
+
     def set_day_of_week_has_service(self, dow, has_service=True):
         """Set service as running (or not) on a day of the week. By default the
         service does not run on any days.
@@ -228,6 +251,48 @@ class ServicePeriod:
             date_it = date_it + delta
         return dates
 
+    def get_active_date_bitset(self, base_date):
+        """Return the dates this service period is active as an integer bitset.
+
+        Args:
+          base_date: a date object. Dates before it are ignored.
+
+        Returns:
+          an int with bit i set if this service period is active on the date i
+          days after base_date.
+        """
+        base_ordinal = base_date.toordinal()
+        bitset = 0
+        if self.start_date and self.end_date:
+            start_date_object = util.date_string_to_date_object(self.start_date)
+            end_date_object = util.date_string_to_date_object(self.end_date)
+            if start_date_object is not None and end_date_object is not None:
+                first = max(start_date_object.toordinal(), base_ordinal)
+                days = end_date_object.toordinal() + 1 - first
+                if days > 0:
+                    # Repeat the week starting on the first date by doubling
+                    # instead of setting the bits one date at a time.
+                    # date.fromordinal(1) is a Monday
+                    pattern = 0
+                    for i in range(7):
+                        if self.day_of_week[(first - 1 + i) % 7]:
+                            pattern |= 1 << i
+                    length = 7
+                    while length < days:
+                        pattern |= pattern << length
+                        length *= 2
+                    pattern &= (1 << days) - 1
+                    bitset = pattern << (first - base_ordinal)
+        for date, (exception_type, _) in self.date_exceptions.items():
+            date_object = util.date_string_to_date_object(date)
+            if date_object is None or date_object < base_date:
+                continue
+            if exception_type == self._EXCEPTION_TYPE_ADD:
+                bitset |= 1 << (date_object.toordinal() - base_ordinal)
+            else:
+                bitset &= ~(1 << (date_object.toordinal() - base_ordinal))
+        return bitset
+
     def __getattr__(self, name):
         try:
             # Return 1 if value in day_of_week is True, 0 otherwise
@@ -12,7 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import array
 import bisect
+import copy
+import hashlib
+import itertools
 
 from .gtfsfactoryuser import GtfsFactoryUser
 from . import problems as problems_module
@@ -32,18 +36,30 @@ class Shape(GtfsFactoryUser):
     DEPRECATED_FIELD_NAMES = []
 
     def __init__(self, shape_id):
-        # List of shape point tuple (lat, lng, shape_dist_traveled), where lat and
-        # lon is the location of the shape point, and shape_dist_traveled is an
-        # increasing metric representing the distance traveled along the shape.
-        self.points = []
         # An ID that uniquely identifies a shape in the dataset.
         self.shape_id = shape_id
         # The max shape_dist_traveled of shape points in this shape.
         self.max_distance = 0
-        # List of shape_dist_traveled of each shape point.
-        self.distance = []
-        # List of shape_pt_sequence of each shape point.
-        self.sequence = []
+        # The points are kept in arrays of machine values, which take a fraction
+        # of the memory of a tuple of Python objects per point. See points.
+        self._lats = array.array('d')
+        self._lons = array.array('d')
+        # Array of shape_dist_traveled of each shape point, NaN if it is missing.
+        self.distance = array.array('d')
+        # Array of shape_pt_sequence of each shape point.
+        self.sequence = array.array('q')
+
+    @property
+    def points(self):
+        """List of shape point tuples (lat, lng, shape_dist_traveled), where lat
+        and lng is the location of the shape point, and shape_dist_traveled is an
+        increasing metric representing the distance traveled along the shape or
+        None. The list is built from the arrays of the shape on each access."""
+        return list(zip(self._lats, self._lons, self._get_distances()))
+
+    def _get_distances(self):
+        # NaN is the only value that isn't equal to itself
+        return [None if d != d else d for d in self.distance]
 
     def add_point(self, lat, lon, distance=None, problems=problems_module.default_problem_reporter):
         shapepoint_class = self.get_gtfs_factory().ShapePoint
@@ -62,7 +78,11 @@ class Shape(GtfsFactoryUser):
         else:
             index = bisect.bisect(self.sequence, shapepoint.shape_pt_sequence)
 
-        if shapepoint.shape_pt_sequence in self.sequence:
+        # The sequence is sorted, so an equal sequence number is next to index
+        if ((index > 0 and
+             self.sequence[index - 1] == shapepoint.shape_pt_sequence) or
+                (index < len(self.sequence) and
+                 self.sequence[index] == shapepoint.shape_pt_sequence)):
             problems.invalid_value('shape_pt_sequence', shapepoint.shape_pt_sequence,
                                    'The sequence number %d occurs more than once in '
                                    'shape %s.' %
@@ -91,13 +111,66 @@ class Shape(GtfsFactoryUser):
             self.max_distance = shapepoint.shape_dist_traveled
 
         self.sequence.insert(index, shapepoint.shape_pt_sequence)
-        self.distance.insert(index, shapepoint.shape_dist_traveled)
-        self.points.insert(index, (shapepoint.shape_pt_lat,
-                                   shapepoint.shape_pt_lon,
-                                   shapepoint.shape_dist_traveled))
+        if shapepoint.shape_dist_traveled is None:
+            self.distance.insert(index, float('nan'))
+        else:
+            self.distance.insert(index, shapepoint.shape_dist_traveled)
+        self._lats.insert(index, shapepoint.shape_pt_lat)
+        self._lons.insert(index, shapepoint.shape_pt_lon)
 
     def clear_points(self):
-        self.points = []
+        self.max_distance = 0
+        del self._lats[:]
+        del self._lons[:]
+        del self.distance[:]
+        del self.sequence[:]
+
+    def copy(self):
+        """Return a copy of this shape with its own arrays of points."""
+        shape = copy.copy(self)
+        shape._lats = array.array('d', self._lats)
+        shape._lons = array.array('d', self._lons)
+        shape.distance = array.array('d', self.distance)
+        shape.sequence = array.array('q', self.sequence)
+        return shape
+
+    def get_fingerprint(self, precision=5):
+        """Return a hash of the geometry of this shape.
+
+        Each coordinate and distance is scaled by 10 ** precision and rounded
+        to an integer, so shapes whose points are all within the rounding of
+        each other get the same fingerprint. Points close to a rounding boundary
+        can still round apart. The distances are part of the geometry since the
+        shape_dist_traveled of stop_times refer to them.
+
+        Args:
+          precision: the number of decimals of the coordinates and distances
+              which are compared. 5 decimals of a degree are about a metre.
+
+        Returns:
+          a bytes digest
+        """
+        scale = float(10 ** precision)
+        digest = hashlib.sha1()
+        for values in (self._lats, self._lons, self.distance):
+            # NaN, for a missing distance, can't be rounded
+            digest.update(array.array(
+                'q', [round(v * scale) if v == v else -1
+                      for v in values]).tobytes())
+        return digest.digest()
+
+    def generate_field_values_tuples(self):
+        """Generate a tuple of FIELD_NAMES values for each point of this shape,
+        with shape_pt_sequence numbered from 1. The values are read straight
+        from the arrays and floats are written by repr, which round-trips
+        them exactly."""
+        return zip(itertools.repeat(self.shape_id), self._lats, self._lons,
+                   itertools.count(1), self._get_distances())
+
+    def _get_point(self, index):
+        distance = self.distance[index]
+        return (self._lats[index], self._lons[index],
+                None if distance != distance else distance)
 
     def __eq__(self, other):
         if not other:
@@ -106,7 +179,12 @@ class Shape(GtfsFactoryUser):
         if id(self) == id(other):
             return True
 
-        return self.points == other.points
+        if self._lats != other._lats or self._lons != other._lons:
+            return False
+        # Missing distances are NaN, which isn't equal to itself
+        return len(self.distance) == len(other.distance) and all(
+            d1 == d2 or (d1 != d1 and d2 != d2)
+            for d1, d2 in zip(self.distance, other.distance))
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -119,7 +197,7 @@ class Shape(GtfsFactoryUser):
             problems.missing_value('shape_id')
 
     def validate_shape_points(self, problems):
-        if not self.points:
+        if not self.sequence:
             problems.other_problem('The shape with shape_id "%s" contains no points.' %
                                    self.shape_id, problem_type=problems_module.TYPE_WARNING)
 
@@ -142,13 +220,13 @@ class Shape(GtfsFactoryUser):
         if not self.distance:
             return None
         if shape_dist_traveled <= self.distance[0]:
-            return self.points[0]
+            return self._get_point(0)
         if shape_dist_traveled >= self.distance[-1]:
-            return self.points[-1]
+            return self._get_point(-1)
 
         index = bisect.bisect(self.distance, shape_dist_traveled)
-        (lat0, lng0, dist0) = self.points[index - 1]
-        (lat1, lng1, dist1) = self.points[index]
+        (lat0, lng0, dist0) = self._get_point(index - 1)
+        (lat1, lng1, dist1) = self._get_point(index)
 
         # Interpolate if shape_dist_traveled does not equal to any of the point
         # in shape segment.
@@ -0,0 +1,130 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Find the shapes of a feed with the same geometry and keep one of each.
+
+Two shapes have the same geometry if they have the same number of points and
+each coordinate and distance of one is within 10 ** -precision of the other.
+Shapes are only compared with the shapes whose first point is in a neighbouring
+cell of a grid of that size, so finding the duplicates among n shapes doesn't
+compare every pair.
+"""
+
+import itertools
+import math
+
+
+def _get_cell(shape, scale):
+    """Return the number of points of shape and the cell of its first point in
+    a grid with scale cells per degree."""
+    if not shape.sequence:
+        return 0,
+    lat, lon, _ = shape._get_point(0)
+    return len(shape.sequence), math.floor(lat * scale), math.floor(lon * scale)
+
+
+def _get_neighbour_cells(cell):
+    """Return the cells of _get_cell which can have the first point of a shape
+    within a cell size of the first point of a shape in cell."""
+    if len(cell) == 1:
+        return [cell]
+    count, lat, lon = cell
+    return [(count, lat + i, lon + j)
+            for i, j in itertools.product((-1, 0, 1), repeat=2)]
+
+
+def _is_same_geometry(shape, other, tolerance):
+    """Return True if each coordinate and distance of shape is within tolerance
+    of the one of other, which has the same number of points."""
+    # Shapes which differ usually do at their ends
+    indexes = (-1,) if shape.sequence else ()
+    for values, other_values in ((shape._lats, other._lats),
+                                 (shape._lons, other._lons),
+                                 (shape.distance, other.distance)):
+        for value, other_value in itertools.chain(
+                ((values[i], other_values[i]) for i in indexes),
+                zip(values, other_values)):
+            # NaN, for a missing distance, only matches NaN
+            if (not abs(value - other_value) <= tolerance and
+                    (value == value or other_value == other_value)):
+                return False
+    return True
+
+
+def group_duplicate_shapes(shapes, precision=5):
+    """Group shapes with the same geometry.
+
+    Each shape is compared with the first shape of the groups found so far
+    whose first point is within a cell of its own. It joins the first group
+    that has the same geometry, or starts a new one. Shapes which are within
+    the tolerance of each other are grouped even if their coordinates would
+    round to different values.
+
+    Args:
+      shapes: a sequence of Shape objects
+      precision: the number of decimals of the coordinates and distances which
+          are compared. A coordinate or distance of a shape may differ by up to
+          10 ** -precision from the one of the first shape of its group.
+
+    Returns:
+      a list of lists of indexes into shapes, one list for each geometry with
+      more than one shape. The indexes of a list and the lists are in the order
+      of shapes.
+    """
+    scale = float(10 ** precision)
+    tolerance = 1 / scale
+    # Map from a cell to the index of the first shape of each group whose first
+    # point is in it
+    cells = {}
+    groups = {}
+    for index, shape in enumerate(shapes):
+        cell = _get_cell(shape, scale)
+        first_indexes = sorted(itertools.chain.from_iterable(
+            cells.get(c, ()) for c in _get_neighbour_cells(cell)))
+        for first_index in first_indexes:
+            if _is_same_geometry(shape, shapes[first_index], tolerance):
+                groups[first_index].append(index)
+                break
+        else:
+            cells.setdefault(cell, []).append(index)
+            groups[index] = [index]
+    return sorted(group for group in groups.values() if len(group) > 1)
+
+
+def dedup_shapes(schedule, precision=5):
+    """Remove the shapes of schedule which have the same geometry as another
+    one and point their trips at the shape which is kept, the first of each
+    geometry in the order of the schedule.
+
+    Args:
+      schedule: the Schedule to change
+      precision: the number of decimals of the coordinates and distances which
+          are compared, see group_duplicate_shapes
+
+    Returns:
+      a dict of the removed shape_ids to the shape_id which replaces them
+    """
+    shapes = list(schedule.get_shape_list())
+    replaced_ids = {}
+    for group in group_duplicate_shapes(shapes, precision):
+        kept_id = shapes[group[0]].shape_id
+        for index in group[1:]:
+            replaced_ids[shapes[index].shape_id] = kept_id
+    for trip in schedule.get_trip_list():
+        shape_id = getattr(trip, 'shape_id', None)
+        if shape_id in replaced_ids:
+            trip.shape_id = replaced_ids[shape_id]
+    for shape_id in replaced_ids:
+        schedule.remove_shape(shape_id)
+    return replaced_ids
@@ -0,0 +1,77 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+from . import util
+
+# Length of a degree of latitude in meters, on the sphere used by
+# util.approximate_distance
+_METERS_PER_DEGREE = util.EARTH_RADIUS * math.pi / 180
+
+
+class GridIndex:
+    """A grid of latitude and longitude cells for finding nearby points.
+
+    Points are put in square cells of cell_size meters (measured along a
+    meridian), so finding the points within a radius only looks at the cells
+    the radius overlaps instead of at every point. Like
+    Schedule.get_stops_in_bounding_box it does not handle the 180th meridian.
+    """
+
+    def __init__(self, cell_size=500.0):
+        """Create an empty index.
+
+        Args:
+          cell_size: size of a cell in meters. Queries are fastest when the
+              radius searched is about the size of a cell.
+        """
+        self._cell_degrees = cell_size / _METERS_PER_DEGREE
+        self._cells = {}
+
+    def _get_cell(self, lat, lon):
+        return (int(math.floor(lat / self._cell_degrees)),
+                int(math.floor(lon / self._cell_degrees)))
+
+    def add(self, lat, lon, item):
+        """Add item at (lat, lon) to the index."""
+        self._cells.setdefault(self._get_cell(lat, lon), []).append((lat, lon, item))
+
+    def add_stops(self, stops):
+        """Add Stop objects that have a location, each as its own item."""
+        for stop in stops:
+            if stop.stop_lat is not None and stop.stop_lon is not None:
+                self.add(stop.stop_lat, stop.stop_lon, stop)
+
+    def get_nearby(self, lat, lon, radius):
+        """Return the items within radius meters of (lat, lon).
+
+        Returns:
+          a list of (distance in meters, item) tuples sorted by distance
+        """
+        lat_cells = int(math.ceil(radius / _METERS_PER_DEGREE / self._cell_degrees))
+        cos_lat = math.cos(math.radians(min(abs(lat), 89.0)))
+        lon_cells = int(math.ceil(radius / (_METERS_PER_DEGREE * cos_lat) /
+                                  self._cell_degrees))
+        center_lat_cell, center_lon_cell = self._get_cell(lat, lon)
+        nearby = []
+        for lat_cell in range(center_lat_cell - lat_cells, center_lat_cell + lat_cells + 1):
+            for lon_cell in range(center_lon_cell - lon_cells,
+                                  center_lon_cell + lon_cells + 1):
+                for point_lat, point_lon, item in self._cells.get((lat_cell, lon_cell), ()):
+                    distance = util.approximate_distance(lat, lon, point_lat, point_lon)
+                    if distance <= radius:
+                        nearby.append((distance, item))
+        nearby.sort(key=lambda x: x[0])
+        return nearby
@@ -0,0 +1,305 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Export a Schedule to a SQLite database and load it back.
+
+The database has one table for each GTFS file with the same column names,
+except that times in stop_times and frequencies are integer seconds since
+midnight in columns named like arrival_secs. Numeric columns have REAL or
+INTEGER types, empty values are NULL and ids are primary keys or indexed,
+so the database can be queried directly, for example with misc/sql_loop.py.
+"""
+
+import itertools
+import os
+import sqlite3 as sqlite
+
+from . import gtfsfactoryuser
+from . import problems as problems_module
+
+# Types of the columns that aren't TEXT
+_COLUMN_TYPES = {
+    'stop_lat': 'REAL',
+    'stop_lon': 'REAL',
+    'location_type': 'INTEGER',
+    'wheelchair_boarding': 'INTEGER',
+    'route_type': 'INTEGER',
+    'route_sort_order': 'INTEGER',
+    'direction_id': 'INTEGER',
+    'wheelchair_accessible': 'INTEGER',
+    'bikes_allowed': 'INTEGER',
+    'transfer_type': 'INTEGER',
+    'min_transfer_time': 'INTEGER',
+    'price': 'REAL',
+    'payment_method': 'INTEGER',
+    'transfers': 'INTEGER',
+    'transfer_duration': 'INTEGER',
+    'monday': 'INTEGER',
+    'tuesday': 'INTEGER',
+    'wednesday': 'INTEGER',
+    'thursday': 'INTEGER',
+    'friday': 'INTEGER',
+    'saturday': 'INTEGER',
+    'sunday': 'INTEGER',
+    'exception_type': 'INTEGER',
+    'shape_pt_lat': 'REAL',
+    'shape_pt_lon': 'REAL',
+    'shape_pt_sequence': 'INTEGER',
+    'shape_dist_traveled': 'REAL',
+    'arrival_secs': 'INTEGER',
+    'departure_secs': 'INTEGER',
+    'stop_sequence': 'INTEGER',
+    'pickup_type': 'INTEGER',
+    'drop_off_type': 'INTEGER',
+    'timepoint': 'INTEGER',
+    'start_secs': 'INTEGER',
+    'end_secs': 'INTEGER',
+    'headway_secs': 'INTEGER',
+    'exact_times': 'INTEGER',
+}
+
+# Map from table name to (primary key columns, list of indexed columns)
+_TABLE_KEYS = {
+    'agency': ((), [('agency_id',)]),
+    'stops': (('stop_id',), [('parent_station',)]),
+    'routes': (('route_id',), [('agency_id',)]),
+    'trips': (('trip_id',), [('route_id',), ('service_id',), ('shape_id',)]),
+    'transfers': ((), [('from_stop_id', 'to_stop_id')]),
+    'feed_info': ((), []),
+    'calendar': (('service_id',), []),
+    'calendar_dates': (('service_id', 'date'), []),
+    'fare_attributes': (('fare_id',), []),
+    'fare_rules': ((), [('fare_id',), ('route_id',)]),
+    'shapes': (('shape_id', 'shape_pt_sequence'), []),
+    'frequencies': ((), [('trip_id',)]),
+    # A schedule can hold stop_times with duplicate stop_sequence values, which
+    # the validator reports, so they aren't a primary key
+    'stop_times': ((), [('trip_id', 'stop_sequence'), ('stop_id',)]),
+}
+
+# Tables of objects with a field_dict argument, in the order they are loaded
+_OBJECT_TABLES = [('agency', 'Agency'), ('stops', 'Stop'), ('routes', 'Route'),
+                  ('transfers', 'Transfer'), ('trips', 'Trip'),
+                  ('fare_attributes', 'FareAttribute'), ('fare_rules', 'FareRule'),
+                  ('feed_info', 'FeedInfo')]
+
+_FREQUENCY_COLUMNS = ['trip_id', 'start_secs', 'end_secs', 'headway_secs',
+                      'exact_times']
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def _create_table(cursor, table, columns, schema='main'):
+    primary_key, indexes = _TABLE_KEYS[table]
+    definitions = ['%s %s' % (_quote(c), _COLUMN_TYPES.get(c, 'TEXT'))
+                   for c in columns]
+    if primary_key:
+        definitions.append('PRIMARY KEY (%s)' % ','.join(map(_quote, primary_key)))
+    cursor.execute('CREATE TABLE %s.%s (%s)' % (schema, table, ','.join(definitions)))
+    for index_columns in indexes:
+        if set(index_columns).issubset(columns):
+            cursor.execute('CREATE INDEX %s.%s ON %s (%s)' % (
+                schema, _quote('%s_%s_index' % (table, '_'.join(index_columns))),
+                table, ','.join(map(_quote, index_columns))))
+
+
+def _insert_rows(cursor, table, columns, rows, schema='main'):
+    cursor.executemany('INSERT INTO %s.%s (%s) VALUES (%s)' % (
+        schema, table, ','.join(map(_quote, columns)), ','.join(['?'] * len(columns))),
+        ([None if value == '' else value for value in row] for row in rows))
+
+
+def _generate_object_values(objects, columns):
+    for o in objects:
+        yield [getattr(o, c, None) for c in columns]
+
+
+def export_sqlite(schedule, path):
+    """Write every table of schedule to a new SQLite database at path.
+
+    An existing file at path is replaced. The tables of objects are inserted
+    with executemany in one transaction and stop_times are copied with a
+    single INSERT ... SELECT from the database of the schedule.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    factory = schedule._gtfs_factory
+    conn = sqlite.connect(path)
+    cursor = conn.cursor()
+    object_lists = {
+        'agency': schedule.get_agency_list(),
+        'stops': schedule.get_stop_list(),
+        'routes': schedule.get_route_list(),
+        'transfers': schedule.get_transfer_list(),
+        'trips': schedule.get_trip_list(),
+        'feed_info': [schedule.feed_info] if schedule.feed_info else [],
+    }
+    for table, objects in object_lists.items():
+        if table not in schedule._table_columns:
+            continue
+        columns = schedule.get_table_columns(table)
+        _create_table(cursor, table, columns)
+        _insert_rows(cursor, table, columns,
+                     _generate_object_values(objects, columns))
+
+    fares = schedule.get_fare_attribute_list()
+    _create_table(cursor, 'fare_attributes', factory.FareAttribute.FIELD_NAMES)
+    _insert_rows(cursor, 'fare_attributes', factory.FareAttribute.FIELD_NAMES,
+                 (f.get_field_values_tuple() for f in fares))
+    _create_table(cursor, 'fare_rules', factory.FareRule.FIELD_NAMES)
+    _insert_rows(cursor, 'fare_rules', factory.FareRule.FIELD_NAMES,
+                 (rule.get_field_values_tuple() for fare in fares
+                  for rule in fare.get_fare_rule_list()))
+
+    periods = schedule.get_service_period_list()
+    service_period_class = factory.ServicePeriod
+    _create_table(cursor, 'calendar', service_period_class.FIELD_NAMES)
+    _insert_rows(cursor, 'calendar', service_period_class.FIELD_NAMES,
+                 filter(None, (p.get_calendar_field_values_tuple() for p in periods)))
+    _create_table(cursor, 'calendar_dates',
+                  service_period_class.FIELD_NAMES_CALENDAR_DATES)
+    _insert_rows(cursor, 'calendar_dates',
+                 service_period_class.FIELD_NAMES_CALENDAR_DATES,
+                 itertools.chain.from_iterable(
+                     p.generate_calendar_dates_field_values_tuples() for p in periods))
+
+    _create_table(cursor, 'shapes', factory.Shape.FIELD_NAMES)
+    _insert_rows(cursor, 'shapes', factory.Shape.FIELD_NAMES,
+                 schedule._generate_shape_rows())
+
+    _create_table(cursor, 'frequencies', _FREQUENCY_COLUMNS)
+    _insert_rows(cursor, 'frequencies', _FREQUENCY_COLUMNS,
+                 ((trip.trip_id,) + headway for trip in schedule.get_trip_list()
+                  for headway in trip.get_frequency_tuples()))
+
+    stop_time_columns = factory.StopTime.SQL_FIELD_NAMES
+    _create_table(cursor, 'stop_times', stop_time_columns)
+    conn.commit()
+    conn.close()
+
+    # ATTACH isn't allowed inside a transaction
+    schedule.connection.commit()
+    cursor = schedule.connection.cursor()
+    cursor.execute('ATTACH DATABASE ? AS feed', (path,))
+    try:
+        cursor.execute('INSERT INTO feed.stop_times SELECT %s FROM main.stop_times '
+                       'ORDER BY trip_id,stop_sequence' % ','.join(stop_time_columns))
+        schedule.connection.commit()
+    finally:
+        cursor.execute('DETACH DATABASE feed')
+
+
+def _read_table(cursor, table):
+    """Return (columns, cursor over the rows) of a table of the attached
+    database or None if it doesn't have the table."""
+    cursor.execute("SELECT name FROM feed.sqlite_master WHERE type='table' AND name=?",
+                   (table,))
+    if not cursor.fetchall():
+        return None
+    rows = cursor.execute('SELECT * FROM feed.%s' % table)
+    return [d[0] for d in cursor.description], rows
+
+
+def load_sqlite(path, problems=None, memory_db=True, gtfs_factory=None):
+    """Return a new Schedule read from a database written by export_sqlite.
+
+    The data was validated when it was loaded into the schedule that was
+    exported, so objects are added without validating their fields again and
+    stop_times are copied into the new schedule with a single query.
+
+    Args:
+      path: path of the database
+      problems: a ProblemReporter, by default problems.default_problem_reporter
+      memory_db: passed to the Schedule
+      gtfs_factory: the GtfsFactory whose classes are created
+    """
+    if problems is None:
+        problems = problems_module.default_problem_reporter
+    if gtfs_factory is None:
+        gtfs_factory = gtfsfactoryuser.GtfsFactoryUser().get_gtfs_factory()
+    schedule = gtfs_factory.Schedule(problem_reporter=problems,
+                                     memory_db=memory_db)
+    schedule.connection.commit()
+    cursor = schedule.connection.cursor()
+    cursor.execute('ATTACH DATABASE ? AS feed', (path,))
+    try:
+        _load_service_periods(schedule, cursor, gtfs_factory, problems)
+        _load_shapes(schedule, cursor, gtfs_factory, problems)
+        for table, class_name in _OBJECT_TABLES:
+            table_rows = _read_table(cursor, table)
+            if table_rows is None:
+                continue
+            columns, rows = table_rows
+            object_class = getattr(gtfs_factory, class_name)
+            for row in rows.fetchall():
+                instance = object_class(field_dict=dict(
+                    (c, v) for c, v in zip(columns, row) if v is not None))
+                instance.set_gtfs_factory(gtfs_factory)
+                instance.add_to_schedule(schedule, problems)
+            if table in schedule._table_columns:
+                # Keep columns that are empty in every row
+                schedule.add_table_columns(table, columns)
+
+        table_rows = _read_table(cursor, 'frequencies')
+        if table_rows is not None:
+            for trip_id, start_secs, end_secs, headway_secs, exact_times in \
+                    table_rows[1].fetchall():
+                schedule.get_trip(trip_id).add_frequency(
+                    start_secs, end_secs, headway_secs, exact_times, problems)
+
+        columns = ','.join(gtfs_factory.StopTime.SQL_FIELD_NAMES)
+        cursor.execute('INSERT INTO main.stop_times (%s) SELECT %s FROM feed.stop_times'
+                       % (columns, columns))
+        schedule.connection.commit()
+    finally:
+        cursor.execute('DETACH DATABASE feed')
+    schedule.clear_dirty_tables()
+    return schedule
+
+
+def _load_service_periods(schedule, cursor, gtfs_factory, problems):
+    service_period_class = gtfs_factory.ServicePeriod
+    periods = {}
+    table_rows = _read_table(cursor, 'calendar')
+    if table_rows is not None:
+        columns, rows = table_rows
+        indexes = [columns.index(c) for c in service_period_class.FIELD_NAMES]
+        for row in rows.fetchall():
+            period = service_period_class(field_list=[
+                None if row[i] is None else str(row[i]) for i in indexes])
+            periods[period.service_id] = period
+    table_rows = _read_table(cursor, 'calendar_dates')
+    if table_rows is not None:
+        for service_id, date, exception_type in table_rows[1].fetchall():
+            if service_id not in periods:
+                periods[service_id] = service_period_class(service_id)
+            periods[service_id].set_date_has_service(date, exception_type == 1)
+    for period in periods.values():
+        schedule.add_service_period_object(period, problems)
+
+
+def _load_shapes(schedule, cursor, gtfs_factory, problems):
+    table_rows = _read_table(cursor, 'shapes')
+    if table_rows is None:
+        return
+    cursor.execute('SELECT shape_id,shape_pt_lat,shape_pt_lon,shape_dist_traveled '
+                   'FROM feed.shapes ORDER BY shape_id,shape_pt_sequence')
+    for shape_id, points in itertools.groupby(cursor.fetchall(), lambda row: row[0]):
+        shape = gtfs_factory.Shape(shape_id)
+        shape.set_gtfs_factory(gtfs_factory)
+        for _, lat, lon, distance in points:
+            shape.add_point(lat, lon, distance, problems)
+        schedule.add_shape_object(shape, problems)
@@ -0,0 +1,212 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Extract the part of a Schedule used by a subset of its trips.
+
+The trips are picked with set operations on the ids of the schedule and on
+the stop_times table, and the other entities are the closure of what the
+trips refer to: stops and their parent stations, routes and agencies, shapes,
+service periods, and the fares and transfers between what is kept.
+"""
+
+from . import util
+
+
+def _create_id_table(cursor, table, column, ids):
+    """Create the temporary table table with the values of ids in column."""
+    cursor.execute('DROP TABLE IF EXISTS temp.%s' % table)
+    cursor.execute('CREATE TEMP TABLE %s (%s CHAR(50) PRIMARY KEY)'
+                   % (table, column))
+    cursor.executemany('INSERT INTO temp.%s VALUES (?)' % table,
+                       ((value,) for value in ids))
+
+
+def _get_trip_ids_by_stops(schedule, stop_ids):
+    """Return the set of ids of trips that visit any of stop_ids."""
+    cursor = schedule.connection.cursor()
+    _create_id_table(cursor, 'subset_stops', 'stop_id', stop_ids)
+    try:
+        cursor.execute('SELECT DISTINCT trip_id FROM stop_times WHERE stop_id IN '
+                       '(SELECT stop_id FROM temp.subset_stops)')
+        return set(row[0] for row in cursor)
+    finally:
+        cursor.execute('DROP TABLE IF EXISTS temp.subset_stops')
+
+
+def _get_active_service_ids(schedule, date_range):
+    """Return the set of ids of service periods active on any date of
+    date_range, a tuple of "YYYYMMDD" strings including both ends."""
+    start_date, end_date = (util.date_string_to_date_object(d) for d in date_range)
+    if start_date > end_date:
+        return set()
+    days_mask = (1 << ((end_date - start_date).days + 1)) - 1
+    return set(period.service_id for period in schedule.get_service_period_list()
+               if period.get_active_date_bitset(start_date) & days_mask)
+
+
+def _copy_service_period(factory, original_period):
+    period = factory.ServicePeriod(original_period.service_id)
+    period.day_of_week = list(original_period.day_of_week)
+    period.start_date = original_period.start_date
+    period.end_date = original_period.end_date
+    period.date_exceptions = dict(original_period.date_exceptions)
+    return period
+
+
+def subset_schedule(schedule, route_ids=None, bounding_box=None,
+                    date_range=None, problems=None, memory_db=True):
+    """Return a new Schedule with the trips of schedule that match every given
+    criterion and everything they need.
+
+    The objects of the new schedule are copies and the stop_times of the kept
+    trips are copied with one query and one executemany, without creating a
+    StopTime object for each row. The result can be written with
+    write_google_transit_feed.
+
+    Args:
+      schedule: the Schedule to take the subset of
+      route_ids: keep the trips of these routes
+      bounding_box: a tuple (min_lat, min_lon, max_lat, max_lon). Keep the trips
+          that stop in it at least once. Trips are kept whole, with their stops
+          outside the box.
+      date_range: a tuple of "YYYYMMDD" strings (first date, last date). Keep
+          the trips of service periods active on a date in the range, and
+          remove the other dates from the service periods. No trip is kept if
+          the first date is after the last one.
+      problems: the ProblemReporter of the new schedule, by default that of
+          schedule
+      memory_db: use an in-memory sqlite database for the new schedule
+
+    Returns:
+      a new Schedule
+    """
+    if problems is None:
+        problems = schedule.problem_reporter
+
+    trip_ids = set(schedule.trips)
+    if route_ids is not None:
+        route_ids = set(route_ids)
+        trip_ids &= set(trip_id for trip_id, trip in schedule.trips.items()
+                        if trip.route_id in route_ids)
+    if bounding_box is not None:
+        min_lat, min_lon, max_lat, max_lon = bounding_box
+        # Stops without coordinates, such as generic nodes, are never in the box
+        trip_ids &= _get_trip_ids_by_stops(
+            schedule, [stop.stop_id for stop in schedule.get_stop_list()
+                       if stop.stop_lat is not None and
+                       stop.stop_lon is not None and
+                       min_lat <= stop.stop_lat <= max_lat and
+                       min_lon <= stop.stop_lon <= max_lon])
+    if date_range is not None:
+        service_ids = _get_active_service_ids(schedule, date_range)
+        trip_ids &= set(trip_id for trip_id, trip in schedule.trips.items()
+                        if trip.service_id in service_ids)
+
+    # Keep the order of the original schedule
+    trips = [trip for trip_id, trip in schedule.trips.items() if trip_id in trip_ids]
+    route_ids = set(trip.route_id for trip in trips)
+    routes = [route for route in schedule.get_route_list()
+              if route.route_id in route_ids]
+    service_ids = set(trip.service_id for trip in trips)
+    shape_ids = set(getattr(trip, 'shape_id', None) for trip in trips)
+
+    cursor = schedule.connection.cursor()
+    _create_id_table(cursor, 'subset_trips', 'trip_id', trip_ids)
+    try:
+        subset = _build_subset(schedule, trips, routes, service_ids, shape_ids,
+                               cursor, date_range, problems, memory_db)
+    finally:
+        cursor.execute('DROP TABLE IF EXISTS temp.subset_trips')
+    return subset
+
+
+def _build_subset(schedule, trips, routes, service_ids, shape_ids, cursor,
+                  date_range, problems, memory_db):
+    """Return a new Schedule with copies of trips and what they need. cursor
+    is a cursor of schedule with the ids of trips in temp.subset_trips."""
+    factory = schedule._gtfs_factory
+    route_ids = set(route.route_id for route in routes)
+    cursor.execute('SELECT DISTINCT stop_id FROM stop_times WHERE trip_id IN '
+                   '(SELECT trip_id FROM temp.subset_trips)')
+    stop_ids = set(row[0] for row in cursor)
+    # Add the parent stations, and their parents
+    new_stop_ids = stop_ids
+    while new_stop_ids:
+        new_stop_ids = set(
+            getattr(schedule.stops[stop_id], 'parent_station', None)
+            for stop_id in new_stop_ids if stop_id in schedule.stops)
+        new_stop_ids -= stop_ids | {None, ''}
+        stop_ids |= new_stop_ids
+    stops = [stop for stop in schedule.get_stop_list() if stop.stop_id in stop_ids]
+    zone_ids = set(stop.zone_id for stop in stops
+                   if getattr(stop, 'zone_id', None))
+
+    subset = factory.Schedule(problem_reporter=problems, memory_db=memory_db)
+    agencies = list(schedule.get_agency_list())
+    if len(agencies) > 1:
+        agency_ids = set(route.agency_id for route in routes)
+        agencies = [a for a in agencies if a.agency_id in agency_ids]
+    for agency in agencies:
+        subset.add_agency_object(factory.Agency(field_dict=agency), problems)
+    if schedule.feed_info is not None:
+        subset.add_feed_info_object(
+            factory.FeedInfo(field_dict=schedule.feed_info), problems)
+    for period in schedule.get_service_period_list():
+        if period.service_id in service_ids:
+            period = _copy_service_period(factory, period)
+            if date_range is not None:
+                period.clip_dates(*date_range)
+            subset.add_service_period_object(period, problems, validate=False)
+    for stop in stops:
+        subset.add_stop_object(factory.Stop(field_dict=stop), problems)
+    for route in routes:
+        subset.add_route_object(factory.Route(field_dict=route), problems)
+    for shape in schedule.get_shape_list():
+        if shape.shape_id in shape_ids:
+            subset.add_shape_object(shape.copy(), problems)
+    for trip in trips:
+        new_trip = factory.Trip(field_dict=trip)
+        subset.add_trip_object(new_trip, problems)
+        for start, end, headway, exact_times in trip.get_frequency_tuples():
+            new_trip.add_frequency(start, end, headway, exact_times, problems)
+
+    for fare in schedule.get_fare_attribute_list():
+        rules = [rule for rule in fare.get_fare_rule_list()
+                 if (not rule.route_id or rule.route_id in route_ids) and
+                 all(not zone_id or zone_id in zone_ids for zone_id in
+                     (rule.origin_id, rule.destination_id, rule.contains_id))]
+        if fare.get_fare_rule_list() and not rules:
+            continue
+        subset.add_fare_attribute_object(
+            factory.FareAttribute(field_dict=fare), problems)
+        for rule in rules:
+            subset.add_fare_rule_object(factory.FareRule(field_dict=rule), problems)
+    for transfer in schedule.get_transfer_iter():
+        if transfer.from_stop_id in stop_ids and transfer.to_stop_id in stop_ids:
+            subset.add_transfer_object(factory.Transfer(field_dict=transfer),
+                                       problems)
+
+    # Keep the columns of the original tables, even those empty in the subset
+    for table in list(subset._table_columns):
+        subset.add_table_columns(table, schedule.get_table_columns(table))
+
+    columns = factory.StopTime.SQL_FIELD_NAMES
+    cursor.execute('SELECT %s FROM stop_times WHERE trip_id IN '
+                   '(SELECT trip_id FROM temp.subset_trips)' % ','.join(columns))
+    subset.connection.cursor().executemany(
+        'INSERT INTO stop_times (%s) VALUES (%s)' % (
+            ','.join(columns), ','.join(['?'] * len(columns))),
+        cursor)
+    subset.mark_table_dirty('stop_times')
+    return subset
@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
+import heapq
+import itertools
 import warnings
 
 from .gtfsobjectbase import GtfsObjectBase
@@ -86,6 +89,7 @@ class Trip(GtfsObjectBase):
         cursor = schedule.connection.cursor()
         cursor.execute(
             insert_query, stoptime.get_sql_values_tuple(self.trip_id))
+        schedule.mark_table_dirty('stop_times')
 
     def replace_stop_time_object(self, stoptime, schedule=None):
         """Replace a StopTime object from this trip with the given one.
@@ -224,6 +228,7 @@ class Trip(GtfsObjectBase):
         """
         cursor = self._schedule.connection.cursor()
         cursor.execute('DELETE FROM stop_times WHERE trip_id=?', (self.trip_id,))
+        self._schedule.mark_table_dirty('stop_times')
 
     def get_stop_times(self, problems=None):
         """Return a sorted list of StopTime objects for this trip."""
@@ -263,30 +268,63 @@ class Trip(GtfsObjectBase):
                       "accordingly.", DeprecationWarning)
         return self.get_frequency_stop_times(problems)
 
-    def get_frequency_stop_times(self, problems=None):
-        """Return a list of StopTime objects for each headway-based run.
+    def get_frequency_offsets(self, stoptimes=None):
+        """Return the time offsets of this trip's pattern relative to its start.
+
+        A headway-based run at start time T visits the i-th stop at
+        T + arrival_offsets[i] and leaves it at T + departure_offsets[i], so the
+        runs of a trip are fully described by its start times and these offsets
+        without building any StopTime objects.
+
+        Args:
+          stoptimes: Optional list of StopTime objects of this trip, as returned
+              by get_stop_times. Fetched from the schedule when not given.
 
         Returns:
-          a list of list of StopTime objects. Each list of StopTime objects
-          represents one run. If this trip doesn't have headways returns an empty
-          list.
+          a tuple (arrival_offsets, departure_offsets) of lists of seconds, with
+          None for stops that are not timepoints. Both lists are empty if the
+          trip has no stop times.
+        """
+        if stoptimes is None:
+            stoptimes = self.get_stop_times()
+        if not stoptimes:
+            return [], []
+        first_secs = stoptimes[0].arrival_secs  # first time of the trip
+        arrival_offsets = []
+        departure_offsets = []
+        for st in stoptimes:
+            if st.arrival_secs is not None:
+                arrival_offsets.append(st.arrival_secs - first_secs)
+            else:
+                arrival_offsets.append(None)
+            if st.departure_secs is not None:
+                departure_offsets.append(st.departure_secs - first_secs)
+            else:
+                departure_offsets.append(None)
+        return arrival_offsets, departure_offsets
+
+    def iter_frequency_stop_times(self, problems=None):
+        """Generator of a list of StopTime objects for each headway-based run.
+
+        Unlike get_frequency_stop_times the runs are built one at a time, so a
+        caller that stops early never pays for the remaining runs.
         """
-        stoptimes_list = []  # list of stoptime lists to be returned
         stoptime_pattern = self.get_stop_times()
-        first_secs = stoptime_pattern[0].arrival_secs  # first time of the trip
+        arrival_offsets, departure_offsets = self.get_frequency_offsets(
+            stoptime_pattern)
         stoptime_class = self.get_gtfs_factory().StopTime
         # for each start time of a headway run
-        for run_secs in self.get_frequency_start_times():
+        for run_secs in self.iter_frequency_start_times():
             # stop time list for a headway run
             stoptimes = []
             # go through the pattern and generate stoptimes
-            for st in stoptime_pattern:
+            for st, arrival_offset, departure_offset in zip(
+                    stoptime_pattern, arrival_offsets, departure_offsets):
                 arrival_secs, departure_secs = None, None  # default value if the stoptime is not timepoint
-                if st.arrival_secs is not None:
-                    arrival_secs = st.arrival_secs - first_secs + run_secs
-                if st.departure_secs is not None:
-                    departure_secs = st.departure_secs - first_secs + run_secs
-                # append stoptime
+                if arrival_offset is not None:
+                    arrival_secs = arrival_offset + run_secs
+                if departure_offset is not None:
+                    departure_secs = departure_offset + run_secs
                 stoptimes.append(stoptime_class(
                     problems=problems, stop=st.stop,
                     arrival_secs=arrival_secs,
@@ -298,9 +336,19 @@ class Trip(GtfsObjectBase):
                     stop_sequence=st.stop_sequence,
                     timepoint=st.timepoint
                 ))
-            # add stoptimes to the stoptimes_list
-            stoptimes_list.append(stoptimes)
-        return stoptimes_list
+            yield stoptimes
+
+    def get_frequency_stop_times(self, problems=None):
+        """Return a list of StopTime objects for each headway-based run.
+
+        Returns:
+          a list of list of StopTime objects. Each list of StopTime objects
+          represents one run. If this trip doesn't have headways returns an empty
+          list.
+        """
+        if not self._headways:
+            return []
+        return list(self.iter_frequency_stop_times(problems))
 
     def get_start_time(self, problems=problems_module.default_problem_reporter):
         """Return the first time of the trip. TODO: For trips defined by frequency
@@ -326,23 +374,58 @@ class Trip(GtfsObjectBase):
                       "accordingly.", DeprecationWarning)
         return self.get_frequency_start_times()
 
+    def iter_frequency_start_times(self):
+        """Generator of the start time of each headway-based run.
+
+        Start times are generated lazily, headway period by headway period, in
+        the same order as get_frequency_start_times returns them."""
+        # for each headway period of the trip
+        for freq_tuple in self.get_frequency_tuples():
+            (start_secs, end_secs, headway_secs) = freq_tuple[0:3]
+            for run_secs in range(start_secs, end_secs, headway_secs):
+                yield run_secs
+
     def get_frequency_start_times(self):
         """Return a list of start time for each headway-based run.
 
         Returns:
           a sorted list of seconds since midnight, the start time of each run. If
           this trip doesn't have headways returns an empty list."""
-        start_times = []
-        # for each headway period of the trip
+        return list(self.iter_frequency_start_times())
+
+    def get_frequency_run_count(self):
+        """Return the number of headway-based runs without expanding them.
+
+        Returns:
+          the number of runs, which is 0 if this trip doesn't have headways."""
+        count = 0
         for freq_tuple in self.get_frequency_tuples():
             (start_secs, end_secs, headway_secs) = freq_tuple[0:3]
-            # reset run secs to the start of the timeframe
-            run_secs = start_secs
-            while run_secs < end_secs:
-                start_times.append(run_secs)
-                # increment current run secs by headway secs
-                run_secs += headway_secs
-        return start_times
+            count += len(range(start_secs, end_secs, headway_secs))
+        return count
+
+    def get_frequency_start_times_after(self, secs, limit=None):
+        """Return the start times of the headway-based runs at or after secs.
+
+        Each headway period is an arithmetic progression of start times, so the
+        first run of a period at or after secs is found by bisecting the period
+        instead of expanding it. The periods are then merged in time order.
+
+        Args:
+          secs: seconds since midnight
+          limit: the maximum number of start times to return, or None for all
+
+        Returns:
+          a sorted list of seconds since midnight. If this trip doesn't have
+          headways returns an empty list."""
+        remaining_runs = []
+        for freq_tuple in self.get_frequency_tuples():
+            (start_secs, end_secs, headway_secs) = freq_tuple[0:3]
+            runs = range(start_secs, end_secs, headway_secs)
+            runs = runs[bisect.bisect_left(runs, secs):]
+            if runs:
+                remaining_runs.append(runs)
+        return list(itertools.islice(heapq.merge(*remaining_runs), limit))
 
     def get_end_time(self, problems=problems_module.default_problem_reporter):
         """Return the last time of the trip. TODO: For trips defined by frequency
@@ -473,9 +556,13 @@ class Trip(GtfsObjectBase):
                                           'Should be 0 (no fixed schedule) or 1 (fixed and regular schedule)')
 
         self._headways.append((start_time, end_time, headway_secs, exact_times))
+        if self._schedule:
+            self._schedule.mark_table_dirty('frequencies')
 
     def clear_frequencies(self):
         self._headways = []
+        if self._schedule:
+            self._schedule.mark_table_dirty('frequencies')
 
     def _headway_output_tuple(self, headway):
         return (self.trip_id,
@@ -499,7 +586,9 @@ class Trip(GtfsObjectBase):
             return self._schedule.get_service_period(self.service_id)
         elif name == 'pattern_id':
             if '_pattern_id' not in self.__dict__:
-                self.__dict__['_pattern_id'] = hash(self.get_pattern())
+                # Stops aren't hashable, their ids identify them in a schedule
+                self.__dict__['_pattern_id'] = hash(
+                    tuple(stop.stop_id for stop in self.get_pattern()))
             return self.__dict__['_pattern_id']
         else:
             return GtfsObjectBase.__getattr__(self, name)
@@ -768,4 +857,4 @@ class Trip(GtfsObjectBase):
 
 
 def sort_list_of_trip_by_time(trips):
-    trips.sort(key="GetStartTime")
+    trips.sort(key=lambda trip: trip.get_start_time())
@@ -15,6 +15,7 @@
 import codecs
 import csv
 import datetime
+import functools
 import math
 import optparse
 import random
@@ -435,15 +436,26 @@ def time_to_seconds_since_midnight(time_string):
     return int(m.group(1)) * 3600 + int(m.group(2)) * 60 + int(m.group(3))
 
 
+# Lookup tables for format_seconds_since_midnight, which is called for every
+# time written to stop_times.txt
+_HOUR_PREFIXES = ['%02d:' % h for h in range(100)]
+_MINUTE_SECOND_SUFFIXES = ['%02d:%02d' % divmod(s, 60) for s in range(3600)]
+
+
 def format_seconds_since_midnight(s):
     """Formats an int number of seconds past midnight into a string
     as "HH:MM:SS"."""
+    if type(s) is int and 0 <= s < 360000:
+        hours, rest = divmod(s, 3600)
+        return _HOUR_PREFIXES[hours] + _MINUTE_SECOND_SUFFIXES[rest]
     return "%02d:%02d:%02d" % (s / 3600, (s / 60) % 60, s % 60)
 
 
+@functools.lru_cache(maxsize=65536)
 def date_string_to_date_object(date_string):
     """Return a date object for a string "YYYYMMDD"."""
-    # If this becomes a bottleneck date objects could be cached
+    # Date objects are immutable so they are cached, a feed has few distinct
+    # dates and they are parsed again for every service period
     if re.match('^\\d{8}$', date_string) is None:
         return None
     try:
@@ -516,35 +528,76 @@ def approximate_distance_between_stops(stop1, stop2):
                                 stop2.stop_lat, stop2.stop_lon)
 
 
+def interpolate_times(times, stops):
+    """Estimate the times of untimed stops of a trip using distance.
+
+    This is the row based equivalent of Trip.get_time_interpolated_stops, for
+    code that reads the stop_times table directly.
+
+    Args:
+      times: a list of (arrival_secs, departure_secs) tuples of a trip, sorted
+          by stop_sequence. Both are None for an untimed stop.
+      stops: a list of the Stop objects visited, in the same order
+
+    Returns:
+      a list of (arrival_secs, departure_secs, is_timepoint) tuples. A missing
+      arrival or departure of a timed stop is copied from the other one. If the
+      first or last stop has no time the untimed stops keep times of None.
+    """
+    result = []
+    for arrival_secs, departure_secs in times:
+        if arrival_secs is None:
+            arrival_secs = departure_secs
+        elif departure_secs is None:
+            departure_secs = arrival_secs
+        result.append((arrival_secs, departure_secs, arrival_secs is not None))
+    if not result or result[0][0] is None or result[-1][0] is None:
+        return result
+
+    cur_index = 0
+    for next_index in range(1, len(result)):
+        if not result[next_index][2]:
+            continue
+        if next_index - cur_index > 1:
+            distances = [0]
+            for i in range(cur_index + 1, next_index + 1):
+                distances.append(distances[-1] + (
+                    approximate_distance_between_stops(stops[i - 1], stops[i]) or 0))
+            cur_secs = result[cur_index][0]
+            total_time = result[next_index][0] - cur_secs
+            for i in range(cur_index + 1, next_index):
+                if distances[-1]:
+                    distance_percent = distances[i - cur_index] / distances[-1]
+                else:
+                    distance_percent = (i - cur_index) / (next_index - cur_index)
+                secs = int(round(distance_percent * total_time + cur_secs))
+                result[i] = (secs, secs, False)
+        cur_index = next_index
+    return result
+
+
 class CsvUnicodeWriter:
     """
-    Create a wrapper around a csv writer object which can safely write unicode
-    values. Passes all arguments to csv.writer.
+    Create a wrapper around a csv writer object which writes str values as
+    they are. Passes all arguments to csv.writer, so the file must be opened
+    in text mode with newline=''. Encoding the output is left to the file.
     """
 
     def __init__(self, *args, **kwargs):
         self.writer = csv.writer(*args, **kwargs)
 
     def writerow(self, row):
-        """Write row to the csv file. Any unicode strings in row are encoded as
-        utf-8."""
-        encoded_row = []
-        for s in row:
-            if isinstance(s, str):
-                encoded_row.append(s.encode("utf-8"))
-            else:
-                encoded_row.append(s)
+        """Write row to the csv file."""
         try:
-            self.writer.writerow(encoded_row)
+            self.writer.writerow(row)
         except Exception as e:
-            print('error writing %s as %s' % (row, encoded_row))
+            print('error writing %s' % (row,))
             raise e
 
     def writerows(self, rows):
-        """Write rows to the csv file. Any unicode strings in rows are encoded as
-        utf-8."""
-        for row in rows:
-            self.writerow(row)
+        """Write rows to the csv file. The rows are handed to csv.writer in
+        one call, without looking at each value in Python."""
+        self.writer.writerows(rows)
 
     def __getattr__(self, name):
         return getattr(self.writer, name)
@@ -0,0 +1,363 @@
+# Copyright (C) 2007 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Write zip files whose members can be added already compressed.
+
+zipfile.ZipFile can only add a member by compressing its data itself. A
+ZipWriter also adds members from DEFLATE data compressed elsewhere, such as
+chunks compressed by a pool of threads or a member of another zip file, so
+the feed writer doesn't recompress them. Only the record layouts of the zip
+format are used, not the internals of zipfile.
+"""
+
+import io
+import struct
+import zipfile
+import zlib
+
+# Records of the zip format, see
+# https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT
+_LOCAL_FILE_HEADER = struct.Struct('<4s2B4HL2L2H')
+_LOCAL_FILE_HEADER_SIGNATURE = b'PK\003\004'
+_CENTRAL_DIRECTORY_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+_CENTRAL_DIRECTORY_HEADER_SIGNATURE = b'PK\001\002'
+_DATA_DESCRIPTOR = struct.Struct('<4sL2Q')
+_DATA_DESCRIPTOR_SIGNATURE = b'PK\007\010'
+_ZIP64_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sQ2H2L4Q')
+_ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE = b'PK\006\006'
+_ZIP64_END_LOCATOR = struct.Struct('<4sLQL')
+_ZIP64_END_LOCATOR_SIGNATURE = b'PK\006\007'
+_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4s4H2LH')
+_END_OF_CENTRAL_DIRECTORY_SIGNATURE = b'PK\005\006'
+_ZIP64_EXTRA_ID = 1
+
+# Larger values are stored in the zip64 records
+_ZIP64_LIMIT = (1 << 32) - 1
+_ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+
+_VERSION_DEFLATED = 20
+_VERSION_ZIP64 = 45
+_SYSTEM_UNIX = 3
+# Sizes and CRC-32 follow the data, in a data descriptor
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+# 1980-01-01 00:00:00, the default date_time of zipfile.ZipInfo
+_DOS_TIME = 0
+_DOS_DATE = (1 << 5) | 1
+# -rw-rw-rw-
+_EXTERNAL_ATTR = 0o100666 << 16
+
+
+class _Member:
+    """The central directory entry of a member written by a ZipWriter."""
+
+    def __init__(self, filename, compress_type, header_offset, flag_bits=0):
+        try:
+            self.filename = filename.encode('ascii')
+        except UnicodeEncodeError:
+            self.filename = filename.encode('utf-8')
+            flag_bits |= _FLAG_UTF8
+        self.flag_bits = flag_bits
+        self.compress_type = compress_type
+        self.header_offset = header_offset
+        # Offset of the compressed data, after the local file header
+        self.data_offset = None
+        self.CRC = 0
+        self.compress_size = 0
+        self.file_size = 0
+
+
+class _MemberWriter(io.RawIOBase):
+    """A writable raw stream which compresses its data into a member of a
+    ZipWriter. The member is finished when the stream is closed."""
+
+    def __init__(self, writer, member, compression_level):
+        io.RawIOBase.__init__(self)
+        self._writer = writer
+        self._member = member
+        if compression_level is None:
+            compression_level = zlib.Z_DEFAULT_COMPRESSION
+        self._compressor = zlib.compressobj(compression_level, zlib.DEFLATED,
+                                            -zlib.MAX_WBITS)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        member = self._member
+        member.file_size += len(data)
+        member.CRC = zlib.crc32(data, member.CRC)
+        self._writer._write(self._compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._writer._write(self._compressor.flush())
+            self._writer._finish_stream(self._member)
+        io.RawIOBase.close(self)
+
+
+class _CompressedMemberWriter:
+    """Adds data that is already compressed to a member of a ZipWriter whose
+    sizes and CRC-32 are only known at the end. See ZipWriter.open_compressed.
+    """
+
+    def __init__(self, writer, member):
+        self._writer = writer
+        self._member = member
+
+    def write(self, data):
+        """Append compressed data to the member."""
+        self._writer._write(data)
+
+    def finish(self, file_size, crc):
+        """Finish the member.
+
+        Args:
+          file_size: the size of the uncompressed data
+          crc: the CRC-32 of the uncompressed data
+        """
+        self._member.file_size = file_size
+        self._member.CRC = crc
+        self._writer._finish_stream(self._member)
+
+
+class ZipWriter:
+    """Write a zip file member by member.
+
+    Members are either compressed by the writer, from a stream returned by
+    open, or added already compressed with write_compressed. Members and the
+    whole file can be larger than 4 GB. The output only needs to be written to
+    in order, so it can be a file-like object that can't seek.
+
+      with ZipWriter(path) as writer:
+        with writer.open('stops.txt') as member:
+          member.write(data)
+    """
+
+    def __init__(self, file):
+        """Create a zip file.
+
+        Args:
+          file: path of the new zip file (a string) or a binary file-like object
+        """
+        if isinstance(file, str):
+            self._file = open(file, 'wb')
+            self._own_file = True
+        else:
+            self._file = file
+            self._own_file = False
+        try:
+            self._offset = self._file.tell()
+        except (AttributeError, OSError):
+            self._offset = 0
+        self._members = []
+        self._open_member = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _write(self, data):
+        self._file.write(data)
+        self._offset += len(data)
+
+    def _start_member(self, member, zip64_sizes):
+        """Write the local file header of member."""
+        if self._open_member is not None:
+            raise ValueError('Member %s is still open' %
+                             self._open_member.filename.decode('utf-8'))
+        if zip64_sizes:
+            extra = struct.pack('<2H2Q', _ZIP64_EXTRA_ID, 16,
+                                member.file_size, member.compress_size)
+            version = _VERSION_ZIP64
+            file_size = compress_size = _ZIP64_LIMIT
+        else:
+            extra = b''
+            version = _VERSION_DEFLATED
+            file_size, compress_size = member.file_size, member.compress_size
+        self._write(_LOCAL_FILE_HEADER.pack(
+            _LOCAL_FILE_HEADER_SIGNATURE, version, 0, member.flag_bits,
+            member.compress_type, _DOS_TIME, _DOS_DATE, member.CRC,
+            compress_size, file_size, len(member.filename), len(extra)))
+        self._write(member.filename)
+        self._write(extra)
+        member.data_offset = self._offset
+        self._members.append(member)
+
+    def open(self, filename, compression_level=None):
+        """Return a writable binary stream that adds a DEFLATE compressed member
+        to the file. Close it before adding the next member.
+
+        Args:
+          filename: the name of the member
+          compression_level: zlib compression level from 0 to 9, or None for the
+              zlib default
+        """
+        return _MemberWriter(self, self._start_stream(filename,
+                                                      zipfile.ZIP_DEFLATED),
+                             compression_level)
+
+    def open_compressed(self, filename, compress_type=zipfile.ZIP_DEFLATED):
+        """Return a writer that adds a member from data compressed elsewhere,
+        before its sizes and CRC-32 are known. Call its finish method with them
+        before adding the next member.
+
+          member = writer.open_compressed('stop_times.txt')
+          member.write(compressed_chunk)
+          member.finish(file_size, crc)
+
+        Args:
+          filename: the name of the member
+          compress_type: the compression method of the data, like
+              zipfile.ZIP_DEFLATED
+        """
+        return _CompressedMemberWriter(self, self._start_stream(filename,
+                                                                compress_type))
+
+    def _start_stream(self, filename, compress_type):
+        """Start a member whose sizes and CRC-32 follow its data."""
+        member = _Member(filename, compress_type, self._offset,
+                         _FLAG_DATA_DESCRIPTOR)
+        # The sizes aren't known yet, so they always have room for 64 bits
+        self._start_member(member, True)
+        self._open_member = member
+        return member
+
+    def _finish_stream(self, member):
+        member.compress_size = self._offset - member.data_offset
+        self._write(_DATA_DESCRIPTOR.pack(
+            _DATA_DESCRIPTOR_SIGNATURE, member.CRC, member.compress_size,
+            member.file_size))
+        self._open_member = None
+
+    def write_compressed(self, filename, chunks, file_size, compress_size, crc,
+                         compress_type=zipfile.ZIP_DEFLATED):
+        """Add a member from data that is already compressed.
+
+        Args:
+          filename: the name of the member
+          chunks: an iterable of bytes that together are the compressed data
+          file_size: the size of the uncompressed data
+          compress_size: the total size of chunks
+          crc: the CRC-32 of the uncompressed data
+          compress_type: the compression method of the data, like
+              zipfile.ZIP_DEFLATED
+        """
+        member = _Member(filename, compress_type, self._offset)
+        member.file_size = file_size
+        member.compress_size = compress_size
+        member.CRC = crc
+        self._start_member(member, file_size > _ZIP64_LIMIT or
+                           compress_size > _ZIP64_LIMIT)
+        written = 0
+        for chunk in chunks:
+            self._write(chunk)
+            written += len(chunk)
+        if written != compress_size:
+            raise ValueError('Member %s has %d bytes of compressed data instead '
+                             'of %d' % (filename, written, compress_size))
+
+    def close(self):
+        """Write the central directory, and close the file if it was opened by
+        this writer."""
+        if self._file is None:
+            return
+        if self._open_member is not None:
+            raise ValueError('Member %s is still open' %
+                             self._open_member.filename.decode('utf-8'))
+        directory_offset = self._offset
+        for member in self._members:
+            self._write_directory_header(member)
+        directory_size = self._offset - directory_offset
+        count = len(self._members)
+        if (count > _ZIP_FILECOUNT_LIMIT or directory_size > _ZIP64_LIMIT or
+                directory_offset > _ZIP64_LIMIT):
+            zip64_offset = self._offset
+            self._write(_ZIP64_END_OF_CENTRAL_DIRECTORY.pack(
+                _ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE,
+                _ZIP64_END_OF_CENTRAL_DIRECTORY.size - 12,
+                (_SYSTEM_UNIX << 8) | _VERSION_ZIP64, _VERSION_ZIP64, 0, 0,
+                count, count, directory_size, directory_offset))
+            self._write(_ZIP64_END_LOCATOR.pack(
+                _ZIP64_END_LOCATOR_SIGNATURE, 0, zip64_offset, 1))
+            count = min(count, _ZIP_FILECOUNT_LIMIT)
+            directory_size = min(directory_size, _ZIP64_LIMIT)
+            directory_offset = min(directory_offset, _ZIP64_LIMIT)
+        self._write(_END_OF_CENTRAL_DIRECTORY.pack(
+            _END_OF_CENTRAL_DIRECTORY_SIGNATURE, 0, 0, count, count,
+            directory_size, directory_offset, 0))
+        self._file.flush()
+        if self._own_file:
+            self._file.close()
+        self._file = None
+
+    def _write_directory_header(self, member):
+        # The zip64 extra field has the values that don't fit, in this order
+        zip64_values = []
+        file_size, compress_size, header_offset = (
+            member.file_size, member.compress_size, member.header_offset)
+        if file_size > _ZIP64_LIMIT:
+            zip64_values.append(file_size)
+            file_size = _ZIP64_LIMIT
+        if compress_size > _ZIP64_LIMIT:
+            zip64_values.append(compress_size)
+            compress_size = _ZIP64_LIMIT
+        if header_offset > _ZIP64_LIMIT:
+            zip64_values.append(header_offset)
+            header_offset = _ZIP64_LIMIT
+        extra = b''
+        version = _VERSION_DEFLATED
+        if zip64_values or member.flag_bits & _FLAG_DATA_DESCRIPTOR:
+            version = _VERSION_ZIP64
+        if zip64_values:
+            extra = struct.pack('<2H%dQ' % len(zip64_values), _ZIP64_EXTRA_ID,
+                                8 * len(zip64_values), *zip64_values)
+        self._write(_CENTRAL_DIRECTORY_HEADER.pack(
+            _CENTRAL_DIRECTORY_HEADER_SIGNATURE, version, _SYSTEM_UNIX,
+            version, 0, member.flag_bits, member.compress_type, _DOS_TIME,
+            _DOS_DATE, member.CRC, compress_size, file_size,
+            len(member.filename), len(extra), 0, 0, 0, _EXTERNAL_ATTR,
+            header_offset))
+        self._write(member.filename)
+        self._write(extra)
+
+
+def generate_raw_member_chunks(file, info, chunk_size):
+    """Generate the compressed data of a member of a zip file in chunks of up to
+    chunk_size bytes.
+
+    Args:
+      file: a binary file object of the zip file, which can seek
+      info: the zipfile.ZipInfo of the member
+      chunk_size: the largest number of bytes of a chunk
+    """
+    file.seek(info.header_offset)
+    header = _LOCAL_FILE_HEADER.unpack(file.read(_LOCAL_FILE_HEADER.size))
+    if header[0] != _LOCAL_FILE_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile('Bad local file header of member %s' %
+                                 info.filename)
+    # Skip the file name and extra field
+    file.seek(header[-2] + header[-1], io.SEEK_CUR)
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = file.read(min(remaining, chunk_size))
+        if not chunk:
+            raise zipfile.BadZipFile('Truncated member %s' % info.filename)
+        remaining -= len(chunk)
+        yield chunk
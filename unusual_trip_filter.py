@@ -29,6 +29,7 @@ import sys
 import time
 import transitfeed
 from transitfeed import util
+import zipfile
 
 
 class UnusualTripFilter(object):
@@ -147,11 +148,14 @@ https://github.com/google/transitfeed/wiki/UnusualTripFilter
   filter.filter(data)
   print('Saving data')
 
-  # Write the result
+  # Write the result, copying the tables other than trips.txt from the input
+  base = None
+  if zipfile.is_zipfile(feed_name):
+    base = feed_name
   if options.output is None:
-    data.write_google_transit_feed(feed_name)
+    data.write_google_transit_feed(feed_name, base=base)
   else:
-    data.write_google_transit_feed(options.output)
+    data.write_google_transit_feed(options.output, base=base)
 
 
 if __name__ == '__main__':